@@ -1,45 +1,78 @@
-import codecs
-import mediafile
+import hashlib
+import json
 import os
 import re
+import sqlite3
+import threading
+import traceback
 import yaml
 from collections import Counter
+from itertools import groupby, islice
+from concurrent.futures import ThreadPoolExecutor
 from beets.plugins import BeetsPlugin
 from beets.dbcore import types
-from beets.dbcore.query import FixedFieldSort
-from beets.library import Item, parse_query_parts
+from beets.dbcore.query import AndQuery, FixedFieldSort, MatchQuery, MultipleSort, NoneQuery, NumericQuery, OrQuery
+from beets.library import Album, Item, parse_query_parts
 from beets.ui import Subcommand, decargs
 from beets import config
 from optparse import OptionParser
-from confuse import ConfigSource, load_yaml
-from beetsplug.lastgenre import LastGenrePlugin
-from beetsplug.xtractor import XtractorCommand
-from beetsplug.autogenre.genretree import GenreTree
-
-# See https://essentia.upf.edu/svm_models/accuracies_v2.1_beta1.html
-ROSAMERICA_GENRES = {
-    'cla': 'classical',
-    'dan': 'dance', # CAUTION: 'dance' is an out-of-tree genre: might be electronic or rock. better set genre of those tracks manually.
-    'hip': 'hip hop',
-    'jaz': 'jazz',
-    'pop': 'pop',
-    'rhy': 'rhythm and blues',
-    'roc': 'rock',
-    'spe': 'speech'
-}
-ELECTRONIC_GENRES = {
-    'ambient': 'ambient',
-    'dnb': 'drum and bass',
-    'house': 'house',
-    'techno': 'techno',
-    'trance': 'trance',
+from confuse import ConfigSource
+from beetsplug.autogenre.albumgenre import ALBUM_IDS_PER_QUERY, album_genre_changes
+from beetsplug.autogenre.artistindex import ArtistGenreIndex
+from beetsplug.autogenre.batch import StoreBatch
+from beetsplug.autogenre.cache import LastfmCache
+from beetsplug.autogenre.checkpoint import Budget, Checkpoints, parse_duration
+from beetsplug.autogenre.contentkey import ContentKeys, DedupMemo
+from beetsplug.autogenre.essentia import EssentiaGenres, FIELDS as ESSENTIA_FIELDS
+from beetsplug.autogenre.genretree import load_genre_tree
+from beetsplug.autogenre.metrics import Metrics, NULL_METRICS, timed
+from beetsplug.autogenre.plan import PlanWriter, parse_shard, read_plans
+from beetsplug.autogenre.query import PRIORITIES, GenreSelectionQuery, PriorityQuery, ShardQuery, filter_item
+from beetsplug.autogenre.workqueue import WorkQueue
+from beetsplug.autogenre.writer import TagWriter
+
+# Number of ids (or album ids) queried at once while iterating the library
+PAGE_SIZE = 1000
+# Max. number of item ids matched by a single query
+ITEM_IDS_PER_QUERY = 500
+# Max. number of memoized content keys and results per group of duplicates
+DEDUP_MEMO_SIZE = 100000
+# Max. size of a chunk of items, as a multiple of the batch size, that is
+# extended in order to analyze as many items at once as there are workers
+MAX_ANALYSIS_CHUNK = 10
+# lastgenre settings the cached last.fm results depend on
+LASTGENRE_CACHE_SCOPE = ('whitelist', 'canonical', 'count', 'min_weight',
+    'prefer_specific', 'title_case', 'separator')
+# autogenre settings an item's genre depends on
+FINGERPRINT_SETTINGS = ('lastgenre', 'xtractor', 'from_title', 'parent_genres',
+    'artist_index', 'artist_index_min_items', 'artist_index_min_share', 'dedup',
+    'genre_rosamerica_strong', 'genre_electronic_strong',
+    'genre_electronic_prepend', 'genre_electronic_append')
+# item fields an item's genre depends on
+FINGERPRINT_FIELDS = ('artist', 'albumartist', 'album', 'title', 'bpm',
+    'genre_rosamerica', 'genre_rosamerica_probability',
+    'genre_electronic', 'genre_electronic_probability')
+# item fields set by the Essentia analysis that autogenre depends on
+ANALYSIS_FIELDS = ('bpm',) + ESSENTIA_FIELDS
+# pylast network methods per lookup entity
+LASTFM_METHODS = {
+    'track': 'get_track',
+    'album': 'get_album',
+    'artist': 'get_artist',
 }
-SOURCES = set(('lastfm', 'title', 'essentia', 'user'))
+
+class EssentiaRequired(Exception):
+    """Raised when an item's genre can only be derived from Essentia's
+    results, which is deferred in order to analyze and map items in bulk."""
+    def __init__(self, source):
+        super(EssentiaRequired, self).__init__()
+        self.source = source
 
 class AutoGenrePlugin(BeetsPlugin):
     item_types = {
         'genre_source': types.STRING,
         'genres': types.STRING,
+        'genre_fingerprint': types.STRING,
     }
 
     @property
@@ -49,49 +82,215 @@ class AutoGenrePlugin(BeetsPlugin):
     def __init__(self):
         super(AutoGenrePlugin, self).__init__()
         config_file_path = os.path.join(os.path.dirname(__file__), 'config_default.yaml')
-        source = ConfigSource(load_yaml(config_file_path) or {}, config_file_path)
+        source = ConfigSource(_load_yaml(config_file_path) or {}, config_file_path)
         self.config.add(source)
         assert _is_plugin_enabled('lastgenre'), "The 'lastgenre' plugin is not enabled!"
         assert _is_plugin_enabled('xtractor'), "The 'xtractor' plugin is not enabled!"
-        self._lastgenre = LastGenrePlugin()
-        self._xtractor = XtractorCommand(config['xtractor'])
+        # lastgenre and xtractor are loaded on first use, see _lastgenre and _xtractor
+        self._lastgenre_plugin = None
+        self._xtractor_command = None
+        self._plugins_lock = threading.Lock()
         self._lastgenre_conf = config['lastgenre'].get() or {}
         self._separator = self._lastgenre_conf.get('separator') or ', '
         self._remix_regex = re.compile(r'.+[^\w](remix|bootleg|remake)', re.IGNORECASE)
         self._genre_tree = None
+        self._genre_tree_lock = threading.Lock()
+        self._cache = None
+        self._cache_lock = threading.Lock()
+        self._lastfm_client = None
+        self._lastfm_results = {}
+        self._fingerprint_settings = None
+        self._metrics = NULL_METRICS
+        self._tag_writer = None
+        self._album_matches = {}
+        self._xtractor_output = None
+        self._plan = None
+        self._artist_index = None
+        self._content_keys = None
+        self._content_keys_lock = threading.Lock()
+        self._dedup_keys = DedupMemo(DEDUP_MEMO_SIZE)
+        self._dedup_results = DedupMemo(DEDUP_MEMO_SIZE)
         # TODO: fix auto support - fix genres field mapping, see https://github.com/beetbox/mediafile/blob/master/mediafile.py#L1814
         if self.config['auto'].get(bool):
             self.import_stages = [self.imported]
 
+    @property
+    def _lastgenre(self):
+        """The LastGenrePlugin instance, created on first use since it
+        loads the genre whitelist and tree."""
+        if self._lastgenre_plugin is None:
+            with self._plugins_lock:
+                if self._lastgenre_plugin is None:
+                    from beetsplug.lastgenre import LastGenrePlugin
+                    self._lastgenre_plugin = LastGenrePlugin()
+        return self._lastgenre_plugin
+
+    @property
+    def _xtractor(self):
+        if self._xtractor_command is None:
+            with self._plugins_lock:
+                if self._xtractor_command is None:
+                    from beetsplug.xtractor import XtractorCommand
+                    self._xtractor_command = XtractorCommand(config['xtractor'])
+        return self._xtractor_command
+
     def imported(self, session, task):
         """Event hook called when an import task finishes."""
-        if task.is_album:
-            for item in task.album.items():
-                self._update_item_genre(item)
+        if self.config['defer'].get():
+            # Resolve the genres later using autogenre --drain-queue
+            queue = self._work_queue()
+            try:
+                if task.is_album:
+                    queue.put('album', [task.album.id])
+                else:
+                    queue.put('item', [task.item.id])
+            finally:
+                queue.close()
+            return
+        self._load_artist_index(session.lib)
+        with self._store_batch(session.lib) as batch:
+            if task.is_album:
+                self._update_imported_items(list(task.album.items()), [task.album], batch)
+            else:
+                self._update_imported_items([task.item], [], batch)
 
-            self._update_album_genre(task.album)
-        else:
-            self._update_item_genre(task.item)
+    def _update_imported_items(self, items, albums, batch):
+        """Resolves and stores the genres of imported items and albums."""
+        results = self._evaluate_items(items, True, True, None)
+        for item, result in zip(items, results):
+            if result:
+                self._update_item_genre(item, result, batch)
+        for album in albums:
+            item_genres = [item.genre for item in items if item.album_id == album.id]
+            self._update_album_genre(album, item_genres, batch)
 
-    def _update_item_genre(self, item):
-        genre, genres, source = self._item_genre(item, True, True)
+    def _drain_queue(self, lib):
+        """Resolves the genres of the items and albums enqueued during import."""
+        queue = self._work_queue()
+        try:
+            self._load_artist_index(lib)
+            count = 0
+            size = self.config['batch_size'].get(int)
+            with self._store_batch(lib, True) as batch:
+                entries = queue.entries(size)
+                while entries:
+                    items = []
+                    albums = []
+                    for _, kind, entity_id in entries:
+                        if kind == 'album':
+                            album = lib.get_album(entity_id)
+                            if album:
+                                albums.append(album)
+                                items.extend(album.items())
+                        else:
+                            item = lib.get_item(entity_id)
+                            if item:
+                                items.append(item)
+                    self._update_imported_items(items, albums, batch)
+                    batch.flush()
+                    self._flush_writes(batch)
+                    if not self.config['pretend'].get():
+                        queue.remove(entries)
+                    count += len(entries)
+                    self._log.info('Processed {} queued imports...', count)
+                    entries = queue.entries(size, entries[-1][0])
+        finally:
+            queue.close()
+
+    def _work_queue(self):
+        path = self.config['queue_file'].get() or _library_file('autogenre-queue.db')
+        return WorkQueue(path)
+
+    def _update_item_genre(self, item, result, batch):
+        genre, genres, source = result
+        genres = self._join_genres(genres)
         self._log.info("Set track genre '{}' ({}): {}", genre, source, item)
         item.genre = genre
         item.genres = genres
         item.genre_source = source
+        self._count_result(source, True)
         if not self.config['pretend'].get():
             if config['import']['write'].get():
-                item.try_write()
-            item.store(['genre'])
-            item.store(['genres', 'genre_source'])
+                self._write_item(item)
+            # Dirty flexible attributes (genres, genre_source) are always stored.
+            batch.add(item, ['genre'])
+
+    def _update_album_genre(self, album, item_genres, batch):
+        self._set_album_genre(album, _most_common(item_genres), batch)
 
-    def _update_album_genre(self, album):
-        genre = _most_common([item.genre for item in album.items()])
+    def _update_album_genres(self, lib, album_ids, batch):
+        """Sets the genre of the given albums (all if None) to the most
+        common genre of their items. The genres are aggregated by the
+        database and only the changed albums are loaded and stored,
+        within a single transaction.
+        Returns the number of changed albums."""
+        batch.flush()
+        genres = dict(album_genre_changes(lib, album_ids))
+        ids = sorted(genres)
+        with lib.transaction():
+            for i in range(0, len(ids), ALBUM_IDS_PER_QUERY):
+                query = OrQuery([MatchQuery('id', album_id) for album_id in ids[i:i+ALBUM_IDS_PER_QUERY]])
+                for album in lib.albums(query):
+                    self._set_album_genre(album, genres[album.id], batch)
+            batch.flush()
+        return len(ids)
+
+    def _set_album_genre(self, album, genre, batch):
         if album.genre != genre and genre:
             album.genre = genre
             self._log.info("Set genre '{}' for album {}", album.genre, album)
             if not self.config['pretend'].get():
-                album.store(['genre'])
+                batch.add(album, ['genre'])
+
+    def _store_batch(self, lib, progress=False):
+        return StoreBatch(lib, self.config['batch_size'].get(int), self._log, progress, self._metrics)
+
+    def _write_item(self, item):
+        if self._tag_writer is not None:
+            # Written by _flush_writes() after the change has been stored
+            self._tag_writer.add(item)
+            return
+        with self._metrics.timer('write'):
+            ok = item.try_write()
+        if not ok:
+            self._metrics.count('write_failures')
+
+    def _flush_writes(self, batch):
+        """Stores the pending changes and writes the deferred tags of the
+        changed items to their files in parallel."""
+        if self._tag_writer is not None and len(self._tag_writer):
+            batch.flush()
+            self._store_mtimes(self._tag_writer.flush())
+
+    def _store_mtimes(self, items):
+        """Stores the modification times that writing the items' tags set,
+        within a single transaction, so that `beet update` does not reread
+        the files."""
+        if items:
+            with self._metrics.timer('store'), items[0]._db.transaction():
+                for item in items:
+                    item.store(['mtime'])
+
+    def _close_tag_writer(self):
+        writer, self._tag_writer = self._tag_writer, None
+        if writer is None:
+            return
+        # The pending changes have been stored when leaving the batch
+        self._store_mtimes(writer.flush())
+        if writer.failures:
+            self._log.warning('Failed to write tags to {} files:', len(writer.failures))
+            for path, error in writer.failures:
+                self._log.warning('  {}: {}', path, error)
+        self._log.info('Wrote tags to {} files', writer.written)
+        path = self.config['write_report'].get()
+        if path:
+            writer.write_report(path)
+
+    def _count_result(self, source, changed):
+        metrics = self._metrics
+        if metrics.enabled:
+            metrics.count('genre_source', source=source or 'none')
+            metrics.count(changed and 'items_changed' or 'items_unchanged')
 
     def commands(self):
         p = OptionParser()
@@ -131,8 +330,71 @@ class AutoGenrePlugin(BeetsPlugin):
         p.add_option('--no-parent-genres', action='store_false',
             default=self.config['parent_genres'].get(),
             dest='parent_genres', help="do not add primary genre's parent genres")
+        p.add_option('--artist-index', action='store_true',
+            default=self.config['artist_index'].get(),
+            dest='artist_index', help="derive genre from the artist's genres within the library")
+        p.add_option('--no-artist-index', action='store_false',
+            default=self.config['artist_index'].get(),
+            dest='artist_index', help="do not derive genre from the artist's genres within the library")
+        p.add_option('--dedup', action='store_true',
+            default=self.config['dedup'].get(),
+            dest='dedup', help='resolve the genre once per group of duplicate items')
+        p.add_option('--no-dedup', action='store_false',
+            default=self.config['dedup'].get(),
+            dest='dedup', help='resolve the genre of each duplicate item')
+        p.add_option('--group-albums', action='store_true',
+            default=self.config['group_albums'].get(),
+            dest='group_albums', help='evaluate items album by album')
+        p.add_option('--no-group-albums', action='store_false',
+            default=self.config['group_albums'].get(),
+            dest='group_albums', help='evaluate items independently')
+        p.add_option('-i', '--incremental', action='store_true',
+            default=self.config['incremental'].get(),
+            dest='incremental', help='reevaluate only items whose fingerprint changed')
         p.add_option('--genre', type='string',
             dest='genre', help='specify the genre to assign to the selected items')
+        p.add_option('--refresh-cache', action='store_true',
+            default=self.config['refresh_cache'].get(),
+            dest='refresh_cache', help='ignore cached last.fm results but update the cache')
+        p.add_option('--cache-only', action='store_true',
+            default=self.config['cache_only'].get(),
+            dest='cache_only', help='do not query last.fm but use cached results only')
+        p.add_option('--rebuild-tree-cache', action='store_true',
+            default=False,
+            dest='rebuild_tree_cache', help='rebuild the genre tree cache and exit')
+        p.add_option('--albums-only', action='store_true',
+            default=False,
+            dest='albums_only', help="only set the selected albums' genres to their items' most common genre")
+        p.add_option('--drain-queue', action='store_true',
+            default=False,
+            dest='drain_queue', help='resolve the genres of the items enqueued during import and exit')
+        p.add_option('--shard', type='string',
+            dest='shard', help='evaluate only the i-th of N partitions of the selected items, e.g. 1/4')
+        p.add_option('--plan', type='string',
+            dest='plan', help='write the changes to the given plan file instead of storing them')
+        p.add_option('--apply-plan', action='append',
+            dest='apply_plan', help='store the changes of the given plan file(s) and exit')
+        p.add_option('--prioritize', action='store_true',
+            default=self.config['prioritize'].get(),
+            dest='prioritize', help='evaluate items without genre first, then those with an Essentia genre')
+        p.add_option('--no-prioritize', action='store_false',
+            default=self.config['prioritize'].get(),
+            dest='prioritize', help='evaluate items in the order of their id')
+        p.add_option('--resume', action='store_true',
+            default=False,
+            dest='resume', help='continue the interrupted or budgeted run with the same query and options')
+        p.add_option('--max-items', type='int',
+            default=self.config['max_items'].get(int),
+            dest='max_items', help='stop after evaluating the given number of items (0 means unlimited)')
+        p.add_option('--max-duration', type='string',
+            default=self.config['max_duration'].get(),
+            dest='max_duration', help='stop after the given duration, e.g. 3600, 90m or 8h (0 means unlimited)')
+        p.add_option('--metrics', action='store_true',
+            default=self.config['metrics'].get(),
+            dest='metrics', help='print per-stage timings and counters at the end')
+        p.add_option('-j', '--jobs', type='int',
+            default=self.config['workers'].get(int),
+            dest='workers', help='number of items to resolve concurrently')
 
         c = Subcommand('autogenre', parser=p, help='derive and assign song genres')
         c.func = self._run_autogenre_cmd
@@ -140,209 +402,974 @@ class AutoGenrePlugin(BeetsPlugin):
 
     def _run_autogenre_cmd(self, lib, opts, args):
         self._apply_opts_to_config(opts)
+        if self.config['metrics'].get() or self.config['metrics_file'].get():
+            self._metrics = Metrics()
+        if self.config['deferred_writes'].get() and config['import']['write'].get():
+            self._tag_writer = TagWriter(self.config['write_workers'].get(int),
+                self.config['write_retries'].get(int), self._log, self._metrics)
+        try:
+            self._autogenre(lib, opts, args)
+        finally:
+            self._close_tag_writer()
+            self._close_plan()
+            self._fingerprint_settings = None
+            self._lastfm_results = {}
+            self._album_matches = {}
+            self._xtractor_output = None
+            self._artist_index = None
+            self._dedup_keys = DedupMemo(DEDUP_MEMO_SIZE)
+            self._dedup_results = DedupMemo(DEDUP_MEMO_SIZE)
+            self._report_match_cache()
+            self._close_content_keys()
+            self._close_lastfm_client()
+            self._close_cache()
+            self._emit_metrics()
+
+    def _close_plan(self):
+        plan, self._plan = self._plan, None
+        if plan is not None:
+            plan.close()
+
+    def _emit_metrics(self):
+        metrics, self._metrics = self._metrics, NULL_METRICS
+        if not metrics.enabled:
+            return
+        if self.config['metrics'].get():
+            for line in metrics.summary():
+                self._log.info('{}', line)
+        path = self.config['metrics_file'].get()
+        if path:
+            metrics.write(path)
+            self._log.debug('Wrote metrics to {}', path)
+
+    def _autogenre(self, lib, opts, args):
+        if opts.rebuild_tree_cache:
+            assert self.config['tree_cache'].get(bool), "The genre tree cache is disabled!"
+            self._genres()
+            self._log.info('Rebuilt the genre tree cache')
+            return
+        if opts.drain_queue:
+            self._drain_queue(lib)
+            return
+        if opts.apply_plan:
+            self._apply_plans(lib, opts.apply_plan)
+            return
+        if opts.albums_only:
+            album_ids = None
+            if args:
+                album_query, _ = parse_query_parts(decargs(args), Album)
+                album_ids = [album.id for album in lib.albums(album_query)]
+            with self._store_batch(lib, True) as batch:
+                count = self._update_album_genres(lib, album_ids, batch)
+            self._log.info('Changed the genre of {} albums', count)
+            return
         if opts.genre:
             ok = self._genres().contains(opts.genre)
             assert args, "Must specify selector when --genre provided"
             assert ok, "Provided genre '{}' is not registered within genre tree!".format(opts.genre)
         query = decargs(args)
-        parsed_query, parsed_sort = parse_query_parts(query, Item)
-        parsed_sort = FixedFieldSort("albumartist", ascending=True)
-        items = lib.items(parsed_query, parsed_sort)
+        parsed_query, _ = parse_query_parts(query, Item)
+        if opts.shard:
+            parsed_query = AndQuery([parsed_query, ShardQuery(*parse_shard(opts.shard))])
+        group_albums = self.config['group_albums'].get()
         all = opts.all or opts.genre is not None
         force = opts.force or opts.genre is not None
-        pretend = self.config['pretend'].get()
-        filtered_items = [item for item in items if _filter_item(item, all, force)]
-        self._log.info('Selected {} items for genre update...', len(filtered_items))
-        # Update items
-        for item in filtered_items:
-            genre, genres, source = self._item_genre(item, all, force, opts.genre)
-            genre_changed = genre != item.get('genre')
-            genres_changed = genres != item.get('genres')
-            genre_source_changed = source != item.get('genre_source')
-            changed = genre_changed or genres_changed or genre_source_changed
-            if changed and genres is not None:
-                msg = "Change genre from '{}' to '{}' ({}) for item: {}"
-                self._log.info(msg, item.get('genre'), genre, source, item)
-                if not pretend:
-                    item.genre = genre
-                    item.genres = genres
-                    item.genre_source = source
-                    if config['import']['write'].get():
-                        item.try_write()
+        if self.config['incremental'].get():
+            # Reevaluate items only when their fingerprint changed
+            force = True
+            self._fingerprint_settings = self._settings_fingerprint()
+        self._load_artist_index(lib)
+        run = _digest([query, all, force, opts.genre, opts.shard, opts.plan,
+            self.config['incremental'].get(), self.config['prioritize'].get()])
+        budget = Budget(self.config['max_items'].get(int), parse_duration(self.config['max_duration'].get()))
+        if group_albums:
+            budgeted = opts.resume or self.config['prioritize'].get() or budget.limited
+            assert not budgeted, "--resume, --prioritize, --max-items and --max-duration are not supported with --group-albums"
+        if opts.plan:
+            # Resolve the genres without changing the library
+            self._plan = PlanWriter(opts.plan, self._log, opts.resume)
+        with self._plan or self._store_batch(lib, True) as batch:
+            if group_albums:
+                items = _iter_album_items(lib, parsed_query)
+                self._update_album_groups(lib, items, all, force, opts.genre, batch)
+                return
+            self._update_items(lib, parsed_query, all, force, opts.genre, run, opts.resume, budget, batch)
+
+    def _update_items(self, lib, query, all, force, force_genre, run, resume, budget, batch):
+        """Evaluates the selected items in the order of their id, optionally
+        by priority (see PRIORITIES), and updates the genres of their albums.
+        Unless pretending, the progress is recorded after each batch so that
+        an interrupted run, or one that exhausted its budget, can be resumed."""
+        checkpoints = None
+        path = self.config['checkpoint_file'].get()
+        # A plan may be computed using a read-only copy of the library
+        if not self.config['pretend'].get() and (path or self._plan is None):
+            checkpoints = Checkpoints(path or _library_file('autogenre-checkpoint.db'))
+        elif resume:
+            self._log.warning('Cannot resume without a checkpoint file, starting from the beginning')
+        try:
+            phase, last_id, count = 0, 0, 0
+            state = checkpoints and resume and checkpoints.get(run)
+            if state:
+                phase, last_id, count = state
+                self._log.info('Resuming after item {} ({} items evaluated)', last_id, count)
+            elif checkpoints:
+                if resume:
+                    self._log.info('No checkpoint found, starting from the beginning')
+                checkpoints.remove(run)
+            phases = self.config['prioritize'].get() and PRIORITIES or (None,)
+            # Let the database return only the items that pass filter_item()
+            selection = GenreSelectionQuery(all, force)
+            album_ids = set()
+            stopped = False
+            for phase in range(phase, len(phases)):
+                queries = [query, selection]
+                if phases[phase]:
+                    queries.append(PriorityQuery(phases[phase]))
+                items = _iter_items(lib, AndQuery(queries), start=last_id + 1)
+                if phase > 0 and checkpoints:
+                    items = _skip_evaluated(items, checkpoints, run)
+                selected = (item for item in items if self._select_item(item, all, force, force_genre))
+                selected = islice(selected, budget.remaining_items())
+                size = self.config['batch_size'].get(int)
+                if self.config['xtractor'].get() and force_genre is None:
+                    chunks = _analysis_chunks(selected, size, self._analysis_workers())
+                else:
+                    chunks = _chunks(selected, size)
+                for chunk in chunks:
+                    results = self._evaluate_items(chunk, all, force, force_genre)
+                    for item, (genre, genres, source) in zip(chunk, results):
+                        self._store_item_genre(item, genre, genres, source, batch)
+                    chunk_album_ids = set(item.album_id for item in chunk if item.album_id)
+                    album_ids.update(chunk_album_ids)
+                    self._flush_writes(batch)
+                    count += len(chunk)
+                    budget.items += len(chunk)
+                    if checkpoints:
+                        batch.flush()
+                        # Items evaluated within the last phase cannot match another one
+                        evaluated = [item.id for item in chunk] if phase < len(phases) - 1 else ()
+                        if self._plan is not None:
+                            chunk_album_ids = ()
+                        checkpoints.save(run, phase, chunk[-1].id, count, evaluated, chunk_album_ids)
+                    self._log.info('Processed {} items...', count)
+                    stopped = budget.exhausted()
+                    if stopped:
+                        break
+                if stopped:
+                    break
+                last_id = 0
+            # TODO: match remix artist within title and get genre from artist: TITLE (ARTIST remix)
+            # Update albums (when planning, the album genres are derived while applying the plan)
+            if self._plan is None:
+                if checkpoints:
+                    # Including the albums of the items evaluated before resuming
+                    album_ids.update(checkpoints.album_ids(run))
+                if album_ids:
+                    self._update_album_genres(lib, album_ids, batch)
+            if stopped:
+                self._log.info('Stopped after {} items ({:.0f}s) since the budget is exhausted, continue using --resume',
+                    budget.items, budget.elapsed())
+                if checkpoints:
+                    checkpoints.clear_albums(run)
+            elif checkpoints:
+                checkpoints.remove(run)
+        finally:
+            if checkpoints:
+                checkpoints.close()
+
+    def _apply_plans(self, lib, paths):
+        """Stores the changes of the given plan files, written using --plan,
+        in batches and updates the genres of the affected albums."""
+        records = read_plans(paths, self._log)
+        ids = sorted(records)
+        album_ids = set()
+        found = 0
+        with self._store_batch(lib, True) as batch:
+            for i in range(0, len(ids), ITEM_IDS_PER_QUERY):
+                query = OrQuery([MatchQuery('id', item_id) for item_id in ids[i:i+ITEM_IDS_PER_QUERY]])
+                for item in lib.items(query):
+                    found += 1
+                    if self._apply_plan_record(item, records[item.id], batch) and item.album_id:
+                        album_ids.add(item.album_id)
+                self._flush_writes(batch)
+                self._log.info('Applied {} planned changes...', min(i + ITEM_IDS_PER_QUERY, len(ids)))
+            if found < len(ids):
+                self._log.warning('Skipped {} planned changes of items that do not exist', len(ids) - found)
+            if album_ids and not self.config['pretend'].get():
+                self._update_album_genres(lib, album_ids, batch)
+
+    def _apply_plan_record(self, item, record, batch):
+        """Applies a plan record to the item and returns True if the
+        item's genre has been changed."""
+        analysis = record.get('analysis')
+        if analysis:
+            for field, value in analysis.items():
+                setattr(item, field, value)
+        changed = False
+        if 'source' in record:
+            genres = self._split_genres(record['genres'])
+            changed = self._store_item_genre(item, record['genre'], genres, record['source'], batch, record.get('fingerprint'))
+        if analysis and not changed and not self.config['pretend'].get():
+            batch.add(item)
+        return changed
+
+    def _update_album_groups(self, lib, items, all, force, force_genre, batch):
+        """Evaluates the selected items album by album.
+        Since the items of an album are resolved sequentially, album and
+        artist scoped last.fm lookups are done only once per album.
+        The album genre is derived from the album's selected items."""
+        count = 0
+        size = self.config['batch_size'].get(int)
+        for chunk in _group_chunks(items, _album_group, size):
+            results = self._evaluate_items(chunk, all, force, force_genre, _album_group)
+            for _, group in groupby(zip(chunk, results), lambda r: _album_group(r[0])):
+                group = list(group)
+                item_genres = []
+                for item, result in group:
+                    genre = item.get('genre')
+                    if result:
+                        if self._store_item_genre(item, *result, batch):
+                            genre = result[0]
+                    item_genres.append(genre)
+                album_id = group[0][0].album_id
+                album = album_id and lib.get_album(album_id)
+                if album:
+                    self._update_album_genre(album, item_genres, batch)
+            self._flush_writes(batch)
+            count += len(chunk)
+            self._log.info('Processed {} items...', count)
+
+    def _store_item_genre(self, item, genre, genres, source, batch, fingerprint=None):
+        """Stores the item's genre if it has changed.
+        In incremental mode (or if given) the item's fingerprint is stored as well.
+        Returns True if the item's genre has been changed."""
+        genres = self._join_genres(genres)
+        genre_changed = genre != item.get('genre')
+        genres_changed = genres != item.get('genres')
+        genre_source_changed = source != item.get('genre_source')
+        changed = genre_changed or genres_changed or genre_source_changed
+        changed = changed and genres is not None
+        fingerprint = fingerprint or self._fingerprint_settings and self._fingerprint(item)
+        fingerprint_changed = fingerprint and fingerprint != item.get('genre_fingerprint')
+        self._count_result(source, changed)
+        if changed:
+            msg = "Change genre from '{}' to '{}' ({}) for item: {}"
+            self._log.info(msg, item.get('genre'), genre, source, item)
+        if (changed or fingerprint_changed) and not self.config['pretend'].get():
+            if changed:
+                item.genre = genre
+                item.genres = genres
+                item.genre_source = source
+                if config['import']['write'].get() and self._plan is None:
+                    self._write_item(item)
+            if fingerprint_changed:
+                item.genre_fingerprint = fingerprint
+            batch.add(item)
+        return changed
+
+    def _select_item(self, item, all, force, force_genre=None):
+        """Returns True if the item's genre should be (re)evaluated.
+        In incremental mode only items with a changed fingerprint are
+        selected, unless a genre is specified."""
+        if not filter_item(item, all, force):
+            return False
+        if force_genre is not None:
+            return True
+        return not self._fingerprint_settings or self._fingerprint(item) != item.get('genre_fingerprint')
+
+    def _fingerprint(self, item):
+        """Returns a digest of the item's fields and the settings its genre depends on."""
+        # Compare string representations since untyped flexible attributes
+        # are loaded as strings from the database.
+        values = [self._fingerprint_settings] + [str(item.get(k)) for k in FINGERPRINT_FIELDS]
+        return _digest(values)
+
+    def _settings_fingerprint(self):
+        conf = self._lastgenre.config
+        values = [self._genres().digest, conf['source'].get()]
+        values += [conf[k].get() for k in LASTGENRE_CACHE_SCOPE]
+        values += [self.config[k].get() for k in FINGERPRINT_SETTINGS]
+        return _digest(values)
+
+    def _evaluate_items(self, items, all, force, force_genre, group_key=None):
+        """Resolves the genres of the given items that pass the filter.
+        Items with the same group_key are resolved sequentially by the same worker.
+        Items whose genre must be derived from Essentia's results are
+        analyzed in parallel and mapped in bulk afterwards.
+        Returns the (genre, genres, source) results in the order of the
+        given items (None if filtered), with genres as tuple."""
+        def evaluate(item):
+            if not self._select_item(item, all, force, force_genre):
+                return None
+            try:
+                return self._item_genre(item, all, force, force_genre, False)
+            except EssentiaRequired as e:
+                return e
+
+        if self.config['lastgenre'].get() and self.config['lastfm_async'].get():
+            self._prefetch_lastfm([item for item in items if self._select_item(item, all, force, force_genre)], force_genre)
+        if group_key:
+            groups = [list(group) for _, group in groupby(items, group_key)]
+            results = self._map(lambda group: [evaluate(item) for item in group], groups)
+            results = [r for group_results in results for r in group_results]
+        else:
+            results = list(self._map(evaluate, items))
+        pending = [(i, item) for i, (item, r) in enumerate(zip(items, results)) if isinstance(r, EssentiaRequired)]
+        if pending:
+            genres = self._essentia_genres([item for _, item in pending])
+            for (i, item), g in zip(pending, genres):
+                source = results[i].source if g is None else 'essentia'
+                key = self._dedup_key(item)
+                if key:
+                    self._dedup_results[key] = (g, source)
+                results[i] = self._complete_genre(g, source)
+        # The prefetched last.fm results are only needed for this chunk
+        self._lastfm_results = {}
+        return results
+
+    @timed('xtractor_output')
+    def _import_xtractor_output(self, items):
+        """Imports the results of earlier analyses from xtractor's output
+        directory and returns the items that still need to be analyzed."""
+        try:
+            output = self._get_xtractor_output()
+        except FileNotFoundError as e:
+            self._log.debug('Cannot read existing Essentia results: {}', e)
+            return items
+        imported = []
+        for item in items:
+            values = {field: value for field, value in output.load(item).items() if value}
+            for field, value in values.items():
+                setattr(item, field, value)
+            if values:
+                imported.append((item, values))
+        self._metrics.count('xtractor_output_imports', len(imported))
+        self._log.debug('Imported {} existing Essentia results', len(imported))
+        self._store_analyses(imported)
+        return [item for item in items if _needs_analysis(item)]
+
+    def _group_duplicates(self, items):
+        """Returns the first item of each group of duplicates among the given
+        items and (item, first item) tuples for the others."""
+        firsts = {}
+        unique = []
+        duplicates = []
+        for item in items:
+            key = self._dedup_key(item)
+            if key and key in firsts:
+                duplicates.append((item, firsts[key]))
+            else:
+                if key:
+                    firsts[key] = item
+                unique.append(item)
+        return unique, duplicates
+
+    def _copy_analyses(self, duplicates):
+        """Copies the Essentia results of analyzed items to their duplicates."""
+        copied = []
+        for item, analyzed in duplicates:
+            values = {field: analyzed.get(field) for field in ANALYSIS_FIELDS if analyzed.get(field)}
+            for field, value in values.items():
+                setattr(item, field, value)
+            if values:
+                copied.append((item, values))
+        self._metrics.count('dedup_analyses', len(copied))
+        self._store_analyses(copied)
+
+    def _store_analyses(self, results):
+        """Stores the Essentia results, given as (item, values) tuples, that
+        have not been stored by xtractor, or writes them to the plan."""
+        if self._plan is not None:
+            for item, values in results:
+                self._plan.add_analysis(item.id, values)
+        elif results and not self._xtractor.cfg_dry_run:
+            with results[0][0]._db.transaction():
+                for item, _ in results:
                     item.store()
-        # TODO: match remix artist within title and get genre from artist: TITLE (ARTIST remix)
-        # Update albums
-        album_ids = set([item.album_id for item in filtered_items if item.album_id])
-        for album_id in album_ids:
-            album = lib.get_album(album_id)
-            if album:
-                self._update_album_genre(album)
+
+    def _get_xtractor_output(self):
+        if not self._xtractor_output:
+            output_dir = self._xtractor._get_extraction_output_path()
+            from beetsplug.autogenre.xtractoroutput import XtractorOutput
+            self._xtractor_output = XtractorOutput.from_config(self._xtractor.config, output_dir, ('bpm',) + ESSENTIA_FIELDS)
+        return self._xtractor_output
+
+    @timed('analysis')
+    def _analyze_items(self, items):
+        """Runs the Essentia analysis for the given items in parallel.
+        Since the extractor runs as a separate process per item, a thread
+        pool is sufficient to utilize multiple CPU cores."""
+        workers = self._analysis_workers()
+        self._metrics.count('analyses', len(items))
+        self._log.info('Analyzing {} items using essentia ({} workers)...', len(items), workers)
+        dry_run = self._xtractor.cfg_dry_run
+        if self._plan is not None:
+            # Do not store the results within the library
+            self._xtractor.cfg_dry_run = True
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for _ in pool.map(self._xtractor._run_analysis, items):
+                    pass
+        finally:
+            self._xtractor.cfg_dry_run = dry_run
+
+    def _analysis_workers(self):
+        return self.config['analysis_workers'].get(int) or os.cpu_count() or 1
+
+    def _map(self, func, values):
+        """Maps the values using a bounded thread pool when more than one
+        worker is configured. Yields the results in the order of the values."""
+        workers = self.config['workers'].get(int)
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                yield from pool.map(func, values)
+        else:
+            yield from map(func, values)
 
     def _apply_opts_to_config(self, opts):
         for k, v in opts.__dict__.items():
             if v is not None and k in self.config:
                 self.config[k] = v
 
-    def _item_genre(self, item, all, force, force_genre=None):
-        genres, source = self._item_genres(item, all, force, force_genre)
-        genrel = self._str2list(genres)
-        genre = genres and genrel[0] or None
+    def _item_genre(self, item, all, force, force_genre=None, analyze=True):
+        genres, source = self._item_genres(item, all, force, force_genre, analyze)
+        return self._complete_genre(genres, source)
+
+    def _complete_genre(self, genres, source):
+        genre = genres and genres[0] or None
 
         if genres:
             if self.config['parent_genres'].get() and genre:
                 # Append primary genre's parent genres to genre list
-                parent_genres = self._genres().parents(genre)
-                parent_genres = [self._format_genre(g) for g in parent_genres]
-                genrel = genrel + [g for g in parent_genres if g not in genrel]
-                genres = self._list2str(genrel)
+                parent_genres = self._genres().formatted_parents(genre)
+                genres = genres + tuple(g for g in parent_genres if g not in genres)
 
         return genre, genres, source
 
-    def _item_genres(self, item, all, force, force_genre):
+    @timed('item_genres')
+    def _item_genres(self, item, all, force, force_genre, analyze=True):
         genre = item.get('genres')
         if not genre:
             genre = item.get('genre')
+        genres = self._split_genres(genre)
         source = item.get('genre_source')
-        if _filter_item(item, all, force):
+        if filter_item(item, all, force):
             if force_genre is not None:
                 source = force_genre and 'user' or None
-                genre = self._format_genre(force_genre.lower())
-            if source != 'user' or not genre:
-                # auto-detect genre
-                if self.config['lastgenre'].get():
-                    genre = self._lastfm_genre(item)
-                    if genre is not None:
-                        source = 'lastfm'
-                if self.config['from_title'].get():
-                    genre, matched = self._fix_remix_genre(item, genre)
-                    if matched and genre is not None:
-                        source = 'title'
-                if genre is None and self.config['xtractor'].get():
-                    genre = self._essentia_genre(item)
-                    if genre is not None:
-                        source = 'essentia'
-        return genre, source
+                genres = self._split_genres(self._format_genre(force_genre.lower()))
+            if source != 'user' or not genres:
+                # auto-detect genre, only once per group of duplicates
+                key = self._dedup_key(item)
+                result = key and self._dedup_results.get(key)
+                if result:
+                    genres, source = result
+                    self._metrics.count('dedup_hits')
+                else:
+                    genres, source = self._detect_genres(item, genres, source, analyze)
+                    if key:
+                        self._dedup_results[key] = (genres, source)
+        return genres, source
+
+    def _detect_genres(self, item, genres, source, analyze):
+        """Derives the item's genres from the library, last.fm, its title
+        or Essentia's results."""
+        library_genres = self._library_genres(item)
+        if library_genres is not None:
+            genres = library_genres
+            source = 'library'
+        elif self.config['lastgenre'].get():
+            genre = self._lastfm_genre(item)
+            genres = self._split_genres(genre)
+            if genres is not None:
+                source = 'lastfm'
+        if self.config['from_title'].get():
+            genres, matched = self._fix_remix_genre(item, genres)
+            if matched and genres is not None:
+                source = 'title'
+        if genres is None and self.config['xtractor'].get():
+            if not analyze:
+                raise EssentiaRequired(source)
+            genres = self._essentia_genre(item)
+            if genres is not None:
+                source = 'essentia'
+        return genres, source
+
+    def _load_artist_index(self, lib):
+        if self._artist_index is None and self.config['artist_index'].get():
+            with self._metrics.timer('artist_index'):
+                self._artist_index = ArtistGenreIndex.build(lib,
+                    self.config['artist_index_min_items'].get(int),
+                    self.config['artist_index_min_share'].as_number(),
+                    config['va_name'].as_str())
+            self._log.debug('Indexed the genres of {} artists', len(self._artist_index))
+
+    def _library_genres(self, item):
+        """Returns the genre tuple of the item's artist if it is dominant
+        within the library, see ArtistGenreIndex."""
+        if self._artist_index is None:
+            return None
+        genres = self._split_genres(self._artist_index.lookup(item))
+        if genres:
+            self._log.debug("Got library genre '{}' for item: {}", genres[0], item)
+            return genres
+        return None
+
+    def _dedup_key(self, item):
+        """Returns the key of the item's group of duplicates, see ContentKeys,
+        or None if duplicates are resolved independently."""
+        if not self.config['dedup'].get():
+            return None
+        key = self._dedup_keys.get(item.id, False)
+        if key is False:
+            key = self._dedup_keys[item.id] = self._get_content_keys().key(item)
+        return key
+
+    def _get_content_keys(self):
+        with self._content_keys_lock:
+            if not self._content_keys:
+                path = self.config['dedup_cache_file'].get() or _library_file('autogenre-dedup.db')
+                self._content_keys = self._open_sidecar(ContentKeys, path)
+            return self._content_keys
+
+    def _close_content_keys(self):
+        with self._content_keys_lock:
+            if self._content_keys:
+                keys = self._content_keys
+                self._log.debug('Hashed the audio data of {} files', keys.hashed)
+                self._metrics.count('content_hashes', keys.hashed)
+                self._content_keys = None
+                keys.close()
 
     def _is_remix(self, title):
         return self._remix_regex.match(title) is not None
 
+    @timed('lastfm')
     def _lastfm_genre(self, item):
-        genre = None
-        src = None
-        source = self._lastgenre.config['source'].get()
-        if self._is_remix(item.get('title')) and source != 'track':
-            # When item is remix, get genre frpm the last.fm track.
+        genre, src = self._lastfm_item_genre(item)
+        if genre:
+            msg = "Got last.fm genre '{}' based on {} for item: {}"
+            self._log.debug(msg, genre, src, item)
+        return genre
+
+    def _lastfm_item_genre(self, item):
+        """Like LastGenrePlugin._get_genre but for items only and with the
+        sources derived per item instead of from the shared plugin config.
+        This allows to resolve multiple items concurrently."""
+        lastgenre = self._lastgenre
+        if not lastgenre.config['force'].get() and lastgenre._is_allowed(item.genre):
+            return item.genre, 'keep'
+        for lookup in self._lastfm_lookups(item):
+            genre = self._lastfm_lookup(*lookup)
+            if genre:
+                return genre, lookup[0]
+        if item.genre:
+            genre = lastgenre._resolve_genres([item.genre])
+            if genre:
+                return genre, 'original'
+        fallback = lastgenre.config['fallback'].get()
+        if fallback:
+            return fallback, 'fallback'
+        return None, None
+
+    def _lastfm_lookups(self, item):
+        """Returns the last.fm lookups to try for an item, in order."""
+        sources = self._lastgenre.sources
+        if self._is_remix(item.get('title')):
+            # When item is remix, get genre from the last.fm track.
             # (The artist's genre would be most likely wrong / the original.
             # E.g. 'Fugees - Ready or not (Champion Bootleg)'.
             # For other items the album/artist source is more reliable.)
-            self._lastgenre.config['source'] = 'track'
+            sources = ('track', 'album', 'artist')
+        lookups = []
+        if 'track' in sources:
+            lookups.append(('track', item.artist, item.title))
+        if 'album' in sources:
+            lookups.append(('album', item.albumartist, item.album))
+        if 'artist' in sources:
+            lookups.append(('artist', item.artist))
+        return lookups
+
+    def _lastfm_lookup(self, entity, *args):
+        if any(not a for a in args):
+            return None
+        key = (entity,) + args
+        if key in self._lastfm_results:
+            return self._lastfm_results[key]
+        found, genre = self._cached_lastfm_lookup(key)
+        if found:
+            return genre
+        from beetsplug.autogenre.lastfm import LastfmError
+        self._metrics.count('lastfm_lookups', backend='pylast')
+        try:
+            tags = self._pylast_top_tags(entity, *args)
+        except LastfmError as e:
+            # Not cached persistently in order to retry within the next run
+            self._log.warning('{}', e)
+            return None
+        genre = self._lastfm_tags_genre(tags)
+        self._cache_lastfm_lookup(key, genre)
+        self._lastfm_results[key] = genre
+        return genre
+
+    def _pylast_top_tags(self, entity, *args):
+        """Like LastfmClient.top_tags but using pylast, like
+        LastGenrePlugin._tags_for, except that errors are raised as
+        LastfmError instead of being returned as missing tags."""
+        import pylast
+        from beetsplug.lastgenre import LASTFM, PYLAST_EXCEPTIONS, REPLACE
+        from beetsplug.autogenre.lastfm import ERROR_NOT_FOUND, LastfmError
+        for k, v in REPLACE.items():
+            args = tuple(a.replace(k, v) for a in args)
+        obj = getattr(LASTFM, LASTFM_METHODS[entity])(*args)
+        if isinstance(obj, pylast.Album):
+            # Album.get_top_tags() does not return TopItem instances,
+            # see https://github.com/pylast/pylast/issues/86
+            obj = super(pylast.Album, obj)
+        try:
+            tags = obj.get_top_tags()
+            return [(tag.item.get_name(), int(tag.weight or 0)) for tag in tags]
+        except pylast.WSError as e:
+            if e.get_id() == str(ERROR_NOT_FOUND):
+                return []
+            raise LastfmError('last.fm request failed (error {}): {}'.format(e.get_id(), e))
+        except PYLAST_EXCEPTIONS as e:
+            raise LastfmError('last.fm request failed: {}'.format(e))
+        except Exception as e:
+            # Isolate bugs in pylast, like lastgenre does
+            self._log.debug('{}', traceback.format_exc())
+            raise LastfmError('error in pylast library: {}'.format(e))
+
+    def _cached_lastfm_lookup(self, key):
+        """Returns a (found, genre) tuple from the persistent cache.
+        In cache-only mode a lookup is always considered found."""
+        cache = self._lastfm_cache()
+        if cache and not self.config['refresh_cache'].get():
+            found, genre = cache.get(key)
+            return found or self.config['cache_only'].get(), genre
+        return self.config['cache_only'].get(), None
+
+    def _cache_lastfm_lookup(self, key, genre):
+        cache = self._lastfm_cache()
+        if cache:
+            cache.set(key, genre)
+
+    def _prefetch_lastfm(self, items, force_genre):
+        """Resolves the last.fm lookups of the given items concurrently using
+        the asynchronous client. The subsequent evaluation of the items
+        picks the results up from memory instead of querying last.fm."""
+        if force_genre:
+            return
+        lastgenre = self._lastgenre
+        keep = not lastgenre.config['force'].get()
+        keys = set(self._dedup_results.keys())
+        lookups = [self._lastfm_lookups(item) for item in items
+            if not (item.get('genre_source') == 'user' and item.get('genre') and force_genre is None)
+            and not (keep and lastgenre._is_allowed(item.genre))
+            and not (self._artist_index and self._artist_index.lookup(item))
+            and not self._is_duplicate(item, keys)]
+        if lookups:
+            import asyncio
+            asyncio.run(self._prefetch_lastfm_lookups(lookups))
+
+    def _is_duplicate(self, item, keys):
+        """Returns True if the genre of a duplicate of the item is resolved
+        already, otherwise adds the item's key to the given keys."""
+        key = self._dedup_key(item)
+        if not key:
+            return False
+        if key in keys:
+            return True
+        keys.add(key)
+        return False
+
+    async def _prefetch_lastfm_lookups(self, lookups):
+        async def prefetch(item_lookups):
+            # Like _lastfm_item_genre(), stop at the first lookup that yields a genre
+            for lookup in item_lookups:
+                if await self._lastfm_lookup_async(*lookup):
+                    break
+        import asyncio
+        await asyncio.gather(*[prefetch(item_lookups) for item_lookups in lookups])
+
+    async def _lastfm_lookup_async(self, entity, *args):
+        if any(not a for a in args):
+            return None
+        key = (entity,) + args
+        if key in self._lastfm_results:
+            return self._lastfm_results[key]
+        found, genre = self._cached_lastfm_lookup(key)
+        if not found:
+            from beetsplug.autogenre.lastfm import LastfmError
             try:
-                genre, src = self._lastgenre._get_genre(item)
-            finally:
-                self._lastgenre.config['source'].set(source)
-        else:
-            genre, src = self._lastgenre._get_genre(item)
-        if genre:
-            msg = "Got last.fm genre '{}' based on {} for item: {}"
-            self._log.debug(msg, genre, src, item)
+                tags = await self._get_lastfm_client().top_tags(entity, *args)
+            except LastfmError as e:
+                # Not cached persistently in order to retry within the next run
+                self._log.warning('{}', e)
+                self._lastfm_results[key] = None
+                return None
+            genre = self._lastfm_tags_genre(tags)
+            self._cache_lastfm_lookup(key, genre)
+        self._lastfm_results[key] = genre
         return genre
 
-    def _fix_remix_genre(self, item, genre):
-        '''Match genre within title or album and prepend to genre list.
+    def _lastfm_tags_genre(self, tags):
+        """Like LastGenrePlugin.fetch_genre but for (name, weight) tuples."""
+        lastgenre = self._lastgenre
+        min_weight = lastgenre.config['min_weight'].get(int)
+        names = [name.lower() for name, weight in tags if not min_weight or weight >= min_weight]
+        return lastgenre._resolve_genres(names)
+
+    def _get_lastfm_client(self):
+        if not self._lastfm_client:
+            from beetsplug.autogenre.lastfm import LastfmClient
+            from beetsplug.lastgenre import LASTFM
+            self._lastfm_client = LastfmClient(LASTFM.api_key,
+                url=self.config['lastfm_url'].get(),
+                rate=self.config['lastfm_rate'].as_number(),
+                concurrency=self.config['lastfm_concurrency'].get(int),
+                retries=self.config['lastfm_retries'].get(int),
+                log=self._log)
+        return self._lastfm_client
+
+    def _close_lastfm_client(self):
+        if self._lastfm_client:
+            client = self._lastfm_client
+            self._log.debug('Sent {} asynchronous last.fm requests', client.requests)
+            self._metrics.count('lastfm_requests', client.requests, backend='async')
+            self._lastfm_client = None
+            client.close()
+
+    def _lastfm_cache(self):
+        with self._cache_lock:
+            if not self._cache and self.config['cache'].get(bool):
+                path = self.config['cache_file'].get() or _library_file('autogenre-cache.db')
+                conf = self._lastgenre.config
+                # The genre tree's digest covers the whitelist and tree files' contents
+                scope = _digest([self._genres().digest] + [conf[k].get() for k in LASTGENRE_CACHE_SCOPE])
+                day = 24 * 60 * 60
+                ttl = self.config['cache_ttl'].get(int) * day
+                negative_ttl = self.config['cache_negative_ttl'].get(int) * day
+                self._log.debug('Using last.fm cache {}', path)
+                self._cache = self._open_sidecar(LastfmCache, path, scope, ttl, negative_ttl)
+            return self._cache
+
+    def _open_sidecar(self, cls, path, *args):
+        """Opens one of the plugin's databases or, if it cannot be written
+        (e.g. next to a read-only copy of the library), an in-memory one."""
+        try:
+            return cls(path, *args)
+        except sqlite3.Error as e:
+            self._log.warning("Cannot open '{}', using an in-memory database instead: {}", path, e)
+            return cls(':memory:', *args)
+
+    def _close_cache(self):
+        with self._cache_lock:
+            if self._cache:
+                cache = self._cache
+                self._log.debug('last.fm cache: {} hits, {} misses', cache.hits, cache.misses)
+                self._metrics.count('lastfm_cache_hits', cache.hits)
+                self._metrics.count('lastfm_cache_misses', cache.misses)
+                self._cache = None
+                cache.close()
+
+    @timed('title_match')
+    def _fix_remix_genre(self, item, genres):
+        '''Match genre within title or album and prepend to genre tuple.
         This fixes remixes that are wrongly tagged on last.fm'''
         title = item.get('title')
         album = item.get('album')
-        genres = self._str2list(genre)
         matched = self._genres().match(title)
         if matched:
             source = 'title'
         elif album:
             source = 'album'
-            matched = self._genres().match(album)
+            matched = self._match_album(item, album)
         prepend_genre = None
         if matched:
             prepend_genre = matched.lower()
         if prepend_genre:
             prepend_genre = self._format_genre(prepend_genre)
-            genres = [g for g in genres if g != prepend_genre]
-            genre = self._list2str([prepend_genre] + genres)
-            self._log.debug("Fixed genre '{}' based on {} of item: {}", genre, source, item)
-            return genre, True
-        return genre, False
+            genres = (prepend_genre,) + tuple(g for g in genres or () if g != prepend_genre)
+            self._log.debug("Fixed genre '{}' based on {} of item: {}", self._join_genres(genres), source, item)
+            return genres, True
+        return genres, False
 
     def _essentia_genre(self, item):
-        if not item.get('bpm') or not item.get('genre_rosamerica'):
-            # Run essentia analysis if result not known yet.
-            self._log.debug('Analyzing item using essentia: {}', item)
-            self._xtractor._run_analysis(item)
-        if 'genre_rosamerica' not in item:
-            # Essentia analysis may not provide data in some cases.
-            return None
-        # Use Essentia's mapped genre_rosamerica value
-        genre_rosamerica = item.genre_rosamerica
-        genre_rosamerica_probability = float(item.genre_rosamerica_probability)
-        genre_electronic = item.genre_electronic
-        genre_electronic_probability = float(item.genre_electronic_probability)
-        genre = ROSAMERICA_GENRES.get(genre_rosamerica)
-        genre_electronic_strong = self.config['genre_electronic_strong'].get()
-        genre_rosamerica_strong = self.config['genre_rosamerica_strong'].get()
-        genre_electronic_prepend = self.config['genre_electronic_prepend'].get()
-        genre_electronic_append = self.config['genre_electronic_append'].get()
-
-        if genre == 'dance':
-            if genre_electronic_probability > genre_electronic_strong:
-                # Use the result of Essentia's electronic genre model
-                genre = ELECTRONIC_GENRES.get(genre_electronic)
-        elif genre_rosamerica_probability < genre_rosamerica_strong and genre_electronic_probability > genre_electronic_prepend:
-            # Prepend electronic to genre list
-            genres = ['electronic'] + [genre]
-            genre_electro = ELECTRONIC_GENRES.get(genre_electronic)
-            if genre_electro: # Append electronic sub genre to list
-                genres += [genre_electro]
-            genre = self._list2str(genres)
-
-        if genre_electronic_probability > genre_electronic_append:
-            if genre_rosamerica in ('rhy', 'pop', 'hip'):
-                # Append electronic to genre list
-                genres = self._str2list(genre)
-                if 'electronic' not in genres:
-                    genre = self._list2str(genres + ['electronic'])
-            elif genre == 'dance':
-                genre = 'electronic'
-
-        genre = self._format_genre(genre)
-        self._log.debug("Got essentia genre '{}' for item: {}", genre, item)
-        return genre
+        return self._essentia_genres([item])[0]
+
+    def _match_album(self, item, album):
+        """Matches the genre tree against the album name, only once per
+        album when match_album_once is enabled."""
+        if not item.album_id or not self.config['match_album_once'].get():
+            return self._genres().match(album)
+        matched = self._album_matches.get(item.album_id, False)
+        if matched is False:
+            matched = self._album_matches[item.album_id] = self._genres().match(album)
+        return matched
+
+    def _report_match_cache(self):
+        info = self._genre_tree and self._genre_tree.match_cache_info()
+        if info and info.hits + info.misses:
+            hit_rate = info.hits * 100 / (info.hits + info.misses)
+            self._log.debug('Genre match memo: {} hits, {} misses ({:.1f}% hit rate)', info.hits, info.misses, hit_rate)
+            self._metrics.count('match_cache_hits', info.hits)
+            self._metrics.count('match_cache_misses', info.misses)
+            # Reset the statistics and free the memory
+            self._genre_tree.set_match_cache_size(self.config['match_cache_size'].get(int))
+
+    @timed('essentia')
+    def _essentia_genres(self, items):
+        """Returns the genre tuples derived from Essentia's results for the
+        given items, running the analysis for those not analyzed yet."""
+        pending = [item for item in items if _needs_analysis(item)]
+        if pending and self.config['reuse_xtractor_output'].get():
+            pending = self._import_xtractor_output(pending)
+        duplicates = []
+        if pending and self.config['dedup'].get():
+            pending, duplicates = self._group_duplicates(pending)
+        if pending:
+            self._analyze_items(pending)
+            if self._plan is not None:
+                # The results have not been stored, read them from the output
+                self._get_xtractor_output().rescan()
+                self._import_xtractor_output(pending)
+        if duplicates:
+            self._copy_analyses(duplicates)
+        # Essentia analysis may not provide data in some cases.
+        mapper = EssentiaGenres.from_config(self.config, self._format_genre)
+        genres = mapper.derive_genres(items)
+        for item, g in zip(items, genres):
+            if g:
+                self._log.debug("Got essentia genre '{}' for item: {}", self._join_genres(g), item)
+        return genres
 
     def _genres(self):
+        with self._genre_tree_lock:
+            return self._load_genres()
+
+    def _load_genres(self):
         if not self._genre_tree:
             genre_tree_file = self._lastgenre_conf.get('canonical')
             if not genre_tree_file:
                 genre_tree_file = os.path.join(os.path.dirname(__file__), '..', 'lastgenre', 'genres-tree.yaml')
             genre_wh_file = self._lastgenre_conf.get('whitelist')
             assert genre_wh_file, "Config option lastgenre.whitelist is not specified!"
-            with open(genre_wh_file, 'r') as f:
-                genre_whitelist = [genre.strip().lower() for genre in f.readlines() if genre.strip()]
-            with codecs.open(genre_tree_file, 'r', encoding='utf-8') as f:
-                genre_tree_yaml = yaml.safe_load(f)
-            self._genre_tree = GenreTree(genre_tree_yaml, genre_whitelist)
+            cache_file = None
+            if self.config['tree_cache'].get(bool):
+                cache_file = self.config['tree_cache_file'].get() or _library_file('autogenre-tree.cache')
+            # Read from the config rather than from the LastGenrePlugin, which
+            # would parse the genre tree when created (title_case defaults to yes)
+            scope = json.dumps(self._lastgenre_conf.get('title_case', True))
+            rebuild = self.config['rebuild_tree_cache'].get()
+            self._genre_tree = load_genre_tree(genre_tree_file, genre_wh_file, self._format_genre,
+                cache_file, scope, rebuild, self._log)
+            self._genre_tree.set_match_cache_size(self.config['match_cache_size'].get(int))
 
         return self._genre_tree
 
     def _format_genre(self, genre):
         return self._lastgenre._format_tag(genre)
 
-    def _str2list(self, str):
-        return str and str.split(self._separator) or []
+    def _split_genres(self, genres):
+        """Returns the genre tuple of a genre list string (or None)."""
+        if genres is None:
+            return None
+        return genres and tuple(genres.split(self._separator)) or ()
+
+    def _join_genres(self, genres):
+        """Formats a genre tuple (or None) as genre list string."""
+        if genres is None:
+            return None
+        return self._separator.join(genres)
+
+
+def _iter_items(lib, query, field='id', start=0):
+    """Yields the items matching the query ordered by the given field,
+    starting at the given field value.
+    The items are queried page by page (by field value range) so that
+    only a single page of items is held in memory at a time."""
+    with lib.transaction() as tx:
+        max_value = tx.query('SELECT MAX({}) FROM items'.format(field))[0][0] or 0
+    sort = MultipleSort([FixedFieldSort(field), FixedFieldSort('id')])
+    for page_start in range(start, max_value + 1, PAGE_SIZE):
+        value_range = NumericQuery(field, '{}..{}'.format(page_start, page_start + PAGE_SIZE - 1))
+        for item in lib.items(AndQuery([query, value_range]), sort):
+            yield item
+
+def _iter_album_items(lib, query):
+    """Yields the items matching the query ordered by album, followed by
+    the singletons."""
+    yield from _iter_items(lib, query, 'album_id')
+    yield from _iter_items(lib, AndQuery([query, NoneQuery('album_id')]))
+
+def _album_group(item):
+    """Returns the album id or, for singletons, a negative item id."""
+    return item.album_id or -item.id
+
+def _skip_evaluated(items, checkpoints, run):
+    """Skips the items evaluated within earlier phases of the run, looking
+    them up page by page."""
+    evaluated = set()
+    page_end = -1
+    for item in items:
+        if item.id > page_end:
+            page_end = item.id + PAGE_SIZE - 1
+            evaluated = checkpoints.evaluated(run, item.id, page_end)
+        if item.id not in evaluated:
+            yield item
+
+def _chunks(values, size):
+    values = iter(values)
+    chunk = list(islice(values, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(values, size))
+
+def _analysis_chunks(items, size, workers):
+    """Like _chunks but extends a chunk, up to MAX_ANALYSIS_CHUNK times the
+    size, until it contains an item that may need to be analyzed per
+    worker, so that the analyses of sparse unanalyzed items run in parallel."""
+    chunk = []
+    pending = 0
+    for item in items:
+        chunk.append(item)
+        if _needs_analysis(item):
+            pending += 1
+        if len(chunk) >= size and (pending >= workers or len(chunk) >= size * MAX_ANALYSIS_CHUNK):
+            yield chunk
+            chunk = []
+            pending = 0
+    if chunk:
+        yield chunk
+
+def _group_chunks(values, key, size):
+    """Like _chunks but does not split groups of values with the same key."""
+    chunk = []
+    for _, group in groupby(values, key):
+        chunk.extend(group)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _digest(values):
+    return hashlib.sha1(json.dumps(values).encode('utf-8')).hexdigest()
 
-    def _list2str(self, list):
-        return self._separator.join(list)
+def _needs_analysis(item):
+    return not item.get('bpm') or not item.get('genre_rosamerica')
 
+def _library_file(name):
+    '''Returns the path of a file with the given name next to the library.'''
+    library_dir = os.path.dirname(config['library'].as_filename())
+    return os.path.join(library_dir, name)
 
-def _filter_item(item, all, force):
-    src = item.get('genre_source')
-    empty = not item.get('genre')
-    return (empty or src in SOURCES or not src and all) and (empty or force)
+def _load_yaml(path):
+    '''Like confuse.load_yaml but using libyaml if available, since the
+    defaults are loaded on every beet invocation.'''
+    with open(path, 'r', encoding='utf-8') as f:
+        return yaml.load(f, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
 
 def _is_plugin_enabled(plugin_name):
     enabled_plugins = config['plugins'].get() if config['plugins'].exists() else []
@@ -0,0 +1,48 @@
+from itertools import groupby
+
+# Max. number of album ids per query, below SQLite's variable limit
+ALBUM_IDS_PER_QUERY = 500
+
+AGGREGATE_SQL = '''
+WITH ranked AS (
+    SELECT album_id, genre, ROW_NUMBER() OVER (PARTITION BY album_id ORDER BY {order}) AS pos
+    FROM items
+    WHERE album_id IS NOT NULL AND genre IS NOT NULL AND genre != ''{filter}
+), counts AS (
+    SELECT album_id, genre, COUNT(*) AS n, MIN(pos) AS first
+    FROM ranked
+    GROUP BY album_id, genre
+)
+SELECT counts.album_id, counts.genre, albums.genre
+FROM counts JOIN albums ON albums.id = counts.album_id
+ORDER BY counts.album_id, counts.n DESC, counts.first
+'''
+
+def album_genre_changes(lib, album_ids=None):
+    '''Returns (album_id, genre) tuples for the albums whose most common
+    non-empty item genre differs from the album's genre.
+    Like _most_common() applied to album.items(), ties are resolved in
+    favour of the genre that occurs first in the default item order.
+    The genres of the given albums or, if None, of all albums are
+    aggregated using one grouped query per ALBUM_IDS_PER_QUERY albums.'''
+    order = lib.get_default_item_sort().order_clause()
+    order = order and order + ', id' or 'id'
+    if album_ids is None:
+        return _album_genre_changes(lib, AGGREGATE_SQL.format(order=order, filter=''), ())
+    album_ids = sorted(album_ids)
+    changes = []
+    for i in range(0, len(album_ids), ALBUM_IDS_PER_QUERY):
+        ids = album_ids[i:i+ALBUM_IDS_PER_QUERY]
+        album_filter = ' AND album_id IN ({})'.format(', '.join(['?'] * len(ids)))
+        changes += _album_genre_changes(lib, AGGREGATE_SQL.format(order=order, filter=album_filter), ids)
+    return changes
+
+def _album_genre_changes(lib, sql, subvals):
+    with lib.transaction() as tx:
+        rows = tx.query(sql, subvals)
+    changes = []
+    for album_id, group in groupby(rows, lambda row: row[0]):
+        _, genre, album_genre = next(group)
+        if genre != album_genre:
+            changes.append((album_id, genre))
+    return changes
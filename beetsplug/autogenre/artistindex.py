@@ -0,0 +1,105 @@
+from collections import Counter, defaultdict
+
+# Weight of an item's genre within its artist's distribution per genre_source.
+# Genres derived from the index itself count less, so that they do not
+# outweigh later last.fm or user assignments.
+SOURCE_WEIGHTS = {'user': 2.0, 'lastfm': 1.0, 'library': 0.5}
+
+INDEX_SQL = '''
+SELECT items.id, items.artist, items.albumartist, items.genre, source.value, genres.value
+FROM items
+JOIN item_attributes AS source ON source.entity_id = items.id AND source.key = 'genre_source'
+LEFT JOIN item_attributes AS genres ON genres.entity_id = items.id AND genres.key = 'genres'
+WHERE items.genre IS NOT NULL AND items.genre != '' AND source.value IN ({})
+'''
+
+class ArtistGenreIndex:
+    '''Maps artists to the weighted distribution of the genres of their
+    items within the library, built from the items whose genre_source is
+    one of SOURCE_WEIGHTS using a single query.
+    An artist's genres are only returned if their primary genre is
+    dominant, i.e. it has at least the min_share of the artist's total
+    weight and at least min_items items.
+    The various artists name (va_name) is not indexed as album artist and
+    an item's own genre is not taken into account when looking it up, so
+    that it does not reinforce itself.'''
+
+    def __init__(self, min_items, min_share, va_name=None):
+        self._min_items = min_items
+        self._min_share = min_share
+        self._va_name = _key(va_name)
+        # name -> genre -> [weight, items, Counter of genres lists]
+        self._artists = defaultdict(dict)
+        # item id -> (names, genre, genres, weight) added to the index
+        self._items = {}
+
+    @classmethod
+    def build(cls, lib, min_items, min_share, va_name=None):
+        index = cls(min_items, min_share, va_name)
+        sources = sorted(SOURCE_WEIGHTS)
+        sql = INDEX_SQL.format(', '.join(['?'] * len(sources)))
+        with lib.transaction() as tx:
+            rows = tx.query(sql, sources)
+        for item_id, artist, albumartist, genre, source, genres in rows:
+            index.add(artist, albumartist, genre, genres or genre, source, item_id)
+        return index
+
+    def __len__(self):
+        return len(self._artists)
+
+    def add(self, artist, albumartist, genre, genres, source, item_id=None):
+        weight = SOURCE_WEIGHTS[source]
+        names = self._names(artist, albumartist)
+        if item_id is not None:
+            self._items[item_id] = (names, genre, genres, weight)
+        for name in names:
+            entry = self._artists[name].get(genre)
+            if entry is None:
+                entry = self._artists[name][genre] = [0.0, 0, Counter()]
+            entry[0] += weight
+            entry[1] += 1
+            entry[2][genres] += 1
+
+    def lookup(self, item):
+        '''Returns the dominant genres (as stored within the genres field)
+        of the item's artist or else album artist, or None.'''
+        own = self._items.get(item.get('id'))
+        albumartist = _key(item.get('albumartist'))
+        if albumartist == self._va_name:
+            albumartist = ''
+        for name in (_key(item.get('artist')), albumartist):
+            genres = self._dominant_genres(name, own)
+            if genres:
+                return genres
+        return None
+
+    def _names(self, artist, albumartist):
+        names = {_key(artist)}
+        if _key(albumartist) != self._va_name:
+            names.add(_key(albumartist))
+        names.discard('')
+        return names
+
+    def _dominant_genres(self, name, own=None):
+        distribution = name and self._artists.get(name)
+        if not distribution:
+            return None
+        entries = list(distribution.items())
+        if own and name in own[0]:
+            _, own_genre, own_genres, own_weight = own
+            entries = [(genre, genre == own_genre and _subtract(entry, own_genres, own_weight) or entry)
+                for genre, entry in entries]
+        total = sum(entry[0] for _, entry in entries)
+        _, (weight, items, genres) = max(entries, key=lambda e: e[1][0])
+        if not items or items < self._min_items or weight < total * self._min_share:
+            return None
+        return genres.most_common(1)[0][0]
+
+def _subtract(entry, genres, weight):
+    '''Returns the entry without an item of the given genres and weight.'''
+    counter = entry[2].copy()
+    counter[genres] -= 1
+    return [entry[0] - weight, entry[1] - 1, +counter]
+
+def _key(name):
+    return (name or '').strip().lower()
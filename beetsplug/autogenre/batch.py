@@ -0,0 +1,38 @@
+from beetsplug.autogenre.metrics import NULL_METRICS
+
+class StoreBatch:
+    '''Collects changed items and albums and stores them in batches,
+    each batch within a single library transaction.
+    When used as a context manager, pending changes are stored on exit,
+    also when the run is interrupted.'''
+
+    def __init__(self, lib, size, log, progress=False, metrics=NULL_METRICS):
+        self._lib = lib
+        self._metrics = metrics
+        self._size = max(size, 1)
+        self._log = log
+        self._progress = progress
+        self._pending = []
+        self.stored = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def add(self, obj, fields=None):
+        self._pending.append((obj, fields))
+        if len(self._pending) >= self._size:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        with self._metrics.timer('store'), self._lib.transaction():
+            for obj, fields in pending:
+                obj.store(fields)
+        self.stored += len(pending)
+        if self._progress:
+            self._log.info('Stored {} changes', self.stored)
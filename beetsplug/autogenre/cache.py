@@ -0,0 +1,66 @@
+import time
+from beetsplug.autogenre.sqlitedb import SQLiteDB
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS lastfm (
+    kind TEXT NOT NULL,
+    artist TEXT NOT NULL,
+    album TEXT NOT NULL,
+    title TEXT NOT NULL,
+    genre TEXT,
+    updated REAL NOT NULL,
+    PRIMARY KEY (kind, artist, album, title)
+);
+'''
+
+class LastfmCache(SQLiteDB):
+    '''Persists resolved last.fm genre lookups within a SQLite database.
+    The cached results are dropped when the scope (a digest of the
+    lastgenre settings the results depend on) changes.'''
+
+    def __init__(self, path, scope, ttl, negative_ttl):
+        self._ttl = ttl
+        self._negative_ttl = negative_ttl
+        super().__init__(path, SCHEMA, autocommit=True)
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'scope'").fetchone()
+        if not row or row[0] != scope:
+            with self._db:
+                self._db.execute('DELETE FROM lastfm')
+                self._db.execute("INSERT OR REPLACE INTO meta VALUES ('scope', ?)", (scope,))
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        '''Returns a (found, genre) tuple for the given lookup key.
+        Expired entries are treated as if they were not cached.'''
+        with self._lock:
+            row = self._db.execute(
+                'SELECT genre, updated FROM lastfm WHERE kind = ? AND artist = ? AND album = ? AND title = ?',
+                _key(key)).fetchone()
+            if row:
+                genre, updated = row
+                # A TTL of 0 means that the entries do not expire
+                ttl = self._ttl if genre is not None else self._negative_ttl
+                if not ttl or time.time() - updated < ttl:
+                    self.hits += 1
+                    return True, genre
+            self.misses += 1
+            return False, None
+
+    def set(self, key, genre):
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO lastfm VALUES (?, ?, ?, ?, ?, ?)',
+                _key(key) + (genre or None, time.time()))
+
+def _key(key):
+    '''Maps a (kind, *args) lookup to the (kind, artist, album, title) columns.'''
+    kind, args = key[0], key[1:]
+    if kind == 'track':
+        return (kind, args[0], '', args[1])
+    elif kind == 'album':
+        return (kind, args[0], args[1], '')
+    return (kind, args[0], '', '')
@@ -0,0 +1,112 @@
+import re
+import time
+from beetsplug.autogenre.sqlitedb import SQLiteDB
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS checkpoints (
+    run TEXT PRIMARY KEY,
+    phase INTEGER NOT NULL,
+    last_id INTEGER NOT NULL,
+    items INTEGER NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS evaluated (
+    run TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    PRIMARY KEY (run, id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS albums (
+    run TEXT NOT NULL,
+    album_id INTEGER NOT NULL,
+    PRIMARY KEY (run, album_id)
+) WITHOUT ROWID;
+'''
+
+DURATION_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+class Checkpoints(SQLiteDB):
+    '''Persists the progress of autogenre runs within a SQLite database,
+    keyed by a digest of the run's parameters (query and selection
+    options), so that an interrupted or budgeted run can be resumed.
+    A checkpoint consists of the priority phase and the id of the last
+    item whose changes have been stored, the ids of the items evaluated
+    within earlier phases (since they may match a later phase after
+    their genre changed) and the ids of the albums whose genre has not
+    been updated yet.'''
+
+    def __init__(self, path):
+        super().__init__(path, SCHEMA)
+
+    def get(self, run):
+        '''Returns the (phase, last_id, items) tuple of the run or None.'''
+        with self._lock:
+            return self._db.execute('SELECT phase, last_id, items FROM checkpoints WHERE run = ?',
+                (run,)).fetchone()
+
+    def save(self, run, phase, last_id, items, evaluated_ids=(), album_ids=()):
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?)',
+                (run, phase, last_id, items, time.time()))
+            self._db.executemany('INSERT OR IGNORE INTO evaluated VALUES (?, ?)',
+                [(run, item_id) for item_id in evaluated_ids])
+            self._db.executemany('INSERT OR IGNORE INTO albums VALUES (?, ?)',
+                [(run, album_id) for album_id in album_ids])
+
+    def evaluated(self, run, first_id, last_id):
+        '''Returns the set of ids within the given range of the items
+        evaluated within earlier phases of the run.'''
+        with self._lock:
+            rows = self._db.execute('SELECT id FROM evaluated WHERE run = ? AND id BETWEEN ? AND ?',
+                (run, first_id, last_id)).fetchall()
+        return set(row[0] for row in rows)
+
+    def album_ids(self, run):
+        with self._lock:
+            rows = self._db.execute('SELECT album_id FROM albums WHERE run = ? ORDER BY album_id',
+                (run,)).fetchall()
+        return [row[0] for row in rows]
+
+    def clear_albums(self, run):
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM albums WHERE run = ?', (run,))
+
+    def remove(self, run):
+        with self._lock, self._db:
+            for table in ('checkpoints', 'evaluated', 'albums'):
+                self._db.execute('DELETE FROM {} WHERE run = ?'.format(table), (run,))
+
+class Budget:
+    '''Limits the number of items evaluated and/or the duration of a run
+    (0 means unlimited). The duration is checked between batches.'''
+
+    def __init__(self, max_items=0, max_duration=0, clock=time.monotonic):
+        self._max_items = max_items
+        self._max_duration = max_duration
+        self._clock = clock
+        self._start = clock()
+        self.items = 0
+
+    @property
+    def limited(self):
+        return bool(self._max_items or self._max_duration)
+
+    def remaining_items(self):
+        '''Returns the number of items that may still be evaluated or None.'''
+        if not self._max_items:
+            return None
+        return max(self._max_items - self.items, 0)
+
+    def elapsed(self):
+        return self._clock() - self._start
+
+    def exhausted(self):
+        if self._max_items and self.items >= self._max_items:
+            return True
+        return bool(self._max_duration) and self.elapsed() >= self._max_duration
+
+def parse_duration(value):
+    '''Parses a duration such as 3600, "90m", "8h" or "1.5d" into seconds.'''
+    m = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([smhd]?)\s*', str(value))
+    if not m:
+        raise ValueError("Invalid duration '{}', expected e.g. 3600, 90m or 8h".format(value))
+    return float(m.group(1)) * DURATION_UNITS[m.group(2)]
@@ -0,0 +1,164 @@
+import hashlib
+import os
+import struct
+import threading
+from collections import OrderedDict
+from beetsplug.autogenre.sqlitedb import SQLiteDB
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS content_keys (
+    path BLOB PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    hash TEXT
+);
+'''
+
+SAMPLE_SIZE = 64 * 1024
+# Distances of the sampled chunks from the end of the audio data. Unlike
+# the tags at the start of a file, they are the same for copies of a
+# recording whose tags differ.
+SAMPLE_DISTANCES = (SAMPLE_SIZE, 1024 * 1024, 4 * 1024 * 1024)
+# Version of the audio_hash() digest, the persisted hashes of another
+# version are dropped
+HASH_VERSION = '2'
+
+class ContentKeys(SQLiteDB):
+    '''Derives the keys by which duplicate items are grouped: the item's
+    MusicBrainz track id or, if absent, a hash of the file's audio data.
+    The hashes are persisted within a SQLite database and recomputed only
+    when the file's size or modification time changes.'''
+
+    def __init__(self, path):
+        super().__init__(path, SCHEMA, autocommit=True)
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if not row or row[0] != HASH_VERSION:
+            with self._db:
+                self._db.execute('DELETE FROM content_keys')
+                self._db.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (HASH_VERSION,))
+        self.hashed = 0
+
+    def key(self, item):
+        '''Returns the item's group key or None if the file cannot be read.'''
+        mb_trackid = item.get('mb_trackid')
+        if mb_trackid:
+            return 'mbid:' + mb_trackid
+        content_hash = self.content_hash(item.path)
+        return content_hash and 'hash:' + content_hash
+
+    def content_hash(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        with self._lock:
+            row = self._db.execute('SELECT size, mtime, hash FROM content_keys WHERE path = ?', (path,)).fetchone()
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime:
+            return row[2]
+        try:
+            content_hash = audio_hash(path)
+        except OSError:
+            return None
+        with self._lock:
+            self.hashed += 1
+            self._db.execute('INSERT OR REPLACE INTO content_keys VALUES (?, ?, ?, ?)',
+                (path, stat.st_size, stat.st_mtime, content_hash))
+        return content_hash
+
+class DedupMemo:
+    '''A thread-safe mapping that holds the given number of most recently
+    used entries, e.g. the results resolved per group of duplicates, so
+    that its size is bounded within runs over large libraries.'''
+
+    def __init__(self, size):
+        self._size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self._size:
+                self._entries.popitem(last=False)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries)
+
+def audio_hash(path):
+    '''Returns a digest of the length of the file's audio data and of
+    chunks sampled from its end, i.e. excluding leading ID3v2 tags or FLAC
+    metadata and trailing ID3v1 and APEv2 tags. The audio data of other
+    formats is considered to start at the beginning of the file.'''
+    with open(path, 'rb') as f:
+        start = _audio_start(f)
+        end = _audio_end(f)
+        digest = hashlib.sha1(str(max(end - start, 0)).encode('ascii'))
+        if end < SAMPLE_SIZE:
+            f.seek(0)
+            digest.update(f.read(end))
+        for distance in SAMPLE_DISTANCES:
+            if distance > end:
+                break
+            f.seek(end - distance)
+            digest.update(f.read(SAMPLE_SIZE))
+    return digest.hexdigest()
+
+def _audio_start(f):
+    '''Returns the offset of the start of the audio data.'''
+    f.seek(0)
+    header = f.read(10)
+    if header[:3] == b'ID3' and len(header) == 10:
+        # The size is a synchsafe integer and excludes the header and footer
+        size = 0
+        for byte in header[6:10]:
+            size = size << 7 | byte & 0x7f
+        return 10 + size + (10 if header[5] & 0x10 else 0)
+    if header[:4] == b'fLaC':
+        offset = 4
+        f.seek(offset)
+        block = f.read(4)
+        while len(block) == 4:
+            offset += 4 + int.from_bytes(block[1:4], 'big')
+            if block[0] & 0x80:
+                # The last metadata block
+                break
+            f.seek(offset)
+            block = f.read(4)
+        return offset
+    return 0
+
+def _audio_end(f):
+    '''Returns the offset of the end of the audio data.'''
+    end = f.seek(0, os.SEEK_END)
+    if end >= 128:
+        f.seek(end - 128)
+        if f.read(3) == b'TAG':
+            end -= 128
+    if end >= 32:
+        f.seek(end - 32)
+        footer = f.read(32)
+        if footer[:8] == b'APETAGEX':
+            # The tag size includes the footer but not the optional header
+            size, _, flags = struct.unpack('<III', footer[12:24])
+            end -= size + (32 if flags & 0x80000000 else 0)
+    return max(end, 0)
@@ -0,0 +1,93 @@
+# See https://essentia.upf.edu/svm_models/accuracies_v2.1_beta1.html
+ROSAMERICA_GENRES = {
+    'cla': 'classical',
+    'dan': 'dance', # CAUTION: 'dance' is an out-of-tree genre: might be electronic or rock. better set genre of those tracks manually.
+    'hip': 'hip hop',
+    'jaz': 'jazz',
+    'pop': 'pop',
+    'rhy': 'rhythm and blues',
+    'roc': 'rock',
+    'spe': 'speech'
+}
+ELECTRONIC_GENRES = {
+    'ambient': 'ambient',
+    'dnb': 'drum and bass',
+    'house': 'house',
+    'techno': 'techno',
+    'trance': 'trance',
+}
+# Essentia fields the genre is derived from
+FIELDS = ('genre_rosamerica', 'genre_rosamerica_probability',
+    'genre_electronic', 'genre_electronic_probability')
+
+class EssentiaGenres:
+    '''Derives genres from the results of Essentia's rosamerica and
+    electronic genre models.
+    The thresholds are applied column-wise and the resulting genre tuple
+    is computed once per combination of model labels and threshold
+    outcomes, so that mapping many items costs a few comparisons and a
+    dict lookup per item.'''
+
+    def __init__(self, rosamerica_strong, electronic_strong, electronic_prepend, electronic_append, format_genre=None):
+        self._rosamerica_strong = rosamerica_strong
+        self._electronic_strong = electronic_strong
+        self._electronic_prepend = electronic_prepend
+        self._electronic_append = electronic_append
+        self._format_genre = format_genre or (lambda genre: genre)
+        self._table = {}
+
+    @classmethod
+    def from_config(cls, config, format_genre=None):
+        return cls(config['genre_rosamerica_strong'].as_number(),
+            config['genre_electronic_strong'].as_number(),
+            config['genre_electronic_prepend'].as_number(),
+            config['genre_electronic_append'].as_number(),
+            format_genre)
+
+    def derive_genres(self, items):
+        '''Returns a formatted genre tuple per item or None if an item has
+        not been analyzed.'''
+        analyzed = [item for item in items if 'genre_rosamerica' in item]
+        genres = iter(self.derive_columns(*[[item.get(field) for item in analyzed] for field in FIELDS]))
+        return [next(genres) if 'genre_rosamerica' in item else None for item in items]
+
+    def derive_columns(self, rosamerica, rosamerica_probability, electronic, electronic_probability):
+        '''Returns a formatted genre tuple (or None) per row of the given
+        columns of model labels and probabilities.'''
+        rosamerica_probability = [float(p or 0) for p in rosamerica_probability]
+        electronic_probability = [float(p or 0) for p in electronic_probability]
+        weak_rosamerica = [p < self._rosamerica_strong for p in rosamerica_probability]
+        strong_electronic = [p > self._electronic_strong for p in electronic_probability]
+        prepend_electronic = [p > self._electronic_prepend for p in electronic_probability]
+        append_electronic = [p > self._electronic_append for p in electronic_probability]
+        table = self._table
+        genres = []
+        for key in zip(rosamerica, electronic, weak_rosamerica, strong_electronic, prepend_electronic, append_electronic):
+            g = table.get(key, False)
+            if g is False:
+                g = table[key] = self._derive(*key)
+            genres.append(g)
+        return genres
+
+    def _derive(self, rosamerica, electronic, weak_rosamerica, strong_electronic, prepend_electronic, append_electronic):
+        genre = ROSAMERICA_GENRES.get(rosamerica)
+        genres = [genre]
+        if genre == 'dance':
+            if strong_electronic:
+                # Use the result of Essentia's electronic genre model
+                genres = [ELECTRONIC_GENRES.get(electronic)]
+        elif weak_rosamerica and prepend_electronic:
+            # Prepend electronic to genre list
+            genres = ['electronic', genre]
+            genre_electro = ELECTRONIC_GENRES.get(electronic)
+            if genre_electro: # Append electronic sub genre to list
+                genres.append(genre_electro)
+        if append_electronic:
+            if rosamerica in ('rhy', 'pop', 'hip'):
+                # Append electronic to genre list
+                if 'electronic' not in genres:
+                    genres.append('electronic')
+            elif genres == ['dance']:
+                genres = ['electronic']
+        genres = tuple(self._format_genre(g) for g in genres if g)
+        return genres or None
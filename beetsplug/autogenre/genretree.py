@@ -1,44 +1,164 @@
-import re
-import sys
+import codecs
+import functools
+import hashlib
+import json
+import os
+import pickle
+from beetsplug.autogenre.matcher import GenreMatcher
+
+# Must be incremented whenever the GenreTree's state changes structurally.
+CACHE_VERSION = 2
+# Default max. number of memoized match() results
+MATCH_CACHE_SIZE = 10000
 
 class GenreTree:
-    def __init__(self, genre_tree, genre_whitelist):
+    def __init__(self, genre_tree, genre_whitelist, format_genre=None):
         self._parentmap = _tree2parentmap(genre_tree)
         self._whitelist = set(genre_whitelist)
         self._genres = set(_tree2list(genre_tree))
-        genres = sorted(self._genres, key=lambda g: sys.maxsize-len(g))
-        genre_regex = '|'.join([re.escape(genre) for genre in genres])
-        regex = r'.*?((\[|\()({0})(\)|\])|({0}) +((re)?mix|set|bootleg|music)([^\w]|$))'
-        regex = regex.format(genre_regex)
-        self._regex = re.compile(regex, re.IGNORECASE)
+        self._matcher = GenreMatcher(self._genres)
+        # Precompute the ancestor chain, canonical and formatted form per genre
+        format_genre = format_genre or (lambda genre: genre)
+        self._parents = {}
+        self._ancestors = {}
+        self._canonical = {}
+        self._formatted_parents = {}
+        for genre in self._parentmap.keys():
+            chain = _ancestors(genre, self._parentmap)
+            self._parents[genre] = chain
+            self._ancestors[genre] = frozenset(chain)
+            self._canonical[genre] = next((g for g in chain if g in self._whitelist), chain[-1])
+            self._formatted_parents[genre] = tuple(format_genre(g) for g in chain)
+        self._format_genre = format_genre
+        # Identifies the tree's content, e.g. to detect changes between runs
+        content = json.dumps([sorted(self._parentmap.items()), sorted(self._whitelist)])
+        self.digest = hashlib.sha1(content.encode('utf-8')).hexdigest()
+        self.set_match_cache_size(MATCH_CACHE_SIZE)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_format_genre']
+        del state['_cached_match']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._format_genre = lambda genre: genre
+        self.set_match_cache_size(MATCH_CACHE_SIZE)
+
+    def set_match_cache_size(self, size):
+        '''Replaces the LRU memo of match() results, 0 disables it.'''
+        self._cached_match = size and functools.lru_cache(maxsize=size)(self._match) or None
+
+    def match_cache_info(self):
+        '''Returns the memo's (hits, misses, maxsize, currsize) tuple or None.'''
+        return self._cached_match and self._cached_match.cache_info()
 
     def contains(self, genre):
         return genre.lower() in self._genres
 
     def match(self, title):
-        m = self._regex.match(title)
-        return m and self._canonicalize(m.group(3) or m.group(5)) or None
+        # Matching is case-insensitive and considers the first line only
+        key = title.lower().split('\n', 1)[0]
+        if self._cached_match:
+            return self._cached_match(key)
+        return self._match(key)
+
+    def _match(self, title):
+        m = self._matcher.match(title)
+        return m and self._canonicalize(m) or None
 
     def parents(self, genre):
         genre = genre.lower()
-        parent = self._parentmap.get(genre)
-        return parent and [genre] + self.parents(parent) or [genre]
+        return list(self._parents.get(genre) or (genre,))
+
+    def formatted_parents(self, genre):
+        """Like parents() but returns the formatted genre names."""
+        genre = genre.lower()
+        parents = self._formatted_parents.get(genre)
+        return list(parents or (self._format_genre(genre),))
 
     def is_genre(self, genre, parent):
         genre = genre.lower()
-        if genre == parent.lower():
-            return True
-        p = self._parentmap.get(genre)
-        return p and self.is_genre(p, parent) or False
+        parent = parent.lower()
+        ancestors = self._ancestors.get(genre)
+        return genre == parent or ancestors is not None and parent in ancestors
 
     def _canonicalize(self, genre):
         genre = genre.lower()
-        if genre in self._whitelist:
-            return genre
-        parent = self._parentmap.get(genre)
-        return parent and self._canonicalize(parent) or genre
+        return self._canonical.get(genre, genre)
+
+def load_genre_tree(tree_file, whitelist_file, format_genre, cache_file=None, scope='', rebuild=False, log=None):
+    """Loads the GenreTree from the given files.
+    When a cache file is provided, the built GenreTree is loaded from and
+    stored to it. The cache is invalidated when the version, the files'
+    paths, sizes or modification times or the given scope (representing
+    the formatting settings) change.
+    Failing to write the cache, e.g. next to a read-only library, is
+    logged and otherwise ignored."""
+    key = None
+    if cache_file:
+        key = [CACHE_VERSION, scope] + [_file_stamp(f) for f in (tree_file, whitelist_file)]
+        if not rebuild:
+            tree = _read_cache(cache_file, key)
+            if tree:
+                tree._format_genre = format_genre
+                return tree
+    tree = _read_genre_tree(tree_file, whitelist_file, format_genre)
+    if cache_file:
+        try:
+            _write_cache(cache_file, key, tree)
+        except OSError as e:
+            if log:
+                log.debug('Cannot write the genre tree cache: {}', e)
+    return tree
+
+def _read_genre_tree(tree_file, whitelist_file, format_genre):
+    import yaml
+    with open(whitelist_file, 'r') as f:
+        genre_whitelist = [genre.strip().lower() for genre in f.readlines() if genre.strip()]
+    with codecs.open(tree_file, 'r', encoding='utf-8') as f:
+        genre_tree_yaml = yaml.safe_load(f)
+    return GenreTree(genre_tree_yaml, genre_whitelist, format_genre)
+
+def _file_stamp(path):
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    return [path, st.st_size, st.st_mtime_ns]
+
+def _read_cache(cache_file, key):
+    try:
+        with open(cache_file, 'rb') as f:
+            cached = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        return None
+    if isinstance(cached, dict) and cached.get('key') == key:
+        return cached.get('tree')
+    return None
+
+def _write_cache(cache_file, key, tree):
+    tmp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+    try:
+        with open(tmp_file, 'wb') as f:
+            pickle.dump({'key': key, 'tree': tree}, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+
+def _ancestors(genre, parentmap):
+    """Returns the given genre followed by its ancestors, all lower case."""
+    chain = [genre]
+    parent = parentmap.get(genre)
+    while parent and parent.lower() not in chain:
+        chain.append(parent.lower())
+        parent = parentmap.get(parent.lower())
+    return tuple(chain)
 
-def _tree2parentmap(tree, r={}, parent=None):
+def _tree2parentmap(tree, r=None, parent=None):
+    if r is None:
+        r = {}
     if isinstance(tree, str):
         r[tree.lower()] = parent
     elif isinstance(tree, dict):
@@ -0,0 +1,184 @@
+import asyncio
+import http.client
+import json
+import random
+import threading
+import time
+import urllib.parse
+
+API_URL = 'https://ws.audioscrobbler.com/2.0/'
+METHODS = {
+    'track': ('track.gettoptags', ('artist', 'track')),
+    'album': ('album.gettoptags', ('artist', 'album')),
+    'artist': ('artist.gettoptags', ('artist',)),
+}
+# Characters replaced within request arguments, like lastgenre does.
+REPLACE = {
+    '‐': '-',
+}
+# See https://www.last.fm/api/errorcodes
+ERROR_NOT_FOUND = 6
+TEMPORARY_ERRORS = (8, 11, 16, 29)
+
+class LastfmError(Exception):
+    pass
+
+class TokenBucket:
+    '''Limits the rate of operations to `rate` per second, allowing bursts
+    of up to `capacity` operations.'''
+
+    def __init__(self, rate, capacity=1):
+        self._rate = rate
+        self._capacity = max(capacity, 1)
+        self._tokens = self._capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        '''Takes a token and returns the seconds to wait until it is available.'''
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._updated
+            self._tokens = min(self._capacity, self._tokens + elapsed * self._rate)
+            self._updated = now
+            self._tokens -= 1
+            return self._tokens < 0 and -self._tokens / self._rate or 0
+
+    async def acquire(self):
+        if self._rate > 0:
+            delay = self.reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+class ConnectionPool:
+    '''Keeps idle HTTP connections to a single host for reuse.'''
+
+    def __init__(self, url, timeout):
+        u = urllib.parse.urlsplit(url)
+        self._https = u.scheme == 'https'
+        self.host = u.netloc
+        self.path = u.path or '/'
+        self._timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def request(self, query):
+        '''Sends a GET request and returns the (status, body) tuple.'''
+        conn = self._get()
+        try:
+            conn.request('GET', '{}?{}'.format(self.path, query), headers={'Accept': 'application/json'})
+            resp = conn.getresponse()
+            body = resp.read()
+        except Exception:
+            conn.close()
+            raise
+        if resp.will_close:
+            conn.close()
+        else:
+            self._put(conn)
+        return resp.status, body
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def _get(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        if self._https:
+            return http.client.HTTPSConnection(self.host, timeout=self._timeout)
+        return http.client.HTTPConnection(self.host, timeout=self._timeout)
+
+    def _put(self, conn):
+        with self._lock:
+            self._idle.append(conn)
+
+class LastfmClient:
+    '''Fetches last.fm top tags asynchronously using pooled connections.
+    Requests are rate limited using a token bucket, retried with
+    exponential backoff on temporary errors and identical requests that
+    are in flight concurrently are sent only once.
+    Blocking HTTP requests are run within the event loop's executor.'''
+
+    def __init__(self, api_key, url=API_URL, rate=5, concurrency=8, retries=4, backoff=0.5, timeout=10, log=None):
+        self._api_key = api_key
+        self._pool = ConnectionPool(url, timeout)
+        self._bucket = TokenBucket(rate, max(int(rate), 1))
+        self._concurrency = max(concurrency, 1)
+        self._retries = retries
+        self._backoff = backoff
+        self._log = log
+        self._inflight = {}
+        # The semaphore is bound to the event loop it is used within
+        self._semaphore = None
+        self._semaphore_loop = None
+        self.requests = 0
+
+    def close(self):
+        self._pool.close()
+
+    async def top_tags(self, entity, *args):
+        '''Returns the (name, weight) tuples of the entity's top tags, an
+        empty list if the entity is not known.
+        Raises LastfmError when the request failed permanently.'''
+        key = (entity,) + args
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_top_tags(entity, args))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _fetch_top_tags(self, entity, args):
+        method, arg_names = METHODS[entity]
+        params = {'method': method, 'api_key': self._api_key, 'format': 'json'}
+        for name, value in zip(arg_names, args):
+            for k, v in REPLACE.items():
+                value = value.replace(k, v)
+            params[name] = value
+        query = urllib.parse.urlencode(params)
+        data = await self._request(query)
+        tags = data.get('toptags', {}).get('tag') or []
+        if isinstance(tags, dict):
+            # last.fm returns a single tag as object instead of a list
+            tags = [tags]
+        return [(tag.get('name', ''), int(tag.get('count') or 0)) for tag in tags]
+
+    async def _request(self, query):
+        loop = asyncio.get_running_loop()
+        if self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+            self._semaphore_loop = loop
+        attempt = 0
+        while True:
+            error = None
+            await self._bucket.acquire()
+            async with self._semaphore:
+                try:
+                    self.requests += 1
+                    status, body = await loop.run_in_executor(None, self._pool.request, query)
+                    data = json.loads(body.decode('utf-8')) if body else {}
+                except (OSError, http.client.HTTPException, ValueError) as e:
+                    status, data, error = None, {}, e
+            code = isinstance(data, dict) and data.get('error') or None
+            if code == ERROR_NOT_FOUND:
+                return {}
+            if status == 200 and not code:
+                return data
+            if code:
+                temporary = code in TEMPORARY_ERRORS
+            else:
+                temporary = status is None or status >= 500 or status == 429
+            if not temporary:
+                msg = data.get('message') if isinstance(data, dict) else None
+                raise LastfmError('last.fm request failed with HTTP status {} (error {}): {}'.format(status, code, msg))
+            if attempt >= self._retries:
+                raise LastfmError('last.fm request failed after {} attempts: {}'.format(attempt + 1, error or status or code))
+            delay = self._backoff * 2 ** attempt * (1 + random.random() / 2)
+            attempt += 1
+            if self._log:
+                self._log.debug('Retrying last.fm request in {:.1f}s ({}): {}', delay, error or status or code, query)
+            await asyncio.sleep(delay)
@@ -0,0 +1,52 @@
+import re
+
+OPENING_BRACKETS = '[('
+CLOSING_BRACKETS = ')]'
+SUFFIX_REGEX = re.compile(r' +((re)?mix|set|bootleg|music)([^\w]|$)')
+
+class GenreMatcher:
+    '''Finds the leftmost genre within a title that is either enclosed in
+    brackets, e.g. "[genre]" or "(genre)", or followed by a (re)mix, set,
+    bootleg or music suffix. When multiple genres match at the same
+    position, the longest one wins.
+    Matching is case-insensitive and uses a character trie of the genres
+    in order to scan each title only once.'''
+
+    def __init__(self, genres):
+        self._trie = {}
+        for genre in genres:
+            if not genre:
+                continue
+            node = self._trie
+            for c in genre.lower():
+                node = node.setdefault(c, {})
+            node[None] = True
+
+    def match(self, title):
+        '''Returns the matched genre (lower case) or None.'''
+        text = title.lower().split('\n', 1)[0]
+        root = self._trie
+        for i, c in enumerate(text):
+            if c in OPENING_BRACKETS:
+                for end in self._ends(text, i+1):
+                    if end < len(text) and text[end] in CLOSING_BRACKETS:
+                        return text[i+1:end]
+            if c in root:
+                for end in self._ends(text, i):
+                    if SUFFIX_REGEX.match(text, end):
+                        return text[i:end]
+        return None
+
+    def _ends(self, text, start):
+        '''Returns the end positions of the genres that start at the given
+        position within the text, longest first.'''
+        ends = []
+        node = self._trie
+        for i in range(start, len(text)):
+            node = node.get(text[i])
+            if node is None:
+                break
+            if None in node:
+                ends.append(i+1)
+        ends.reverse()
+        return ends
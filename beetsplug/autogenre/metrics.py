@@ -0,0 +1,159 @@
+import functools
+import json
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)
+PROMETHEUS_PREFIX = 'autogenre'
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.buckets[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+class Metrics:
+    '''Collects per-stage latency histograms and counters of a run.
+    Counters may be labeled, e.g. count('genre_source', source='lastfm').'''
+    enabled = True
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = Counter()
+
+    def count(self, name, n=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] += n
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def timer(self, stage):
+        return _Timer(self, stage)
+
+    def summary(self):
+        '''Returns the summary as list of lines.'''
+        with self._lock:
+            lines = ['{:<16} {:>9} {:>11} {:>10} {:>10}'.format('stage', 'calls', 'total [s]', 'mean [ms]', 'max [ms]')]
+            for stage, h in sorted(self._histograms.items()):
+                lines.append('{:<16} {:>9} {:>11.3f} {:>10.3f} {:>10.3f}'.format(
+                    stage, h.count, h.sum, h.sum * 1000 / h.count, h.max * 1000))
+            for (name, labels), n in sorted(self._counters.items()):
+                lines.append('{}{} = {}'.format(name, _format_labels(labels, '{}={}'), n))
+            return lines
+
+    def to_json(self):
+        with self._lock:
+            return {
+                'stages': {stage: {
+                    'count': h.count,
+                    'sum': h.sum,
+                    'max': h.max,
+                    'buckets': dict(zip([str(b) for b in BUCKETS] + ['+Inf'], h.buckets)),
+                } for stage, h in sorted(self._histograms.items())},
+                'counters': [dict(name=name, labels=dict(labels), value=n)
+                    for (name, labels), n in sorted(self._counters.items())],
+            }
+
+    def to_prometheus(self):
+        '''Returns the metrics in the Prometheus text exposition format.'''
+        lines = []
+        with self._lock:
+            name = '{}_stage_seconds'.format(PROMETHEUS_PREFIX)
+            if self._histograms:
+                lines.append('# TYPE {} histogram'.format(name))
+            for stage, h in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, n in zip(list(BUCKETS) + ['+Inf'], h.buckets):
+                    cumulative += n
+                    lines.append('{}_bucket{{stage="{}",le="{}"}} {}'.format(name, stage, bound, cumulative))
+                lines.append('{}_sum{{stage="{}"}} {}'.format(name, stage, h.sum))
+                lines.append('{}_count{{stage="{}"}} {}'.format(name, stage, h.count))
+            typed = set()
+            for (counter, labels), n in sorted(self._counters.items()):
+                name = '{}_{}_total'.format(PROMETHEUS_PREFIX, counter)
+                if name not in typed:
+                    typed.add(name)
+                    lines.append('# TYPE {} counter'.format(name))
+                lines.append('{}{} {}'.format(name, _format_labels(labels, '{}="{}"'), n))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        '''Writes the metrics to a JSON file if the path ends with .json,
+        otherwise to a Prometheus textfile.'''
+        if path.endswith('.json'):
+            content = json.dumps(self.to_json(), indent=2)
+        else:
+            content = self.to_prometheus()
+        with open(path, 'w') as f:
+            f.write(content)
+
+class NullMetrics:
+    '''Ignores all metrics. Used when metrics are disabled.'''
+    enabled = False
+
+    def count(self, name, n=1, **labels):
+        pass
+
+    def observe(self, stage, seconds):
+        pass
+
+    def timer(self, stage):
+        return _NULL_TIMER
+
+class _Timer:
+    def __init__(self, metrics, stage):
+        self._metrics = metrics
+        self._stage = stage
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._metrics.observe(self._stage, time.perf_counter() - self._start)
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+_NULL_TIMER = _NullTimer()
+NULL_METRICS = NullMetrics()
+
+def timed(stage):
+    '''Decorates a method to record its latency within the metrics
+    referenced by the instance's _metrics attribute.'''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            metrics = self._metrics
+            if not metrics.enabled:
+                return func(self, *args, **kwargs)
+            with metrics.timer(stage):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+def _format_labels(labels, fmt):
+    if not labels:
+        return ''
+    return '{' + ','.join(fmt.format(k, v) for k, v in labels) + '}'
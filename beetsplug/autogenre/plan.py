@@ -0,0 +1,79 @@
+import json
+from beets.library import Item
+
+class PlanWriter:
+    '''Writes the genre changes of items to a JSON Lines plan file instead
+    of storing them, one {"id", "genre", "genres", "source"} object per
+    line, so that they can be applied later using read_plans().
+    It is used in place of a StoreBatch. Album changes are not written
+    since the album genres are derived from the item genres when the
+    plan is applied. When resuming a run, the records are appended.'''
+
+    def __init__(self, path, log, append=False):
+        self._path = path
+        self._log = log
+        self._file = open(path, append and 'a' or 'w', encoding='utf-8')
+        self.stored = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def add(self, obj, fields=None):
+        if not isinstance(obj, Item):
+            return
+        record = {
+            'id': obj.id,
+            'genre': obj.get('genre'),
+            'genres': obj.get('genres'),
+            'source': obj.get('genre_source'),
+        }
+        fingerprint = obj.get('genre_fingerprint')
+        if fingerprint:
+            record['fingerprint'] = fingerprint
+        self._write(record)
+        self.stored += 1
+
+    def add_analysis(self, item_id, values):
+        '''Writes the Essentia results of an item that have not been stored.'''
+        self._write({'id': item_id, 'analysis': values})
+
+    def _write(self, record):
+        self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+        self._log.info('Wrote {} changes to {}', self.stored, self._path)
+
+def read_plans(paths, log):
+    '''Merges the records of the given plan files by item id, records of
+    later files taking precedence over those of earlier files.
+    Lines that cannot be parsed, e.g. of an interrupted run, are skipped.'''
+    records = {}
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for n, line in enumerate(f, 1):
+                try:
+                    record = json.loads(line)
+                    item_id = int(record.pop('id'))
+                except (ValueError, KeyError, TypeError):
+                    log.warning('Skipping invalid line {} of plan {}', n, path)
+                    continue
+                records.setdefault(item_id, {}).update(record)
+    return records
+
+def parse_shard(value):
+    '''Parses a shard specification "i/N" into an (index, count) tuple
+    with 0 <= index < count, where i is 1-based.'''
+    try:
+        i, n = (int(v) for v in value.split('/'))
+    except ValueError:
+        raise ValueError("Invalid shard '{}', expected i/N, e.g. 1/4".format(value))
+    if n < 1 or not 1 <= i <= n:
+        raise ValueError("Invalid shard '{}', expected 1 <= i <= N".format(value))
+    return i - 1, n
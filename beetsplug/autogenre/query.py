@@ -0,0 +1,107 @@
+from beets.dbcore.query import Query
+
+SOURCES = set(('library', 'lastfm', 'title', 'essentia', 'user'))
+
+class GenreSelectionQuery(Query):
+    '''Matches the items whose genre should be (re)evaluated, see
+    filter_item(). Unlike a query on the genre_source flexible attribute,
+    it is evaluated by SQLite directly.'''
+
+    def __init__(self, all, force):
+        self.all = all
+        self.force = force
+
+    def clause(self):
+        empty = "(items.genre IS NULL OR items.genre = '')"
+        if not self.force:
+            return empty, ()
+        sources = sorted(SOURCES)
+        placeholders = ', '.join(['?'] * len(sources))
+        if self.all:
+            # Any item except those with a genre_source that is not known
+            subquery = ("items.id NOT IN (SELECT entity_id FROM item_attributes"
+                " WHERE key = 'genre_source' AND value != '' AND value NOT IN ({}))")
+        else:
+            subquery = ("items.id IN (SELECT entity_id FROM item_attributes"
+                " WHERE key = 'genre_source' AND value IN ({}))")
+        clause = '({} OR {})'.format(empty, subquery.format(placeholders))
+        return clause, sources
+
+    def match(self, item):
+        return filter_item(item, self.all, self.force)
+
+    def __repr__(self):
+        return '{}(all={!r}, force={!r})'.format(self.__class__.__name__, self.all, self.force)
+
+    def __eq__(self, other):
+        return super().__eq__(other) and self.all == other.all and self.force == other.force
+
+    def __hash__(self):
+        return hash((self.all, self.force))
+
+def filter_item(item, all, force):
+    src = item.get('genre_source')
+    empty = not item.get('genre')
+    return (empty or src in SOURCES or not src and all) and (empty or force)
+
+class ShardQuery(Query):
+    '''Matches the items of the given shard (0-based index) out of count
+    shards. Items are partitioned by album id, singletons by item id,
+    so that the items of an album belong to the same shard.'''
+
+    def __init__(self, index, count):
+        self.index = index
+        self.count = count
+
+    def clause(self):
+        return '(COALESCE(items.album_id, items.id) % ?) = ?', (self.count, self.index)
+
+    def match(self, item):
+        return (item.album_id or item.id) % self.count == self.index
+
+    def __repr__(self):
+        return '{}(index={!r}, count={!r})'.format(self.__class__.__name__, self.index, self.count)
+
+    def __eq__(self, other):
+        return super().__eq__(other) and self.index == other.index and self.count == other.count
+
+    def __hash__(self):
+        return hash((self.index, self.count))
+
+# Evaluation order of the items when prioritizing: items without genre,
+# then items whose genre was estimated by Essentia, then all others.
+PRIORITIES = ('untagged', 'essentia', 'other')
+
+class PriorityQuery(Query):
+    '''Matches the items of the given priority, see PRIORITIES.'''
+
+    def __init__(self, priority):
+        assert priority in PRIORITIES, "Unknown priority '{}'".format(priority)
+        self.priority = priority
+
+    def clause(self):
+        empty = "(items.genre IS NULL OR items.genre = '')"
+        if self.priority == 'untagged':
+            return empty, ()
+        subquery = ("items.id IN (SELECT entity_id FROM item_attributes"
+            " WHERE key = 'genre_source' AND value = 'essentia')")
+        if self.priority == 'other':
+            subquery = 'NOT ' + subquery
+        return 'NOT {} AND {}'.format(empty, subquery), ()
+
+    def match(self, item):
+        return item_priority(item) == self.priority
+
+    def __repr__(self):
+        return '{}(priority={!r})'.format(self.__class__.__name__, self.priority)
+
+    def __eq__(self, other):
+        return super().__eq__(other) and self.priority == other.priority
+
+    def __hash__(self):
+        return hash(self.priority)
+
+def item_priority(item):
+    if not item.get('genre'):
+        return 'untagged'
+    return item.get('genre_source') == 'essentia' and 'essentia' or 'other'
@@ -0,0 +1,28 @@
+import sqlite3
+import threading
+
+# Seconds to wait for a lock held by another connection, e.g. of a
+# concurrent import, before failing with 'database is locked'
+TIMEOUT = 30
+
+class SQLiteDB:
+    '''Base class of the plugin's SQLite databases: a single connection
+    that is shared between threads, guarded by a lock and uses write-ahead
+    logging. In autocommit mode, each statement is committed immediately
+    unless it is executed within a `with self._db` block.'''
+
+    def __init__(self, path, schema, autocommit=False):
+        self._lock = threading.Lock()
+        isolation_level = None if autocommit else ''
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=TIMEOUT, isolation_level=isolation_level)
+        try:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.executescript(schema)
+        except sqlite3.Error:
+            self._db.close()
+            raise
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,44 @@
+import time
+from beetsplug.autogenre.sqlitedb import SQLiteDB
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS queue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    entity_id INTEGER NOT NULL,
+    queued REAL NOT NULL,
+    UNIQUE (kind, entity_id)
+);
+'''
+
+class WorkQueue(SQLiteDB):
+    '''Persists the ids of imported items and albums whose genres are
+    resolved later within a SQLite database.
+    Entries are removed only after they have been processed, so that
+    an interrupted run resumes where it stopped.'''
+
+    def __init__(self, path):
+        super().__init__(path, SCHEMA)
+
+    def put(self, kind, entity_ids):
+        '''Enqueues the ids of the given kind ('item' or 'album') unless
+        they are queued already.'''
+        now = time.time()
+        with self._lock, self._db:
+            self._db.executemany('INSERT OR IGNORE INTO queue (kind, entity_id, queued) VALUES (?, ?, ?)',
+                [(kind, entity_id, now) for entity_id in entity_ids])
+
+    def entries(self, limit, after=0):
+        '''Returns up to limit (id, kind, entity_id) tuples with an id
+        greater than the given one, in the order they were enqueued.'''
+        with self._lock:
+            return self._db.execute('SELECT id, kind, entity_id FROM queue WHERE id > ? ORDER BY id LIMIT ?',
+                (after, limit)).fetchall()
+
+    def remove(self, entries):
+        with self._lock, self._db:
+            self._db.executemany('DELETE FROM queue WHERE id = ?', [(e[0],) for e in entries])
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM queue').fetchone()[0]
@@ -0,0 +1,69 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from beets.library import FileOperationError
+from beets.util import displayable_path, syspath
+from beetsplug.autogenre.metrics import NULL_METRICS
+
+class TagWriter:
+    '''Writes the tags of items, whose changes have been stored within the
+    library already, to their files using a thread pool.
+    Failed writes are retried with exponential backoff. The files that
+    could not be written are collected as (path, error) tuples.'''
+
+    def __init__(self, workers, retries, log, metrics=NULL_METRICS, backoff=0.5):
+        self._workers = max(workers, 1)
+        self._retries = retries
+        self._log = log
+        self._metrics = metrics
+        self._backoff = backoff
+        self._pending = []
+        self.written = 0
+        self.failures = []
+
+    def add(self, item):
+        self._pending.append(item)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def flush(self):
+        '''Writes the pending items' tags and returns the written items.'''
+        if not self._pending:
+            return []
+        pending, self._pending = self._pending, []
+        written = []
+        with ThreadPoolExecutor(max_workers=self._workers) as pool:
+            for item, failure in zip(pending, pool.map(self._write, pending)):
+                if failure:
+                    self.failures.append(failure)
+                else:
+                    written.append(item)
+        self.written += len(written)
+        return written
+
+    def _write(self, item):
+        '''Writes the item's tags and returns None or, if all attempts
+        failed, a (path, error) tuple.'''
+        attempt = 0
+        while True:
+            try:
+                with self._metrics.timer('write'):
+                    item.write()
+                return None
+            except FileOperationError as e:
+                if attempt >= self._retries or not os.path.exists(syspath(item.path)):
+                    self._log.error('{}', e)
+                    self._metrics.count('write_failures')
+                    return displayable_path(item.path), str(e)
+                delay = self._backoff * 2 ** attempt
+                attempt += 1
+                self._metrics.count('write_retries')
+                self._log.debug('Retrying to write {} in {:.1f}s: {}', displayable_path(item.path), delay, e)
+                time.sleep(delay)
+
+    def write_report(self, path):
+        '''Writes the paths and errors of the files that could not be written.'''
+        with open(path, 'w', encoding='utf-8') as f:
+            for file_path, error in self.failures:
+                f.write('{}\t{}\n'.format(file_path, error))
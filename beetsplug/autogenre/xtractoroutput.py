@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import re
+from beetsplug.xtractor.helper import extract_value_from_audiodata
+
+_KEY_SEPARATOR = re.compile(r'\s*:\s*')
+
+class XtractorOutput:
+    '''Reads the results of earlier Essentia analyses from the JSON files
+    that xtractor keeps within its output directory (keep_output), named
+    after the item's MusicBrainz track id or the MD5 hash of its path.
+    The directory is listed once. Of a file, only the top-level sections
+    (e.g. highlevel, rhythm) that contain the requested targets are
+    decoded, skipping the large lowlevel section.'''
+
+    def __init__(self, output_dir, targets):
+        self._dir = output_dir
+        self._targets = targets
+        self._sections = {target['path'].as_str().split('.', 1)[0] for target in targets.values()}
+        self._decoder = json.JSONDecoder()
+        self._names = None
+
+    @classmethod
+    def from_config(cls, config, output_dir, fields):
+        '''Creates an instance reading the given fields as configured
+        within xtractor's low_level_targets and high_level_targets.'''
+        targets = {}
+        for key in ('low_level_targets', 'high_level_targets'):
+            for field in config[key].keys():
+                if field in fields:
+                    targets[field] = config[key][field]
+        return cls(output_dir, targets)
+
+    def find(self, item):
+        '''Returns the path of the item's output file or None.'''
+        if self._names is None:
+            self._names = _list_json_files(self._dir)
+        for name in _output_names(item):
+            if name in self._names:
+                return os.path.join(self._dir, name)
+        return None
+
+    def rescan(self):
+        '''Lists the output directory again on the next lookup.'''
+        self._names = None
+
+    def load(self, item):
+        '''Returns the target values found within the item's output file,
+        an empty dict if there is none.'''
+        path = self.find(item)
+        if not path:
+            return {}
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = self._decode_sections(f.read())
+        except (OSError, ValueError):
+            return {}
+        values = {}
+        for field, target in self._targets.items():
+            try:
+                values[field] = extract_value_from_audiodata(data, target)
+            except (AttributeError, TypeError, ValueError):
+                pass
+        return values
+
+    def _decode_sections(self, text):
+        '''Decodes the required top-level sections only, falling back to
+        decoding the whole document if a section cannot be located.'''
+        data = {}
+        for section in self._sections:
+            value = self._find_section(text, section)
+            if value is None:
+                return json.loads(text)
+            data[section] = value
+        return data
+
+    def _find_section(self, text, section):
+        key = '"{}"'.format(section)
+        start = text.find(key)
+        while start >= 0:
+            separator = _KEY_SEPARATOR.match(text, start + len(key))
+            if separator:
+                try:
+                    value, _ = self._decoder.raw_decode(text, separator.end())
+                except ValueError:
+                    value = None
+                # Nested objects may use the same key as a top-level section.
+                if isinstance(value, dict) and self._is_section(section, value):
+                    return value
+            start = text.find(key, start + len(key))
+        return None
+
+    def _is_section(self, section, value):
+        '''Returns whether the path of any target within the section
+        resolves to a value.'''
+        for target in self._targets.values():
+            parts = target['path'].as_str().split('.')
+            if parts[0] != section:
+                continue
+            node = value
+            for part in parts[1:]:
+                if not isinstance(node, dict) or part not in node:
+                    break
+                node = node[part]
+            else:
+                return True
+        return False
+
+def _list_json_files(path):
+    try:
+        with os.scandir(path) as entries:
+            return {entry.name for entry in entries if entry.name.endswith('.json')}
+    except OSError:
+        return set()
+
+def _output_names(item):
+    '''Yields the file names xtractor may have used for the item's output.'''
+    mb_trackid = item.get('mb_trackid')
+    if mb_trackid and '/' not in mb_trackid:
+        yield '{}.json'.format(mb_trackid)
+    path = item.get('path')
+    if path:
+        yield '{}.json'.format(hashlib.md5(path).hexdigest())
@@ -0,0 +1,99 @@
+'''Compares the per-item Essentia genre mapping autogenre used before with
+the column-wise EssentiaGenres mapping.
+Usage: python -m benchmarks.bench_essentia [--items N]'''
+import argparse
+import random
+import sys
+import confuse
+from beetsplug.autogenre.essentia import EssentiaGenres, ELECTRONIC_GENRES, ROSAMERICA_GENRES
+from benchmarks.common import timed
+
+SEPARATOR = ', '
+SETTINGS = {
+    'genre_rosamerica_strong': 0.8,
+    'genre_electronic_strong': 0.8,
+    'genre_electronic_prepend': 0.5,
+    'genre_electronic_append': 0.45,
+}
+
+def format_genre(genre):
+    return genre and genre.title()
+
+class LegacyMapper:
+    '''The per-item mapping of the former AutoGenrePlugin._essentia_genre(),
+    reading the thresholds from the configuration for every item and
+    returning a formatted genre list string.'''
+    def __init__(self, config):
+        self.config = config
+
+    def map(self, item):
+        if 'genre_rosamerica' not in item:
+            return None
+        genre_rosamerica = item['genre_rosamerica']
+        genre_rosamerica_probability = float(item['genre_rosamerica_probability'])
+        genre_electronic = item['genre_electronic']
+        genre_electronic_probability = float(item['genre_electronic_probability'])
+        genre = ROSAMERICA_GENRES.get(genre_rosamerica)
+        genre_electronic_strong = self.config['genre_electronic_strong'].get()
+        genre_rosamerica_strong = self.config['genre_rosamerica_strong'].get()
+        genre_electronic_prepend = self.config['genre_electronic_prepend'].get()
+        genre_electronic_append = self.config['genre_electronic_append'].get()
+        if genre == 'dance':
+            if genre_electronic_probability > genre_electronic_strong:
+                genre = ELECTRONIC_GENRES.get(genre_electronic)
+        elif genre_rosamerica_probability < genre_rosamerica_strong and genre_electronic_probability > genre_electronic_prepend:
+            genres = ['electronic'] + [genre]
+            genre_electro = ELECTRONIC_GENRES.get(genre_electronic)
+            if genre_electro:
+                genres += [genre_electro]
+            genre = SEPARATOR.join(genres)
+        if genre_electronic_probability > genre_electronic_append:
+            if genre_rosamerica in ('rhy', 'pop', 'hip'):
+                genres = genre and genre.split(SEPARATOR) or []
+                if 'electronic' not in genres:
+                    genre = SEPARATOR.join(genres + ['electronic'])
+            elif genre == 'dance':
+                genre = 'electronic'
+        return format_genre(genre)
+
+def synthetic_items(n, seed=42):
+    '''Generates items with Essentia results, probabilities as strings
+    like untyped flexible attributes loaded from the library.'''
+    rnd = random.Random(seed)
+    rosamerica = sorted(ROSAMERICA_GENRES)
+    electronic = sorted(ELECTRONIC_GENRES)
+    return [{
+        'genre_rosamerica': rnd.choice(rosamerica),
+        'genre_rosamerica_probability': str(round(rnd.random(), 6)),
+        'genre_electronic': rnd.choice(electronic),
+        'genre_electronic_probability': str(round(rnd.random(), 6)),
+    } for _ in range(n)]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--items', type=int, default=1000000)
+    args = parser.parse_args()
+
+    config = confuse.Configuration('autogenre-benchmark', read=False)
+    config.set(SETTINGS)
+    items = synthetic_items(args.items)
+    print('{} items'.format(len(items)))
+
+    legacy = LegacyMapper(config)
+    expected, legacy_time = timed(lambda: [legacy.map(item) for item in items])
+    def derive():
+        testee = EssentiaGenres.from_config(config, format_genre)
+        return [g and SEPARATOR.join(g) for g in testee.derive_genres(items)]
+    actual, column_time = timed(derive)
+    mismatches = [(i, e, a) for i, e, a in zip(items, expected, actual) if e != a]
+
+    print('{:<10} {:>10} {:>14} {:>12}'.format('', 'time [s]', 'items/s', 'us/item'))
+    for name, d in (('per-item', legacy_time), ('columns', column_time)):
+        print('{:<10} {:>10.3f} {:>14.0f} {:>12.3f}'.format(name, d, len(items)/d, d*1e6/len(items)))
+    print('mismatches: {}'.format(len(mismatches)))
+    for m in mismatches[:10]:
+        print('  MISMATCH {!r}: per-item={!r} columns={!r}'.format(*m))
+    return 1 if mismatches else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+'''Compares the GenreTree title matcher with the previously used regex,
+measures the GenreTree parents()/is_genre() throughput and the effect of
+the match() memo on an album-structured library.
+Usage: python -m benchmarks.bench_genretree [--titles N] [--lookups N] [--album-size N]'''
+import argparse
+import random
+import re
+import sys
+from beetsplug.autogenre.genretree import MATCH_CACHE_SIZE, GenreTree, _tree2parentmap
+from beetsplug.autogenre.matcher import GenreMatcher
+from benchmarks.common import load_genre_tree_yaml, load_genre_whitelist, synthetic_titles, timed
+
+def legacy_regex(genres):
+    '''Builds the alternation regex the GenreTree used before the GenreMatcher.'''
+    genres = sorted(genres, key=lambda g: sys.maxsize-len(g))
+    genre_regex = '|'.join([re.escape(genre) for genre in genres])
+    regex = r'.*?((\[|\()({0})(\)|\])|({0}) +((re)?mix|set|bootleg|music)([^\w]|$))'
+    return re.compile(regex.format(genre_regex), re.IGNORECASE)
+
+def legacy_match(regex, title):
+    m = regex.match(title)
+    return m and (m.group(3) or m.group(5)).lower() or None
+
+class LegacyLookups:
+    '''The recursive parents()/is_genre() implementation GenreTree used
+    before it precomputed the ancestor chains.'''
+    def __init__(self, genre_tree):
+        self._parentmap = _tree2parentmap(genre_tree)
+
+    def parents(self, genre):
+        genre = genre.lower()
+        parent = self._parentmap.get(genre)
+        return parent and [genre] + self.parents(parent) or [genre]
+
+    def is_genre(self, genre, parent):
+        genre = genre.lower()
+        if genre == parent.lower():
+            return True
+        p = self._parentmap.get(genre)
+        return p and self.is_genre(p, parent) or False
+
+def bench_lookups(tree, legacy, n):
+    rnd = random.Random(42)
+    genres = sorted(tree._parentmap.keys())
+    pairs = [(rnd.choice(genres).title(), rnd.choice(genres)) for _ in range(n)]
+    print('{:<22} {:>12} {:>14}'.format('', 'time [s]', 'lookups/s'))
+    for name, testee in (('legacy', legacy), ('precomputed', tree)):
+        _, d = timed(lambda: [testee.parents(g) for g, _ in pairs])
+        print('{:<22} {:>12.3f} {:>14.0f}'.format(name + ' parents', d, n/d))
+        _, d = timed(lambda: [testee.is_genre(g, p) for g, p in pairs])
+        print('{:<22} {:>12.3f} {:>14.0f}'.format(name + ' is_genre', d, n/d))
+    mismatches = [g for g, p in pairs if tree.parents(g) != legacy.parents(g) or tree.is_genre(g, p) != legacy.is_genre(g, p)]
+    print('lookup mismatches: {}'.format(len(mismatches)))
+    return mismatches
+
+def bench_match_cache(tree, titles, album_size):
+    '''Matches title and, unless matched, album name per item like
+    AutoGenrePlugin._fix_remix_genre, with and without the memo.
+    Half of the titles are drawn from a pool in order to model
+    compilations and DJ mixes that repeat titles.'''
+    rnd = random.Random(42)
+    pool = titles[:1000]
+    albums = ['Album {} ({} mix)'.format(n, rnd.choice(titles[:50])) for n in range(len(titles) // album_size + 1)]
+    items = [(rnd.random() < 0.5 and rnd.choice(pool) or title, albums[i // album_size])
+        for i, title in enumerate(titles)]
+    def fix(items):
+        return [tree.match(title) or tree.match(album) for title, album in items]
+    print('{:<10} {:>12} {:>14} {:>10}'.format('', 'match [s]', 'items/s', 'hit rate'))
+    results = []
+    for name, size in (('uncached', 0), ('memo', MATCH_CACHE_SIZE)):
+        tree.set_match_cache_size(size)
+        r, d = timed(fix, items)
+        results.append(r)
+        info = tree.match_cache_info()
+        hit_rate = info and '{:.1f}%'.format(info.hits * 100 / (info.hits + info.misses)) or '-'
+        print('{:<10} {:>12.3f} {:>14.0f} {:>10}'.format(name, d, len(items)/d, hit_rate))
+    mismatches = [i for i, (a, b) in enumerate(zip(*results)) if a != b]
+    print('memo mismatches: {}'.format(len(mismatches)))
+    return mismatches
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--titles', type=int, default=100000)
+    parser.add_argument('--lookups', type=int, default=1000000)
+    parser.add_argument('--album-size', type=int, default=20)
+    args = parser.parse_args()
+
+    genre_tree = load_genre_tree_yaml()
+    tree, build = timed(GenreTree, genre_tree, load_genre_whitelist())
+    print('GenreTree built within {:.3f}s'.format(build))
+    genres = tree._genres
+    titles = synthetic_titles(args.titles, genres)
+    print('{} genres, {} titles'.format(len(genres), len(titles)))
+
+    regex, regex_compile = timed(legacy_regex, genres)
+    matcher, matcher_build = timed(GenreMatcher, genres)
+    expected, regex_match = timed(lambda: [legacy_match(regex, t) for t in titles])
+    actual, matcher_match = timed(lambda: [matcher.match(t) for t in titles])
+    mismatches = [(t, e, a) for t, e, a in zip(titles, expected, actual) if e != a]
+
+    print('{:<10} {:>10} {:>12} {:>14}'.format('', 'build [s]', 'match [s]', 'titles/s'))
+    print('{:<10} {:>10.3f} {:>12.3f} {:>14.0f}'.format('regex', regex_compile, regex_match, len(titles)/regex_match))
+    print('{:<10} {:>10.3f} {:>12.3f} {:>14.0f}'.format('trie', matcher_build, matcher_match, len(titles)/matcher_match))
+    print('matched: {}, mismatches: {}'.format(len([e for e in expected if e]), len(mismatches)))
+    for m in mismatches[:10]:
+        print('  MISMATCH {!r}: regex={!r} trie={!r}'.format(*m))
+    print()
+    lookup_mismatches = bench_lookups(tree, LegacyLookups(genre_tree), args.lookups)
+    print()
+    memo_mismatches = bench_match_cache(tree, titles, args.album_size)
+    return 1 if mismatches or lookup_mismatches or memo_mismatches else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,206 @@
+'''Measures the throughput of the autogenre command and import stage on a
+synthetic library, using local fakes for last.fm and the Essentia analysis.
+Each scenario runs within a separate process in order to report its own
+peak RSS.
+Usage: python -m benchmarks.bench_pipeline [--items N] [--album-size N]
+    [--lastfm-latency S] [--analysis-latency S] [--analyzed F]
+    [--scenario command|import] [--args ARGS] [--set KEY=VALUE] [--json FILE]'''
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shlex
+import sys
+import tempfile
+import time
+import zlib
+from types import SimpleNamespace
+import yaml
+from benchmarks.common import GENRE_TREE_FILE, GENRE_WHITELIST_FILE, synthetic_titles
+
+SCENARIOS = ('command', 'import')
+LASTFM_GENRES = ('Rock, Pop', 'Jazz', 'House, Electronic', 'Techno', 'Hip Hop', None)
+ROSAMERICA = ('cla', 'dan', 'hip', 'jaz', 'pop', 'rhy', 'roc', 'spe')
+ELECTRONIC = ('ambient', 'dnb', 'house', 'techno', 'trance')
+
+class Timer:
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+
+    def wrap(self, func):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.seconds += time.perf_counter() - start
+                self.calls += 1
+        return timed
+
+def essentia_fields(rnd):
+    return {
+        'genre_rosamerica': rnd.choice(ROSAMERICA),
+        'genre_rosamerica_probability': round(rnd.random(), 6),
+        'genre_electronic': rnd.choice(ELECTRONIC),
+        'genre_electronic_probability': round(rnd.random(), 6),
+        'bpm': rnd.randint(60, 180),
+    }
+
+def fake_lastfm_genre(key):
+    '''Returns a deterministic genre (or None) per lookup key.'''
+    return LASTFM_GENRES[zlib.crc32(repr(key).encode('utf-8')) % len(LASTFM_GENRES)]
+
+def parse_settings(values):
+    '''Parses KEY=VALUE strings with YAML values into a dict.'''
+    settings = {}
+    for value in values:
+        k, v = value.split('=', 1)
+        settings[k] = yaml.safe_load(v)
+    return settings
+
+def configure(tmpdir, settings):
+    from beets import config
+    config.clear()
+    config.read(user=False, defaults=True)
+    config['plugins'] = ['autogenre', 'lastgenre', 'xtractor']
+    config['library'] = os.path.join(tmpdir, 'library.db')
+    config['directory'] = tmpdir
+    config['lastgenre'] = {'whitelist': GENRE_WHITELIST_FILE, 'canonical': GENRE_TREE_FILE, 'count': 3}
+    config['import']['write'] = False
+    for k, v in settings.items():
+        config['autogenre'][k] = v
+
+def build_library(lib, opts):
+    '''Adds albums of synthetic items to the library, some of them
+    analyzed already, and returns the album ids.'''
+    from beets.library import Album, Item
+    rnd = random.Random(opts.seed)
+    with open(GENRE_WHITELIST_FILE, 'r', encoding='utf-8') as f:
+        genres = [g.strip() for g in f if g.strip()]
+    titles = synthetic_titles(opts.items, genres, opts.seed)
+    album_ids = []
+    with lib.transaction():
+        for start in range(0, len(titles), opts.album_size):
+            n = start // opts.album_size
+            artist = 'Artist {}'.format(n % max(len(titles) // (opts.album_size * 3), 1))
+            album = Album(album='Album {}'.format(n), albumartist=artist)
+            album.add(lib)
+            album_ids.append(album.id)
+            for i, title in enumerate(titles[start:start + opts.album_size]):
+                item = Item(title=title, artist=artist, albumartist=artist, album=album.album,
+                    album_id=album.id, track=i + 1, path='/bench/{}/{}.flac'.format(n, i).encode('utf-8'))
+                if rnd.random() < opts.analyzed:
+                    item.update(essentia_fields(rnd))
+                item.add(lib)
+    return album_ids
+
+def install_fakes(plugin, opts, counters):
+    from beetsplug.autogenre.lastfm import LastfmClient
+    def pylast_top_tags(entity, *args):
+        counters['lastfm_lookups'] += 1
+        if opts.lastfm_latency:
+            time.sleep(opts.lastfm_latency)
+        genre = fake_lastfm_genre((entity,) + args)
+        return [(g.lower(), 100) for g in genre.split(', ')] if genre else []
+    async def top_tags(self, entity, *args):
+        counters['lastfm_lookups'] += 1
+        if opts.lastfm_latency:
+            await asyncio.sleep(opts.lastfm_latency)
+        genre = fake_lastfm_genre((entity,) + args)
+        return [(g.lower(), 100) for g in genre.split(', ')] if genre else []
+    def run_analysis(item):
+        counters['analyses'] += 1
+        if opts.analysis_latency:
+            time.sleep(opts.analysis_latency)
+        item.update(essentia_fields(random.Random(item.id)))
+        item.store()
+    plugin._pylast_top_tags = pylast_top_tags
+    plugin._xtractor._run_analysis = run_analysis
+    LastfmClient.top_tags = top_tags
+
+def run_scenario(scenario, opts):
+    '''Runs a scenario within a fresh library and returns its metrics.'''
+    from beets.library import Library
+    from beetsplug.autogenre import AutoGenrePlugin
+    from beetsplug.autogenre.batch import StoreBatch
+    from beetsplug.autogenre.genretree import GenreTree
+    settings = parse_settings(opts.set)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        configure(tmpdir, settings)
+        lib = Library(os.path.join(tmpdir, 'library.db'), tmpdir)
+        album_ids = build_library(lib, opts)
+        plugin = AutoGenrePlugin()
+        counters = {'lastfm_lookups': 0, 'analyses': 0}
+        install_fakes(plugin, opts, counters)
+        plugin._genres() # exclude the genre tree parsing
+        store, match = Timer(), Timer()
+        StoreBatch.flush = store.wrap(StoreBatch.flush)
+        GenreTree.match = match.wrap(GenreTree.match)
+        start = time.perf_counter()
+        if scenario == 'import':
+            session = SimpleNamespace(lib=lib)
+            for album_id in album_ids:
+                plugin.imported(session, SimpleNamespace(is_album=True, album=lib.get_album(album_id)))
+        else:
+            cmd = plugin.commands()[0]
+            cmd_opts, args = cmd.parser.parse_args(shlex.split(opts.args))
+            plugin._run_autogenre_cmd(lib, cmd_opts, args)
+        seconds = time.perf_counter() - start
+        with_genre = len(lib.items('genre::.'))
+        lib._close()
+    return {
+        'items': opts.items,
+        'items_with_genre': with_genre,
+        'seconds': round(seconds, 4),
+        'items_per_second': round(opts.items / seconds, 1),
+        'db_write_seconds': round(store.seconds, 4),
+        'db_write_batches': store.calls,
+        'match_seconds': round(match.seconds, 4),
+        'match_calls': match.calls,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'lastfm_lookups': counters['lastfm_lookups'],
+        'analyses': counters['analyses'],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=10000)
+    parser.add_argument('--album-size', type=int, default=10)
+    parser.add_argument('--lastfm-latency', type=float, default=0.0, help='seconds per fake last.fm lookup')
+    parser.add_argument('--analysis-latency', type=float, default=0.0, help='seconds per fake Essentia analysis')
+    parser.add_argument('--analyzed', type=float, default=0.5, help='fraction of items analyzed already')
+    parser.add_argument('--scenario', choices=SCENARIOS, action='append', help='scenario to run (default: all)')
+    parser.add_argument('--args', default='', help='beet autogenre arguments of the command scenario')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE', help='autogenre setting (YAML value)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', metavar='FILE', help="write the results as JSON to FILE ('-' for stdout)")
+    opts = parser.parse_args()
+
+    results = {}
+    ctx = multiprocessing.get_context('spawn')
+    for scenario in opts.scenario or SCENARIOS:
+        with ctx.Pool(1) as pool:
+            results[scenario] = pool.apply(run_scenario, (scenario, opts))
+
+    columns = ('items/s', 'time [s]', 'db write [s]', 'match [s]', 'peak RSS [MB]', 'lookups', 'analyses')
+    print('{:<10}'.format('') + ''.join('{:>15}'.format(c) for c in columns), file=sys.stderr)
+    for scenario, r in results.items():
+        values = (r['items_per_second'], r['seconds'], r['db_write_seconds'], r['match_seconds'],
+            r['peak_rss_kb'] / 1024, r['lastfm_lookups'], r['analyses'])
+        print('{:<10}'.format(scenario) + ''.join('{:>15.3f}'.format(v) if isinstance(v, float) else '{:>15}'.format(v) for v in values), file=sys.stderr)
+    if opts.json:
+        doc = {'args': vars(opts), 'results': results}
+        if opts.json == '-':
+            json.dump(doc, sys.stdout, indent=2)
+            print()
+        else:
+            with open(opts.json, 'w') as f:
+                json.dump(doc, f, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
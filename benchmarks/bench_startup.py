@@ -0,0 +1,95 @@
+'''Measures the startup latency the autogenre plugin adds to unrelated
+beet commands by timing `beet ls` with and without the plugin enabled.
+Each run starts a new process using a temporary beets directory per
+variant, alternating between the variants.
+Usage: python -m benchmarks.bench_startup [--runs N] [--items N] [--command CMD] [--json FILE]'''
+import argparse
+import json
+import os
+import shlex
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from benchmarks.common import GENRE_TREE_FILE, GENRE_WHITELIST_FILE
+
+VARIANTS = {
+    'without': ['lastgenre', 'xtractor'],
+    'with': ['autogenre', 'lastgenre', 'xtractor'],
+}
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def write_config(beetsdir, library, plugins):
+    config = {
+        'directory': os.path.join(beetsdir, 'music'),
+        'library': library,
+        'plugins': plugins,
+        'lastgenre': {'whitelist': GENRE_WHITELIST_FILE, 'canonical': GENRE_TREE_FILE},
+    }
+    os.makedirs(beetsdir)
+    # JSON is a subset of YAML
+    with open(os.path.join(beetsdir, 'config.yaml'), 'w') as f:
+        json.dump(config, f)
+
+def build_library(path, n):
+    from beets.library import Item, Library
+    lib = Library(path)
+    with lib.transaction():
+        for i in range(n):
+            Item(title='Title {}'.format(i), artist='Artist {}'.format(i % 10),
+                path='/bench/{}.flac'.format(i).encode('utf-8')).add(lib)
+    lib._close()
+
+def run_command(beetsdir, command):
+    env = dict(os.environ, BEETSDIR=beetsdir)
+    env['PYTHONPATH'] = os.pathsep.join(p for p in (ROOT_DIR, env.get('PYTHONPATH')) if p)
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-m', 'beets'] + shlex.split(command), env=env, check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--items', type=int, default=100)
+    parser.add_argument('--command', default='ls', help='beet command to time')
+    parser.add_argument('--json', metavar='FILE', help="write the results as JSON to FILE ('-' for stdout)")
+    opts = parser.parse_args()
+
+    seconds = {variant: [] for variant in VARIANTS}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        library = os.path.join(tmpdir, 'library.db')
+        build_library(library, opts.items)
+        for variant, plugins in VARIANTS.items():
+            write_config(os.path.join(tmpdir, variant), library, plugins)
+            # Warm up the file system and bytecode caches
+            run_command(os.path.join(tmpdir, variant), opts.command)
+        # Alternate the variants so that both are equally affected by noise
+        for _ in range(opts.runs):
+            for variant in VARIANTS:
+                seconds[variant].append(run_command(os.path.join(tmpdir, variant), opts.command))
+    results = {}
+    for variant, values in seconds.items():
+        results[variant] = {
+            'min': round(min(values), 4),
+            'median': round(statistics.median(values), 4),
+            'mean': round(statistics.mean(values), 4),
+        }
+
+    print('{:<10}{:>12}{:>12}{:>12}'.format('', 'min [s]', 'median [s]', 'mean [s]'), file=sys.stderr)
+    for variant, r in results.items():
+        print('{:<10}{:>12.3f}{:>12.3f}{:>12.3f}'.format(variant, r['min'], r['median'], r['mean']), file=sys.stderr)
+    overhead = results['with']['median'] - results['without']['median']
+    print('autogenre adds {:.3f}s (median) to `beet {}`'.format(overhead, opts.command), file=sys.stderr)
+    if opts.json:
+        doc = {'args': vars(opts), 'results': results}
+        if opts.json == '-':
+            json.dump(doc, sys.stdout, indent=2)
+            print()
+        else:
+            with open(opts.json, 'w') as f:
+                json.dump(doc, f, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
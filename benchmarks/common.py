@@ -0,0 +1,45 @@
+import codecs
+import os
+import random
+import time
+import yaml
+import beetsplug.lastgenre
+
+LASTGENRE_DIR = os.path.dirname(beetsplug.lastgenre.__file__)
+GENRE_TREE_FILE = os.path.join(LASTGENRE_DIR, 'genres-tree.yaml')
+GENRE_WHITELIST_FILE = os.path.join(LASTGENRE_DIR, 'genres.txt')
+WORDS = ('love', 'night', 'the', 'of', 'dream', 'fire', 'city', 'heart', 'lost',
+    'summer', 'feat.', 'original', 'version', 'live', 'edit', 'radio', 'dub', 'extended')
+SUFFIXES = ('remix', 'mix', 'set', 'bootleg', 'music')
+
+def load_genre_tree_yaml():
+    with codecs.open(GENRE_TREE_FILE, 'r', encoding='utf-8') as f:
+        return yaml.safe_load(f)
+
+def load_genre_whitelist():
+    with open(GENRE_WHITELIST_FILE, 'r', encoding='utf-8') as f:
+        return [genre.strip().lower() for genre in f.readlines() if genre.strip()]
+
+def synthetic_titles(n, genres, seed=42):
+    '''Generates titles of which some contain a genre in brackets or
+    followed by a remix suffix.'''
+    rnd = random.Random(seed)
+    genres = sorted(genres)
+    titles = []
+    for _ in range(n):
+        title = ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(1, 6))).title()
+        r = rnd.random()
+        if r < 0.15:
+            title = '{} [{}]'.format(title, rnd.choice(genres).title())
+        elif r < 0.3:
+            title = '{} ({} {})'.format(title, rnd.choice(genres), rnd.choice(SUFFIXES))
+        elif r < 0.4:
+            title = '{} ({} Edit)'.format(title, rnd.choice(genres))
+        titles.append(title)
+    return titles
+
+def timed(func, *args):
+    '''Returns the result and the duration in seconds of the function call.'''
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
@@ -11,13 +11,14 @@ setuptools.setup(
     long_description=long_description,
     long_description_content_type='text/markdown',
     url='https://github.com/mgoltzsche/beets-autogenre',
-    packages=setuptools.find_packages(),
+    packages=setuptools.find_packages(exclude=['benchmarks', 'benchmarks.*']),
     include_package_data=True,
     classifiers=[
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.7',
         'License :: OSI Approved :: Apache Software License',
         'Operating System :: OS Independent',
     ],
+    python_requires='>=3.7',
     install_requires=[
         'beets',
         'pylast',
@@ -0,0 +1,51 @@
+import unittest
+from beets.library import Item, Library
+from beetsplug.autogenre import _most_common
+from beetsplug.autogenre.albumgenre import album_genre_changes
+
+class TestAlbumGenreChanges(unittest.TestCase):
+
+    def setUp(self):
+        self.lib = Library(':memory:')
+        albums = [
+            # (album genre, [(track, item genre)])
+            ('Rock', [(1, 'Rock'), (2, 'Rock'), (3, 'Pop')]),
+            ('Rock', [(1, 'Jazz'), (2, 'Jazz'), (3, 'Rock')]),
+            ('', [(2, 'Pop'), (1, 'House'), (3, None), (4, '')]),
+            ('Jazz', [(1, None), (2, '')]),
+            ('Pop', [(3, 'Techno'), (1, 'House'), (2, 'Techno'), (4, 'House')]),
+        ]
+        self.albums = []
+        for i, (album_genre, tracks) in enumerate(albums):
+            items = [Item(title='t', album='Album {}'.format(i), artist='Artist', track=track,
+                genre=genre, path='/{}/{}'.format(i, track).encode('utf-8')) for track, genre in tracks]
+            album = self.lib.add_album(items)
+            # Set the album genre without propagating it to the items
+            with self.lib.transaction() as tx:
+                tx.mutate('UPDATE albums SET genre = ? WHERE id = ?', (album_genre, album.id))
+            self.albums.append(self.lib.get_album(album.id))
+
+    def tearDown(self):
+        self.lib._close()
+
+    def expected_changes(self, albums):
+        changes = []
+        for album in albums:
+            genre = _most_common([item.genre for item in album.items()])
+            if genre and genre != album.genre:
+                changes.append((album.id, genre))
+        return changes
+
+    def test_all_albums(self):
+        actual = album_genre_changes(self.lib)
+        self.assertEqual(actual, self.expected_changes(self.albums))
+        self.assertEqual(actual, [
+            (self.albums[1].id, 'Jazz'),
+            (self.albums[2].id, 'House'),
+            (self.albums[4].id, 'House'),
+        ])
+
+    def test_selected_albums(self):
+        albums = [self.albums[0], self.albums[2]]
+        actual = album_genre_changes(self.lib, [album.id for album in albums])
+        self.assertEqual(actual, self.expected_changes(albums))
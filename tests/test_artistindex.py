@@ -0,0 +1,80 @@
+import unittest
+from beets.library import Item, Library
+from beetsplug.autogenre.artistindex import ArtistGenreIndex
+
+class TestArtistGenreIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.lib = Library(':memory:')
+        items = [
+            # (artist, albumartist, genre, genres, genre_source)
+            ('Band', 'Band', 'Rock', 'Rock, Pop', 'lastfm'),
+            ('Band', 'Band', 'Rock', 'Rock, Pop', 'lastfm'),
+            ('band ', 'Band', 'Rock', 'Rock', 'user'),
+            ('Band', 'Band', 'Pop', 'Pop', 'lastfm'),
+            ('Band', 'Band', 'Jazz', 'Jazz', 'essentia'),
+            ('Band', 'Band', 'Jazz', 'Jazz', None),
+            ('Split', 'Split', 'Rock', 'Rock', 'lastfm'),
+            ('Split', 'Split', 'Rock', 'Rock', 'lastfm'),
+            ('Split', 'Split', 'Pop', 'Pop', 'user'),
+            ('Guest', 'Label', 'House', 'House', 'lastfm'),
+            ('Other', 'Label', 'House', 'House, Techno', 'user'),
+            ('Third', 'Label', 'House', 'House, Techno', 'library'),
+        ]
+        for i, (artist, albumartist, genre, genres, source) in enumerate(items):
+            item = Item(artist=artist, albumartist=albumartist, genre=genre, genres=genres,
+                path='/{}'.format(i).encode('utf-8'))
+            if source:
+                item.genre_source = source
+            self.lib.add(item)
+
+    def tearDown(self):
+        self.lib._close()
+
+    def test_lookup(self):
+        testee = ArtistGenreIndex.build(self.lib, 3, 0.75)
+        testcases = [
+            # Rock: 1 + 1 + 2 of 5, essentia and unspecified sources are ignored
+            (Item(artist='Band', albumartist='Band'), 'Rock, Pop'),
+            (Item(artist='BAND', albumartist=''), 'Rock, Pop'),
+            # Rock: 2 of 4
+            (Item(artist='Split', albumartist='Split'), None),
+            # Falls back to the album artist: House 1 + 2 + 0.5
+            (Item(artist='Guest', albumartist='Label'), 'House, Techno'),
+            (Item(artist='Unknown', albumartist='Unknown'), None),
+            (Item(), None),
+        ]
+        for item, expected in testcases:
+            with self.subTest(artist=item.artist, albumartist=item.albumartist):
+                self.assertEqual(testee.lookup(item), expected)
+
+    def test_thresholds(self):
+        testcases = [
+            # Rock: 2 items, weight 2 of 4
+            (2, 0.5, 'Rock'),
+            (3, 0.5, None),
+            (2, 0.6, None),
+        ]
+        for min_items, min_share, expected in testcases:
+            testee = ArtistGenreIndex.build(self.lib, min_items, min_share)
+            self.assertEqual(testee.lookup(Item(artist='Split')), expected, (min_items, min_share))
+
+    def test_va_name(self):
+        for artist in ('A', 'B', 'C'):
+            item = Item(artist=artist, albumartist='Various Artists', genre='House', genres='House')
+            item.genre_source = 'lastfm'
+            self.lib.add(item)
+        testee = ArtistGenreIndex.build(self.lib, 3, 0.75, 'Various Artists')
+        self.assertEqual(testee.lookup(Item(artist='D', albumartist='Various Artists')), None)
+        testee = ArtistGenreIndex.build(self.lib, 3, 0.75)
+        self.assertEqual(testee.lookup(Item(artist='D', albumartist='Various Artists')), 'House')
+
+    def test_own_genre_is_excluded(self):
+        testee = ArtistGenreIndex.build(self.lib, 3, 0.75)
+        # Rock: 1 + 1 + 2 of 4 without the Pop item itself
+        self.assertEqual(testee.lookup(self.lib.get_item(4)), 'Rock, Pop')
+        # Rock: 2 items without the item itself
+        self.assertEqual(testee.lookup(self.lib.get_item(1)), None)
+        self.assertEqual(testee.lookup(self.lib.get_item(3)), None)
+        # Other items are not affected
+        self.assertEqual(testee.lookup(Item(artist='Band')), 'Rock, Pop')
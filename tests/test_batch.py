@@ -0,0 +1,48 @@
+import unittest
+from beets import logging
+from beets.library import Item, Library
+from beetsplug.autogenre.batch import StoreBatch
+
+class TestStoreBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.lib = Library(':memory:')
+        for i in range(5):
+            self.lib.add(Item(title='Title {}'.format(i), genre='', path='/{}'.format(i).encode('utf-8')))
+        self.log = logging.getLogger('test')
+
+    def tearDown(self):
+        self.lib._close()
+
+    def stored_genres(self):
+        return [item.genre for item in self.lib.items()]
+
+    def change(self, batch, item_id):
+        item = self.lib.get_item(item_id)
+        item.genre = 'Rock'
+        batch.add(item, ['genre'])
+
+    def test_flush_on_size(self):
+        batch = StoreBatch(self.lib, 2, self.log)
+        testcases = [
+            (1, 0, ['', '', '', '', '']),
+            (2, 2, ['Rock', 'Rock', '', '', '']),
+            (3, 2, ['Rock', 'Rock', '', '', '']),
+            (4, 4, ['Rock', 'Rock', 'Rock', 'Rock', '']),
+        ]
+        for item_id, stored, genres in testcases:
+            with self.subTest(item_id=item_id):
+                self.change(batch, item_id)
+                self.assertEqual(batch.stored, stored)
+                self.assertEqual(self.stored_genres(), genres)
+        batch.flush()
+        self.assertEqual(batch.stored, 4)
+
+    def test_flush_on_exit(self):
+        with self.assertRaises(KeyboardInterrupt):
+            with StoreBatch(self.lib, 100, self.log) as batch:
+                self.change(batch, 1)
+                self.change(batch, 3)
+                raise KeyboardInterrupt()
+        self.assertEqual(batch.stored, 2)
+        self.assertEqual(self.stored_genres(), ['Rock', '', 'Rock', '', ''])
@@ -0,0 +1,55 @@
+import os
+import tempfile
+import time
+import unittest
+from beetsplug.autogenre.cache import LastfmCache
+
+class TestLastfmCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'cache.db')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_get_set(self):
+        testee = LastfmCache(self.path, 'scope', 3600, 60)
+        self.assertEqual(testee.get(('album', 'artist', 'album')), (False, None))
+        testee.set(('album', 'artist', 'album'), 'Rock, Pop')
+        testee.set(('artist', 'artist'), None)
+        self.assertEqual(testee.get(('album', 'artist', 'album')), (True, 'Rock, Pop'))
+        self.assertEqual(testee.get(('artist', 'artist')), (True, None))
+        self.assertEqual(testee.get(('track', 'artist', 'album')), (False, None))
+        self.assertEqual((testee.hits, testee.misses), (2, 2))
+        testee.close()
+
+    def test_persistence_and_scope(self):
+        testee = LastfmCache(self.path, 'scope', 0, 0)
+        testee.set(('track', 'artist', 'title'), 'Jazz')
+        testee.close()
+        testee = LastfmCache(self.path, 'scope', 0, 0)
+        self.assertEqual(testee.get(('track', 'artist', 'title')), (True, 'Jazz'))
+        testee.close()
+        testee = LastfmCache(self.path, 'other scope', 0, 0)
+        self.assertEqual(testee.get(('track', 'artist', 'title')), (False, None))
+        testee.close()
+
+    def test_expiry(self):
+        testcases = [
+            # ttl, negative_ttl, expected genre result, expected negative result
+            (3600, 0.01, (True, 'Jazz'), (False, None)),
+            (0.01, 3600, (False, None), (True, None)),
+            (0, 0.01, (True, 'Jazz'), (False, None)),
+            (0.01, 0, (False, None), (True, None)),
+            (0, 0, (True, 'Jazz'), (True, None)),
+        ]
+        for ttl, negative_ttl, genre_result, negative_result in testcases:
+            with self.subTest(ttl=ttl, negative_ttl=negative_ttl):
+                testee = LastfmCache(self.path, 'scope', ttl, negative_ttl)
+                testee.set(('artist', 'a'), 'Jazz')
+                testee.set(('artist', 'b'), None)
+                time.sleep(0.02)
+                self.assertEqual(testee.get(('artist', 'a')), genre_result)
+                self.assertEqual(testee.get(('artist', 'b')), negative_result)
+                testee.close()
@@ -0,0 +1,80 @@
+import os
+import tempfile
+import unittest
+from beetsplug.autogenre.checkpoint import Budget, Checkpoints, parse_duration
+
+class TestCheckpoints(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'checkpoint.db')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_save_get_remove(self):
+        testee = Checkpoints(self.path)
+        self.assertIsNone(testee.get('run1'))
+        testee.save('run1', 0, 100, 50, [3, 7], [1])
+        testee.save('run1', 1, 20, 60, [], [2, 1])
+        testee.save('run2', 0, 5, 5, [4], [9])
+        self.assertEqual(testee.get('run1'), (1, 20, 60))
+        self.assertEqual(testee.evaluated('run1', 1, 5), {3})
+        self.assertEqual(testee.evaluated('run1', 1, 1000), {3, 7})
+        self.assertEqual(testee.album_ids('run1'), [1, 2])
+        testee.clear_albums('run1')
+        self.assertEqual(testee.album_ids('run1'), [])
+        testee.remove('run1')
+        self.assertIsNone(testee.get('run1'))
+        self.assertEqual(testee.evaluated('run1', 1, 1000), set())
+        self.assertEqual(testee.get('run2'), (0, 5, 5))
+        self.assertEqual(testee.album_ids('run2'), [9])
+        testee.close()
+
+    def test_persistence(self):
+        testee = Checkpoints(self.path)
+        testee.save('run', 2, 42, 3, [1])
+        testee.close()
+        testee = Checkpoints(self.path)
+        self.assertEqual(testee.get('run'), (2, 42, 3))
+        self.assertEqual(testee.evaluated('run', 0, 10), {1})
+        testee.close()
+
+class TestBudget(unittest.TestCase):
+
+    def test_budget(self):
+        now = [100.0]
+        clock = lambda: now[0]
+        testcases = [
+            # max_items, max_duration, items, elapsed, remaining, exhausted
+            (0, 0, 1000, 1e6, None, False),
+            (10, 0, 4, 0, 6, False),
+            (10, 0, 12, 0, 0, True),
+            (0, 60, 1000, 59, None, False),
+            (0, 60, 0, 60, None, True),
+            (10, 60, 10, 1, 0, True),
+        ]
+        for max_items, max_duration, items, elapsed, remaining, exhausted in testcases:
+            with self.subTest(max_items=max_items, max_duration=max_duration, items=items, elapsed=elapsed):
+                now[0] = 100.0
+                testee = Budget(max_items, max_duration, clock)
+                testee.items = items
+                now[0] += elapsed
+                self.assertEqual(testee.limited, bool(max_items or max_duration))
+                self.assertEqual(testee.remaining_items(), remaining)
+                self.assertEqual(testee.exhausted(), exhausted)
+
+    def test_parse_duration(self):
+        testcases = [
+            (0, 0),
+            ('3600', 3600),
+            ('45s', 45),
+            ('90m', 5400),
+            ('8h', 28800),
+            ('1.5d', 129600),
+        ]
+        for value, expected in testcases:
+            self.assertEqual(parse_duration(value), expected)
+        for value in ('', 'h', '-1h', '8 hours', '1w'):
+            with self.assertRaises(ValueError, msg=value):
+                parse_duration(value)
@@ -0,0 +1,91 @@
+import os
+import struct
+import tempfile
+import unittest
+from beets.library import Item
+from beetsplug.autogenre.contentkey import ContentKeys, DedupMemo, SAMPLE_SIZE, audio_hash
+
+def ape_tag(payload):
+    # APEv2 footer without header: preamble, version, size, item count, flags, reserved
+    footer = b'APETAGEX' + struct.pack('<IIII', 2000, len(payload) + 32, 1, 0) + b'\0' * 8
+    return payload + footer
+
+def id3v2_tag(payload):
+    # ID3v2.4 header with synchsafe size, no flags
+    size = len(payload)
+    return b'ID3\x04\0\0' + bytes((size >> 21 & 0x7f, size >> 14 & 0x7f, size >> 7 & 0x7f, size & 0x7f)) + payload
+
+def flac_metadata(*blocks):
+    # Metadata block headers: last block flag, type, 24-bit length
+    data = b'fLaC'
+    for i, block in enumerate(blocks):
+        last = i == len(blocks) - 1 and 0x80 or 0
+        data += bytes((last | 4,)) + len(block).to_bytes(3, 'big') + block
+    return data
+
+class TestContentKeys(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.audio = bytes(range(256)) * (5 * 1024 * 1024 // 256)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write_file(self, name, content):
+        path = os.path.join(self.tmpdir.name, name).encode('utf-8')
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def test_audio_hash(self):
+        original = self.write_file('original.mp3', id3v2_tag(b'tags of the album') + self.audio)
+        testcases = [
+            ('compilation.mp3', id3v2_tag(b'longer tags of a compilation') + self.audio, True),
+            ('id3v1.mp3', id3v2_tag(b'') + self.audio + b'TAG' + b'\0' * 125, True),
+            ('ape.mp3', self.audio + ape_tag(b'APE items'), True),
+            ('other.mp3', id3v2_tag(b'') + self.audio[:-1] + b'x', False),
+            ('short.mp3', self.audio[:SAMPLE_SIZE - 1], False),
+            # Same last 4MB but different length, e.g. an extended version
+            ('longer.mp3', id3v2_tag(b'') + b'\x01' * 1024 * 1024 + self.audio, False),
+            ('flac.flac', flac_metadata(b'comments', b'picture') + self.audio, True),
+            ('longer.flac', flac_metadata(b'comments') + b'\x01' + self.audio, False),
+        ]
+        for name, content, same in testcases:
+            with self.subTest(name=name):
+                path = self.write_file(name, content)
+                self.assertEqual(audio_hash(path) == audio_hash(original), same)
+
+    def test_key(self):
+        testee = ContentKeys(os.path.join(self.tmpdir.name, 'keys.db'))
+        path = self.write_file('a.flac', self.audio)
+        copy = self.write_file('b.mp3', id3v2_tag(b'tags') + self.audio)
+        self.assertEqual(testee.key(Item(mb_trackid='abc', path=path)), 'mbid:abc')
+        self.assertEqual(testee.key(Item(path=b'/nonexistent/c.flac')), None)
+        key = testee.key(Item(path=path))
+        self.assertTrue(key.startswith('hash:'))
+        self.assertEqual(testee.key(Item(path=copy)), key)
+        self.assertEqual(testee.hashed, 2)
+        testee.close()
+        # The hashes are cached until the file changes
+        testee = ContentKeys(os.path.join(self.tmpdir.name, 'keys.db'))
+        self.assertEqual(testee.key(Item(path=path)), key)
+        self.assertEqual(testee.hashed, 0)
+        with open(path, 'ab') as f:
+            f.write(b'more audio')
+        self.assertNotEqual(testee.key(Item(path=path)), key)
+        self.assertEqual(testee.hashed, 1)
+        testee.close()
+
+class TestDedupMemo(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        testee = DedupMemo(2)
+        testee['a'] = 1
+        testee['b'] = 2
+        self.assertEqual(testee.get('a'), 1)
+        testee['c'] = 3
+        self.assertEqual(len(testee), 2)
+        self.assertEqual(testee.keys(), ['a', 'c'])
+        self.assertNotIn('b', testee)
+        self.assertEqual(testee.get('b', False), False)
@@ -0,0 +1,75 @@
+import unittest
+from beetsplug.autogenre.essentia import EssentiaGenres
+
+class TestEssentiaGenres(unittest.TestCase):
+
+    def test_derive_columns(self):
+        testee = EssentiaGenres(0.8, 0.8, 0.5, 0.45, lambda g: g.title())
+        testcases = [
+            {
+                'name': 'strong rosamerica',
+                'input': ('roc', 0.9, 'house', 0.2),
+                'expected': ('Rock',),
+            },
+            {
+                'name': 'weak rosamerica, electronic prepended',
+                'input': ('roc', 0.6, 'house', 0.6),
+                'expected': ('Electronic', 'Rock', 'House'),
+            },
+            {
+                'name': 'weak rosamerica, unknown electronic sub genre',
+                'input': ('jaz', 0.6, 'other', 0.6),
+                'expected': ('Electronic', 'Jazz'),
+            },
+            {
+                'name': 'dance, strong electronic',
+                'input': ('dan', 0.9, 'techno', 0.9),
+                'expected': ('Techno',),
+            },
+            {
+                'name': 'dance, weak electronic',
+                'input': ('dan', 0.9, 'techno', 0.46),
+                'expected': ('Electronic',),
+            },
+            {
+                'name': 'dance, no electronic',
+                'input': ('dan', 0.9, 'techno', 0.1),
+                'expected': ('Dance',),
+            },
+            {
+                'name': 'electronic appended',
+                'input': ('hip', 0.9, 'dnb', 0.46),
+                'expected': ('Hip Hop', 'Electronic'),
+            },
+            {
+                'name': 'electronic not appended twice',
+                'input': ('pop', 0.6, 'dnb', 0.6),
+                'expected': ('Electronic', 'Pop', 'Drum And Bass'),
+            },
+            {
+                'name': 'string probabilities',
+                'input': ('cla', '0.9', 'ambient', '0.1'),
+                'expected': ('Classical',),
+            },
+            {
+                'name': 'unknown label',
+                'input': ('xyz', 0.9, 'ambient', 0.1),
+                'expected': None,
+            },
+        ]
+        columns = list(zip(*[c['input'] for c in testcases]))
+        actual = testee.derive_columns(*columns)
+        for c, a in zip(testcases, actual):
+            info = "\ntest case '{}' input: {}".format(c['name'], c['input'])
+            self.assertEqual(a, c['expected'], info)
+
+    def test_derive_genres(self):
+        testee = EssentiaGenres(0.8, 0.8, 0.5, 0.45)
+        items = [
+            {'genre_rosamerica': 'roc', 'genre_rosamerica_probability': '0.9',
+                'genre_electronic': 'house', 'genre_electronic_probability': '0.1'},
+            {},
+            {'genre_rosamerica': 'jaz', 'genre_rosamerica_probability': 0.9,
+                'genre_electronic': 'house', 'genre_electronic_probability': 0.1},
+        ]
+        self.assertEqual(testee.derive_genres(items), [('rock',), None, ('jazz',)])
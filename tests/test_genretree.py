@@ -1,5 +1,6 @@
+import pickle
 import unittest
-from beetsplug.autogenre.genretree import GenreTree
+from beetsplug.autogenre.genretree import GenreTree, _tree2parentmap
 
 class TestGenreMatcher(unittest.TestCase):
 
@@ -208,3 +209,38 @@ class TestGenreMatcher(unittest.TestCase):
             info = "\ntest case '{}' input: {}".format(c['name'], c['input'])
             a = testee.is_genre(c['input'], c['parent'])
             self.assertEqual(a, c['expected'], info)
+
+    def test_formatted_parents(self):
+        genre_tree = [
+            {
+                'fancy genre': [
+                    'sub genre',
+                ],
+            },
+        ]
+        testee = GenreTree(genre_tree, [], lambda genre: genre.title())
+        self.assertEqual(testee.formatted_parents('Sub Genre'), ['Sub Genre', 'Fancy Genre'])
+        self.assertEqual(testee.formatted_parents('unknown genre'), ['Unknown Genre'])
+        self.assertEqual(testee.parents('unknown genre'), ['unknown genre'])
+
+    def test_separate_trees(self):
+        GenreTree([{'genre a': ['sub genre a']}], [])
+        testee = GenreTree([{'genre b': ['sub genre b']}], [])
+        self.assertEqual(_tree2parentmap(['genre c']), {'genre c': None})
+        self.assertFalse(testee.contains('genre a'))
+        self.assertEqual(testee.parents('sub genre a'), ['sub genre a'])
+        self.assertEqual(testee.parents('sub genre b'), ['sub genre b', 'genre b'])
+
+    def test_match_cache(self):
+        testee = GenreTree([{'genre a': ['sub genre a']}], ['genre a'])
+        self.assertEqual(testee.match('Title [Sub Genre A]'), 'genre a')
+        self.assertEqual(testee.match('title [sub genre a]\nsecond line'), 'genre a')
+        self.assertEqual(testee.match('Title'), None)
+        info = testee.match_cache_info()
+        self.assertEqual((info.hits, info.misses), (1, 2))
+        testee = pickle.loads(pickle.dumps(testee))
+        self.assertEqual(testee.match('Title [Sub Genre A]'), 'genre a')
+        self.assertEqual(testee.match_cache_info().misses, 1)
+        testee.set_match_cache_size(0)
+        self.assertIsNone(testee.match_cache_info())
+        self.assertEqual(testee.match('Title [Sub Genre A]'), 'genre a')
@@ -0,0 +1,62 @@
+import os
+import tempfile
+import unittest
+from beetsplug.autogenre import genretree
+from beetsplug.autogenre.genretree import load_genre_tree
+
+class TestGenreTreeCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.tree_file = self._write('tree.yaml', '- fancy genre:\n  - sub genre\n  - alias genre\n')
+        self.whitelist_file = self._write('whitelist.txt', 'fancy genre\nsub genre\n')
+        self.cache_file = os.path.join(self.tmpdir.name, 'tree.cache')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _write(self, name, content):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def _load(self, scope='', rebuild=False):
+        return load_genre_tree(self.tree_file, self.whitelist_file, str.title,
+            self.cache_file, scope, rebuild)
+
+    def test_load_from_cache(self):
+        tree = self._load()
+        self.assertTrue(os.path.isfile(self.cache_file))
+        self.assertEqual(tree.match('title [alias genre]'), 'fancy genre')
+        read_genre_tree = genretree._read_genre_tree
+        genretree._read_genre_tree = None
+        try:
+            cached = self._load()
+        finally:
+            genretree._read_genre_tree = read_genre_tree
+        self.assertEqual(cached.match('title [alias genre]'), 'fancy genre')
+        self.assertEqual(cached.match('title [sub genre]'), 'sub genre')
+        self.assertEqual(cached.parents('sub genre'), ['sub genre', 'fancy genre'])
+        self.assertEqual(cached.formatted_parents('unknown'), ['Unknown'])
+
+    def test_invalidate_cache(self):
+        self.assertEqual(self._load().match('title [alias genre]'), 'fancy genre')
+        self._write('whitelist.txt', 'fancy genre\nsub genre\nalias genre\n')
+        stat = os.stat(self.whitelist_file)
+        os.utime(self.whitelist_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        self.assertEqual(self._load().match('title [alias genre]'), 'alias genre')
+
+    def test_rebuild_cache(self):
+        self._load()
+        with open(self.cache_file, 'wb') as f:
+            f.write(b'corrupted')
+        self.assertEqual(self._load().match('title [sub genre]'), 'sub genre')
+        self.assertEqual(self._load(rebuild=True).match('title [sub genre]'), 'sub genre')
+        self.assertEqual(self._load(scope='other').match('title [sub genre]'), 'sub genre')
+
+    def test_unwritable_cache(self):
+        # E.g. next to a read-only copy of the library
+        self.cache_file = os.path.join(self.tmpdir.name, 'missing', 'tree.cache')
+        self.assertEqual(self._load().match('title [sub genre]'), 'sub genre')
+        self.assertFalse(os.path.exists(self.cache_file))
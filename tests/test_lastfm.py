@@ -0,0 +1,121 @@
+import asyncio
+import json
+import threading
+import time
+import unittest
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from beetsplug.autogenre.lastfm import LastfmClient, LastfmError
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        params = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(self.path).query))
+        server = self.server
+        with server.lock:
+            server.requests.append(params)
+            attempt = len([p for p in server.requests if p == params])
+        name = params.get('artist')
+        status, data = 200, {'toptags': {'tag': [{'name': 'Rock', 'count': 100}, {'name': 'Pop', 'count': '5'}]}}
+        if name == 'single':
+            data = {'toptags': {'tag': {'name': 'Jazz', 'count': 100}}}
+        elif name == 'unknown':
+            data = {'error': 6, 'message': 'not found'}
+        elif name == 'invalid':
+            status, data = 400, {'error': 10, 'message': 'invalid api key'}
+        elif name == 'flaky' and attempt < 3:
+            status, data = (500, {}) if attempt == 1 else (200, {'error': 29, 'message': 'rate limit'})
+        elif name == 'down':
+            status, data = 503, {}
+        elif name == 'slow':
+            time.sleep(0.1)
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class TestLastfmClient(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:{}/2.0/'.format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def client(self, **kwargs):
+        kwargs.setdefault('rate', 0)
+        kwargs.setdefault('backoff', 0.01)
+        return LastfmClient('key', url=self.url, **kwargs)
+
+    def test_top_tags(self):
+        testee = self.client()
+        testcases = [
+            (('track', 'artist', 'ti‐tle'), [('Rock', 100), ('Pop', 5)]),
+            (('album', 'single', 'album'), [('Jazz', 100)]),
+            (('artist', 'unknown'), []),
+        ]
+        for args, expected in testcases:
+            with self.subTest(args=args):
+                self.assertEqual(asyncio.run(testee.top_tags(*args)), expected)
+        self.assertEqual(self.server.requests[0], {'method': 'track.gettoptags',
+            'api_key': 'key', 'format': 'json', 'artist': 'artist', 'track': 'ti-tle'})
+        self.assertEqual(self.server.requests[1]['method'], 'album.gettoptags')
+        self.assertEqual(self.server.requests[1]['album'], 'album')
+        testee.close()
+
+    def test_retry(self):
+        testee = self.client(retries=2)
+        self.assertEqual(asyncio.run(testee.top_tags('artist', 'flaky')), [('Rock', 100), ('Pop', 5)])
+        self.assertEqual(testee.requests, 3)
+        with self.assertRaises(LastfmError):
+            asyncio.run(testee.top_tags('artist', 'down'))
+        self.assertEqual(testee.requests, 6)
+        with self.assertRaises(LastfmError):
+            asyncio.run(testee.top_tags('artist', 'invalid'))
+        self.assertEqual(testee.requests, 7)
+        testee.close()
+
+    def test_inflight_deduplication(self):
+        testee = self.client()
+        async def run():
+            return await asyncio.gather(
+                testee.top_tags('artist', 'slow'),
+                testee.top_tags('artist', 'slow'),
+                testee.top_tags('album', 'slow', 'album'))
+        results = asyncio.run(run())
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(len(self.server.requests), 2)
+        testee.close()
+
+    def test_rate_limit(self):
+        testee = self.client(rate=20)
+        async def run():
+            return await asyncio.gather(*[testee.top_tags('artist', str(i)) for i in range(40)])
+        start = time.monotonic()
+        asyncio.run(run())
+        # 20 requests within the initial burst, 20 more at 20 per second
+        self.assertGreaterEqual(time.monotonic() - start, 0.9)
+        self.assertEqual(len(self.server.requests), 40)
+        testee.close()
+
+    def test_consecutive_event_loops(self):
+        testee = self.client(concurrency=2)
+        async def run(n):
+            return await asyncio.gather(*[testee.top_tags('artist', '{}-{}'.format(n, i)) for i in range(5)])
+        # Each chunk of lookups is resolved within a new event loop
+        for n in range(2):
+            with self.subTest(run=n):
+                self.assertEqual(len(asyncio.run(run(n))), 5)
+        self.assertEqual(len(self.server.requests), 10)
+        testee.close()
@@ -0,0 +1,79 @@
+import unittest
+from beetsplug.autogenre.matcher import GenreMatcher
+
+class TestGenreMatcher(unittest.TestCase):
+
+    def test_match(self):
+        genres = ['house', 'tech house', 'deep house', 'techno', 'Drum And Bass', 'bass']
+        testcases = [
+            {
+                'name': 'bracket',
+                'input': 'title [techno]',
+                'expected': 'techno',
+            },
+            {
+                'name': 'mismatched brackets',
+                'input': 'title (techno]',
+                'expected': 'techno',
+            },
+            {
+                'name': 'prefer longest genre at position',
+                'input': 'title (tech house remix)',
+                'expected': 'tech house',
+            },
+            {
+                'name': 'prefer leftmost genre',
+                'input': 'deep house mix (techno edit)',
+                'expected': 'deep house',
+            },
+            {
+                'name': 'bracket before suffix at same position',
+                'input': 'title [house] mix',
+                'expected': 'house',
+            },
+            {
+                'name': 'fall back to shorter genre when longer one has no suffix',
+                'input': 'title drum and bass edit, bass set',
+                'expected': 'bass',
+            },
+            {
+                'name': 'case insensitive genre definition',
+                'input': 'title (DRUM and bass)',
+                'expected': 'drum and bass',
+            },
+            {
+                'name': 'multiple spaces before suffix',
+                'input': 'house   bootleg',
+                'expected': 'house',
+            },
+            {
+                'name': 'suffix must be a separate word',
+                'input': 'house mixture',
+                'expected': None,
+            },
+            {
+                'name': 'genre as part of another word',
+                'input': 'lighthouse mix',
+                'expected': 'house',
+            },
+            {
+                'name': 'no match within brackets without closing bracket',
+                'input': 'title [techno edit]',
+                'expected': None,
+            },
+            {
+                'name': 'ignore lines after the first one',
+                'input': 'title\n[techno]',
+                'expected': None,
+            },
+            {
+                'name': 'empty title',
+                'input': '',
+                'expected': None,
+            },
+        ]
+        testee = GenreMatcher(genres)
+        for c in testcases:
+            info = "\ntest case '{}' input: {}".format(c['name'], c['input'])
+            a = testee.match(c['input'])
+            self.assertEqual(a, c['expected'], info)
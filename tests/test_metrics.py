@@ -0,0 +1,69 @@
+import json
+import os
+import tempfile
+import unittest
+from beetsplug.autogenre.metrics import Metrics, NULL_METRICS, timed
+
+class Stage:
+    def __init__(self, metrics):
+        self._metrics = metrics
+
+    @timed('stage')
+    def run(self, value):
+        return value * 2
+
+class TestMetrics(unittest.TestCase):
+
+    def test_timed(self):
+        metrics = Metrics()
+        self.assertEqual(Stage(metrics).run(2), 4)
+        self.assertEqual(Stage(metrics).run(3), 6)
+        self.assertEqual(Stage(NULL_METRICS).run(4), 8)
+        stage = metrics.to_json()['stages']['stage']
+        self.assertEqual(stage['count'], 2)
+        self.assertEqual(sum(stage['buckets'].values()), 2)
+
+    def test_counters(self):
+        metrics = Metrics()
+        metrics.count('items_changed')
+        metrics.count('items_changed', 2)
+        metrics.count('genre_source', source='lastfm')
+        metrics.count('genre_source', source='title')
+        metrics.count('genre_source', source='lastfm')
+        self.assertEqual(metrics.to_json()['counters'], [
+            {'name': 'genre_source', 'labels': {'source': 'lastfm'}, 'value': 2},
+            {'name': 'genre_source', 'labels': {'source': 'title'}, 'value': 1},
+            {'name': 'items_changed', 'labels': {}, 'value': 3},
+        ])
+        self.assertEqual(metrics.summary()[-3:], [
+            'genre_source{source=lastfm} = 2',
+            'genre_source{source=title} = 1',
+            'items_changed = 3',
+        ])
+
+    def test_prometheus(self):
+        metrics = Metrics()
+        metrics.observe('lastfm', 0.02)
+        metrics.observe('lastfm', 2)
+        metrics.count('genre_source', source='lastfm')
+        lines = metrics.to_prometheus().splitlines()
+        self.assertIn('# TYPE autogenre_stage_seconds histogram', lines)
+        self.assertIn('autogenre_stage_seconds_bucket{stage="lastfm",le="0.01"} 0', lines)
+        self.assertIn('autogenre_stage_seconds_bucket{stage="lastfm",le="0.05"} 1', lines)
+        self.assertIn('autogenre_stage_seconds_bucket{stage="lastfm",le="+Inf"} 2', lines)
+        self.assertIn('autogenre_stage_seconds_count{stage="lastfm"} 2', lines)
+        self.assertIn('# TYPE autogenre_genre_source_total counter', lines)
+        self.assertIn('autogenre_genre_source_total{source="lastfm"} 1', lines)
+
+    def test_write(self):
+        metrics = Metrics()
+        metrics.count('analyses', 3)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'metrics.json')
+            metrics.write(path)
+            with open(path) as f:
+                self.assertEqual(json.load(f)['counters'][0]['value'], 3)
+            path = os.path.join(tmpdir, 'autogenre.prom')
+            metrics.write(path)
+            with open(path) as f:
+                self.assertIn('autogenre_analyses_total 3\n', f.read())
@@ -0,0 +1,58 @@
+import os
+import tempfile
+import unittest
+from beets import logging
+from beets.library import Album, Item
+from beetsplug.autogenre.plan import PlanWriter, parse_shard, read_plans
+
+class TestPlan(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.log = logging.getLogger('test')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write_plan(self, name, items, analysis=()):
+        path = os.path.join(self.tmpdir.name, name)
+        plan = PlanWriter(path, self.log)
+        with plan:
+            for item in items:
+                plan.add(item)
+            plan.add(Album(id=1, genre='Rock'))
+            for item_id, values in analysis:
+                plan.add_analysis(item_id, values)
+        plan.close()
+        self.assertEqual(plan.stored, len(items))
+        return path
+
+    def test_read_plans(self):
+        plan1 = self.write_plan('1.jsonl', [
+            Item(id=1, genre='Rock', genres='Rock, Pop', genre_source='lastfm'),
+            Item(id=2, genre='Jazz', genres='Jazz', genre_source='lastfm', genre_fingerprint='f2'),
+        ], [(3, {'bpm': 120, 'genre_rosamerica': 'roc'})])
+        plan2 = self.write_plan('2.jsonl', [
+            Item(id=1, genre='Pop', genres='Pop', genre_source='title'),
+            Item(id=3, genre='Techno', genres='Techno', genre_source='essentia'),
+        ])
+        with open(plan2, 'a', encoding='utf-8') as f:
+            f.write('{"id":4,"genre":"Hou')
+        self.assertEqual(read_plans([plan1, plan2], self.log), {
+            1: {'genre': 'Pop', 'genres': 'Pop', 'source': 'title'},
+            2: {'genre': 'Jazz', 'genres': 'Jazz', 'source': 'lastfm', 'fingerprint': 'f2'},
+            3: {'genre': 'Techno', 'genres': 'Techno', 'source': 'essentia',
+                'analysis': {'bpm': 120, 'genre_rosamerica': 'roc'}},
+        })
+
+    def test_parse_shard(self):
+        testcases = [
+            ('1/1', (0, 1)),
+            ('1/4', (0, 4)),
+            ('4/4', (3, 4)),
+        ]
+        for value, expected in testcases:
+            self.assertEqual(parse_shard(value), expected)
+        for value in ('0/4', '5/4', '1/0', '1', 'a/b', '1/2/3'):
+            with self.assertRaises(ValueError, msg=value):
+                parse_shard(value)
@@ -0,0 +1,646 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+import pylast
+from confuse import Configuration
+from beets import config
+from beets.library import Item, Library
+from beets.dbcore.query import MatchQuery
+from beetsplug.autogenre import AutoGenrePlugin, _iter_items
+from beetsplug.autogenre.query import GenreSelectionQuery
+from beetsplug.autogenre.lastfm import LastfmError
+
+class PluginTestCase(unittest.TestCase):
+    '''Creates the plugin using a temporary library directory and a small
+    genre tree and whitelist.'''
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.tree_file = self.write_file('tree.yaml', '- rock:\n  - indie rock\n- electronic:\n  - house\n')
+        self.whitelist_file = self.write_file('whitelist.txt', 'rock\nindie rock\nelectronic\nhouse\n')
+        config.clear()
+        config.read(user=False, defaults=True)
+        config['plugins'] = ['autogenre', 'lastgenre', 'xtractor']
+        config['library'] = os.path.join(self.tmpdir.name, 'library.db')
+        config['lastgenre'] = {'whitelist': self.whitelist_file, 'canonical': self.tree_file}
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write_file(self, name, content):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def create_plugin(self, **settings):
+        plugin = AutoGenrePlugin()
+        plugin.config.set(settings)
+        return plugin
+
+class FakeLastfm:
+    '''Stands in for lastgenre's pylast network, returning the given top
+    tags or raising the given exception per artist.'''
+
+    def __init__(self, artists):
+        self.artists = artists
+        self.requests = []
+
+    def get_artist(self, artist):
+        return FakeEntity(self, artist)
+
+class FakeEntity:
+
+    def __init__(self, network, artist):
+        self._network = network
+        self._artist = artist
+
+    def get_top_tags(self):
+        self._network.requests.append(self._artist)
+        tags = self._network.artists.get(self._artist, [])
+        if isinstance(tags, Exception):
+            raise tags
+        return [pylast.TopItem(pylast.Tag(name, None), weight) for name, weight in tags]
+
+class TestLastfmLookup(PluginTestCase):
+
+    def test_errors_are_not_cached(self):
+        network = FakeLastfm({
+            'Found': [('Indie Rock', 100)],
+            'Unknown': pylast.WSError(None, '6', 'The artist you supplied could not be found'),
+            'Limited': pylast.WSError(None, '29', 'Rate limit exceeded'),
+            'Offline': pylast.NetworkError(None, 'connection refused'),
+            'Malformed': ValueError('unexpected response'),
+        })
+        testcases = [
+            ('Found', 'Indie Rock', True),
+            ('Unknown', None, True),
+            ('Limited', None, False),
+            ('Offline', None, False),
+            ('Malformed', None, False),
+        ]
+        with mock.patch('beetsplug.lastgenre.LASTFM', network):
+            plugin = self.create_plugin(cache=True)
+            for artist, genre, cached in testcases:
+                with self.subTest(artist=artist):
+                    self.assertEqual(plugin._lastfm_lookup('artist', artist), genre)
+                    self.assertEqual(plugin._lastfm_cache().get(('artist', artist)), (cached, genre))
+            plugin._close_cache()
+        with self.assertRaises(LastfmError):
+            with mock.patch('beetsplug.lastgenre.LASTFM', network):
+                plugin._pylast_top_tags('artist', 'Limited')
+
+    def test_cache_scope_covers_whitelist_content(self):
+        plugin = self.create_plugin(cache=True)
+        plugin._lastfm_cache().set(('artist', 'Artist'), 'Rock')
+        plugin._close_cache()
+        self.assertEqual(plugin._lastfm_cache().get(('artist', 'Artist')), (True, 'Rock'))
+        plugin._close_cache()
+        # Editing the whitelist in place invalidates the cached genres
+        self.write_file('whitelist.txt', 'rock\nelectronic\n')
+        plugin = self.create_plugin(cache=True)
+        self.assertEqual(plugin._lastfm_cache().get(('artist', 'Artist')), (False, None))
+        plugin._close_cache()
+
+class FakeLastGenre:
+    '''Stands in for the LastGenrePlugin instance.'''
+
+    SOURCES = {
+        'track': ('track', 'album', 'artist'),
+        'album': ('album', 'artist'),
+        'artist': ('artist',),
+    }
+
+    def __init__(self, source='album', force=True, fallback=None):
+        self.config = Configuration('lastgenre', read=False)
+        self.config.set({'source': source, 'force': force, 'fallback': fallback})
+        self.sources = self.SOURCES[source]
+
+    def _is_allowed(self, genre):
+        return genre in ('Rock', 'House')
+
+    def _resolve_genres(self, tags):
+        return ', '.join(tag.title() for tag in tags if self._is_allowed(tag.title())) or None
+
+class TestLastfmItemGenre(PluginTestCase):
+
+    def create_plugin(self, genres=None, **lastgenre):
+        plugin = super().create_plugin()
+        plugin._lastgenre_plugin = FakeLastGenre(**lastgenre)
+        lookups = []
+        def lookup(entity, *args):
+            lookups.append(entity)
+            return (genres or {}).get(entity)
+        plugin._lastfm_lookup = lookup
+        return plugin, lookups
+
+    def test_lookup_order(self):
+        item = Item(artist='Artist', albumartist='Album Artist', album='Album', title='Title')
+        remix = Item(artist='Artist', albumartist='Album Artist', album='Album', title='Title (Club Remix)')
+        testcases = [
+            ('track', item, ['track', 'album', 'artist']),
+            ('album', item, ['album', 'artist']),
+            ('artist', item, ['artist']),
+            # Remixes are looked up by track first, regardless of the source
+            ('track', remix, ['track', 'album', 'artist']),
+            ('album', remix, ['track', 'album', 'artist']),
+            ('artist', remix, ['track', 'album', 'artist']),
+        ]
+        for source, item, expected in testcases:
+            with self.subTest(source=source, title=item.title):
+                plugin, lookups = self.create_plugin(source=source)
+                self.assertEqual(plugin._lastfm_item_genre(item), (None, None))
+                self.assertEqual(lookups, expected)
+
+    def test_first_found_genre(self):
+        item = Item(artist='Artist', albumartist='Artist', album='Album', title='Title')
+        testcases = [
+            ({'track': 'House', 'album': 'Rock'}, ('House', 'track')),
+            ({'album': 'Rock', 'artist': 'House'}, ('Rock', 'album')),
+            ({'artist': 'House'}, ('House', 'artist')),
+        ]
+        for genres, expected in testcases:
+            with self.subTest(genres=genres):
+                plugin, _ = self.create_plugin(genres, source='track')
+                self.assertEqual(plugin._lastfm_item_genre(item), expected)
+
+    def test_keep_original_fallback(self):
+        testcases = [
+            # force: no keeps an allowed genre without looking it up
+            ({'force': False}, 'Rock', ('Rock', 'keep'), []),
+            # Genres that are not allowed are neither kept nor used as original
+            ({'force': False}, 'Jazz', (None, None), ['album', 'artist']),
+            ({'force': True}, 'Rock', ('Rock', 'original'), ['album', 'artist']),
+            ({'force': True, 'fallback': 'House'}, '', ('House', 'fallback'), ['album', 'artist']),
+            ({'force': True, 'fallback': 'House'}, 'rock', ('Rock', 'original'), ['album', 'artist']),
+        ]
+        for lastgenre, genre, expected, expected_lookups in testcases:
+            with self.subTest(lastgenre=lastgenre, genre=genre):
+                plugin, lookups = self.create_plugin(**lastgenre)
+                item = Item(artist='Artist', albumartist='Artist', album='Album', title='Title', genre=genre)
+                self.assertEqual(plugin._lastfm_item_genre(item), expected)
+                self.assertEqual(lookups, expected_lookups)
+
+class TestEvaluateItems(PluginTestCase):
+
+    def test_results_in_input_order(self):
+        items = [Item(id=i, title='Title {}'.format(i), album_id=i // 3 or None, genre='') for i in range(1, 30)]
+        testcases = [
+            (1, None),
+            (4, None),
+            (4, lambda item: item.album_id or -item.id),
+        ]
+        for workers, group_key in testcases:
+            with self.subTest(workers=workers, grouped=group_key is not None):
+                plugin = self.create_plugin(workers=workers, lastgenre=False)
+                def item_genre(item, all, force, force_genre, analyze):
+                    # Let later items finish first
+                    time.sleep(0.002 * (30 - item.id) / 30)
+                    return item.title, (item.title,), 'title'
+                plugin._item_genre = item_genre
+                results = plugin._evaluate_items(items, True, True, None, group_key)
+                self.assertEqual(results, [(item.title, (item.title,), 'title') for item in items])
+
+    def test_group_albums(self):
+        config['import']['write'] = False
+        lib = Library(config['library'].as_filename(), self.tmpdir.name)
+        albums = {1: [], 2: []}
+        for i, (album, genre) in enumerate([(1, 'House'), (2, 'Rock'), (1, 'House'), (2, 'Rock'), (1, 'Rock'), (None, 'Indie Rock')]):
+            item = Item(title='Song [{}]'.format(genre), artist='Artist', genre='', path='song{}.mp3'.format(i).encode('utf-8'))
+            lib.add(item)
+            if album:
+                albums[album].append(item)
+        for items in albums.values():
+            lib.add_album(items)
+        plugin = self.create_plugin(lastgenre=False, xtractor=False, group_albums=True, batch_size=2)
+        chunks = []
+        evaluate_items = plugin._evaluate_items
+        def evaluate(items, *args):
+            chunks.append([item.id for item in items])
+            return evaluate_items(items, *args)
+        plugin._evaluate_items = evaluate
+        cmd = plugin.commands()[0]
+        opts, args = cmd.parser.parse_args([])
+        cmd.func(lib, opts, args)
+        # The items of an album are evaluated together, followed by the singletons
+        self.assertEqual(chunks, [[1, 3, 5], [2, 4], [6]])
+        for album_id, genre in [(1, 'House'), (2, 'Rock')]:
+            with self.subTest(album=album_id):
+                album = lib.get_album(album_id)
+                self.assertEqual(album.genre, genre)
+                self.assertEqual([item.genre for item in album.items()], [genre] * len(album.items()))
+        self.assertEqual(lib.get_item(6).genre, 'Indie Rock')
+        lib._close()
+
+class TestAnalysis(PluginTestCase):
+
+    def test_sparse_analyses_run_in_parallel(self):
+        config['import']['write'] = False
+        lib = Library(config['library'].as_filename(), self.tmpdir.name)
+        # Every 10th item needs to be analyzed, the others' genre is found within the title
+        for i in range(1, 41):
+            item = Item(title='Song {}'.format(i), artist='Artist', genre='', path='song{}.mp3'.format(i).encode('utf-8'))
+            if i % 10 != 5:
+                item.update({'title': 'Song [House]', 'bpm': 120, 'genre_rosamerica': 'dan'})
+            lib.add(item)
+        plugin = self.create_plugin(batch_size=5, analysis_workers=4, reuse_xtractor_output=False)
+        # Fails unless the 4 analyses run concurrently
+        barrier = threading.Barrier(4, timeout=5)
+        def run_analysis(item):
+            barrier.wait()
+            rosamerica = item.id < 20 and 'roc' or 'dan'
+            item.update({'bpm': item.id, 'genre_rosamerica': rosamerica, 'genre_rosamerica_probability': 0.9,
+                'genre_electronic': 'house', 'genre_electronic_probability': 0.9})
+            item.store()
+        plugin._xtractor._run_analysis = run_analysis
+        cmd = plugin.commands()[0]
+        opts, args = cmd.parser.parse_args([])
+        with mock.patch('beetsplug.lastgenre.LASTFM', FakeLastfm({})):
+            cmd.func(lib, opts, args)
+        for item in lib.items():
+            with self.subTest(id=item.id):
+                if item.id % 10 == 5:
+                    genre = item.id < 20 and 'Rock' or 'House'
+                    self.assertEqual((item.genre, item.genre_source, item.bpm), (genre, 'essentia', item.id))
+                else:
+                    self.assertEqual((item.genre, item.genre_source), ('House', 'title'))
+        lib._close()
+
+class TestArtistIndex(PluginTestCase):
+
+    def setUp(self):
+        super().setUp()
+        config['import']['write'] = False
+        config['lastgenre'] = {'whitelist': self.whitelist_file, 'canonical': self.tree_file, 'source': 'artist'}
+        self.lib = Library(config['library'].as_filename(), self.tmpdir.name)
+        for artist, albumartist, genre in [
+            ('Band', 'Band', 'Rock'),
+            ('Band', 'Band', 'Rock'),
+            ('Band', 'Band', 'Rock'),
+            ('Guest 1', 'Various Artists', 'House'),
+            ('Guest 2', 'Various Artists', 'House'),
+            ('Guest 3', 'Various Artists', 'House'),
+        ]:
+            item = Item(title='Song', artist=artist, albumartist=albumartist, genre=genre, path=b'/song.mp3')
+            item.genre_source = 'lastfm'
+            self.lib.add(item)
+        for artist, albumartist in [('Band', 'Band'), ('Guest 4', 'Various Artists')]:
+            self.lib.add(Item(title='New', artist=artist, albumartist=albumartist, genre='', path=b'/new.mp3'))
+
+    def tearDown(self):
+        self.lib._close()
+        super().tearDown()
+
+    def run_command(self, *argv):
+        plugin = self.create_plugin(xtractor=False, artist_index=True)
+        cmd = plugin.commands()[0]
+        opts, args = cmd.parser.parse_args(list(argv))
+        network = FakeLastfm({'Band': [('Indie Rock', 100)]})
+        with mock.patch('beetsplug.lastgenre.LASTFM', network):
+            cmd.func(self.lib, opts, args)
+        return network.requests
+
+    def genres(self, query):
+        return [(item.genre, item.get('genre_source')) for item in self.lib.items(query)]
+
+    def test_library_genre(self):
+        # The album artist of compilations does not have a genre
+        self.assertEqual(self.run_command('title:New'), ['Guest 4'])
+        self.assertEqual(self.genres('title:New'), [('Rock', 'library'), ('', None)])
+
+    def test_own_genre_is_excluded(self):
+        # Without the item itself, Rock is set on 2 items only (min. 3),
+        # so that it is looked up on last.fm instead of keeping itself
+        self.assertEqual(self.run_command('-f', 'artist:Band', 'title:Song'), ['Band'])
+        self.assertEqual(self.genres('artist:Band title:Song'), [('Indie Rock', 'lastfm')] * 3)
+
+class TestDeferredImport(PluginTestCase):
+
+    def test_drain_queue(self):
+        config['import']['write'] = False
+        lib = Library(config['library'].as_filename(), self.tmpdir.name)
+        items = [Item(title='Song [{}]'.format(genre), artist='Artist', genre='', path='song{}.mp3'.format(i).encode('utf-8'))
+            for i, genre in enumerate(['House', 'House', 'Rock'])]
+        album = lib.add_album(items[:2])
+        lib.add(items[2])
+        plugin = self.create_plugin(lastgenre=False, xtractor=False, defer=True)
+        session = SimpleNamespace(lib=lib)
+        plugin.imported(session, SimpleNamespace(is_album=True, album=album))
+        plugin.imported(session, SimpleNamespace(is_album=False, item=items[2]))
+        queue = plugin._work_queue()
+        self.assertEqual([entry[1:] for entry in queue.entries(10)], [('album', 1), ('item', 3)])
+        queue.close()
+        self.assertEqual([item.genre for item in lib.items()], ['', '', ''])
+        cmd = plugin.commands()[0]
+        opts, args = cmd.parser.parse_args(['--drain-queue'])
+        cmd.func(lib, opts, args)
+        self.assertEqual([item.genre for item in lib.items()], ['House', 'House', 'Rock'])
+        self.assertEqual(lib.get_album(1).genre, 'House')
+        queue = plugin._work_queue()
+        self.assertEqual(len(queue), 0)
+        queue.close()
+        lib._close()
+
+class TestIterItems(PluginTestCase):
+
+    def setUp(self):
+        super().setUp()
+        config['import']['write'] = False
+        self.lib = Library(config['library'].as_filename(), self.tmpdir.name)
+        for i in range(1, 13):
+            self.lib.add(Item(title='Song [House]', artist='Artist', genre='', album_id=(i + 1) // 2,
+                path='song{}.mp3'.format(i).encode('utf-8')))
+        # A gap spanning a whole page
+        for item_id in (4, 5, 6):
+            self.lib.get_item(item_id).remove()
+
+    def tearDown(self):
+        self.lib._close()
+        super().tearDown()
+
+    def edit(self, item_id, **values):
+        item = self.lib.get_item(item_id)
+        item.update(values)
+        item.store()
+
+    def iter_ids(self, field, changes):
+        '''Returns the ids of the untagged items ordered by the given field,
+        applying the given changes while iterating the first page.'''
+        ids = []
+        for item in _iter_items(self.lib, MatchQuery('genre', ''), field):
+            ids.append(item.id)
+            if item.id == 2:
+                for item_id, values in changes.items():
+                    if values is None:
+                        self.lib.get_item(item_id).remove()
+                    else:
+                        self.edit(item_id, **values)
+        return ids
+
+    @mock.patch('beetsplug.autogenre.PAGE_SIZE', 3)
+    def test_changes_between_pages(self):
+        # Item 8 is removed and item 10 no longer matches
+        self.assertEqual(self.iter_ids('id', {8: None, 10: {'genre': 'Rock'}}), [1, 2, 3, 7, 9, 11, 12])
+
+    @mock.patch('beetsplug.autogenre.PAGE_SIZE', 3)
+    def test_resorted_between_pages(self):
+        # Item 7 moves from album 4 to album 6, item 9 is removed
+        self.assertEqual(self.iter_ids('album_id', {7: {'album_id': 6}, 9: None}), [1, 2, 3, 8, 10, 7, 11, 12])
+
+    @mock.patch('beetsplug.autogenre.PAGE_SIZE', 3)
+    def test_evaluated_once(self):
+        plugin = self.create_plugin(lastgenre=False, xtractor=False, batch_size=2)
+        evaluated = []
+        evaluate_items = plugin._evaluate_items
+        def evaluate(items, *args):
+            evaluated.extend(item.id for item in items)
+            return evaluate_items(items, *args)
+        plugin._evaluate_items = evaluate
+        cmd = plugin.commands()[0]
+        opts, args = cmd.parser.parse_args([])
+        cmd.func(self.lib, opts, args)
+        self.assertEqual(evaluated, [1, 2, 3, 7, 8, 9, 10, 11, 12])
+        self.assertEqual(set(item.genre for item in self.lib.items()), {'House'})
+        # The items no longer match the selection
+        self.assertEqual(list(_iter_items(self.lib, GenreSelectionQuery(False, False))), [])
+
+class TestIncremental(PluginTestCase):
+
+    def setUp(self):
+        super().setUp()
+        config['import']['write'] = False
+        self.lib = Library(config['library'].as_filename(), self.tmpdir.name)
+        for title, genre, source in [
+            ('Song [House]', '', None),
+            ('Song [Indie Rock]', 'Indie Rock', 'title'),
+            ('Song [Rock]', '', None),
+        ]:
+            item = Item(title=title, artist='Artist', genre=genre, path=title.encode('utf-8'))
+            if source:
+                item.genre_source = source
+            self.lib.add(item)
+
+    def tearDown(self):
+        self.lib._close()
+        super().tearDown()
+
+    def run_incremental(self, *argv, **settings):
+        '''Runs `beet autogenre -i` and returns the ids of the evaluated items.'''
+        plugin = self.create_plugin(lastgenre=False, xtractor=False, **settings)
+        evaluated = []
+        evaluate_items = plugin._evaluate_items
+        def evaluate(items, *args):
+            evaluated.extend(item.id for item in items)
+            return evaluate_items(items, *args)
+        plugin._evaluate_items = evaluate
+        cmd = plugin.commands()[0]
+        opts, args = cmd.parser.parse_args(['-i'] + list(argv))
+        cmd.func(self.lib, opts, args)
+        return evaluated
+
+    def test_incremental(self):
+        self.assertEqual(self.run_incremental(), [1, 2, 3])
+        # The fingerprint is stored also when the genre did not change
+        for item in self.lib.items():
+            self.assertTrue(item.get('genre_fingerprint'), item.title)
+        self.assertEqual(self.lib.get_item(2).genre, 'Indie Rock')
+        self.assertEqual(self.run_incremental(), [])
+
+        def edit(item_id, **values):
+            item = self.lib.get_item(item_id)
+            item.update(values)
+            item.store()
+        testcases = [
+            ('title', lambda: edit(1, title='Song [Rock]'), {}, [1]),
+            ('essentia', lambda: edit(3, bpm=128, genre_rosamerica='roc'), {}, [3]),
+            ('threshold', lambda: None, {'genre_rosamerica_strong': 0.7}, [1, 2, 3]),
+            ('unchanged', lambda: None, {'genre_rosamerica_strong': 0.7}, []),
+        ]
+        for name, change, settings, expected in testcases:
+            with self.subTest(change=name):
+                change()
+                self.assertEqual(self.run_incremental(**settings), expected)
+        self.assertEqual(self.lib.get_item(1).genre, 'Rock')
+
+    def test_specified_genre(self):
+        self.assertEqual(self.run_incremental(), [1, 2, 3])
+        # The genre is assigned although the fingerprint did not change
+        self.assertEqual(self.run_incremental('--genre=House', 'id:1'), [1])
+        item = self.lib.get_item(1)
+        self.assertEqual((item.genre, item.genre_source), ('House', 'user'))
+
+class TestPrioritize(PluginTestCase):
+
+    def setUp(self):
+        super().setUp()
+        config['import']['write'] = False
+        self.lib = Library(config['library'].as_filename(), self.tmpdir.name)
+        for genre, source in [
+            ('Rock', 'lastfm'),
+            ('', None),
+            ('House', 'essentia'),
+            ('', None),
+            ('Rock', 'essentia'),
+            ('House', 'lastfm'),
+            ('', None),
+        ]:
+            item = Item(title='Song [Indie Rock]', artist='Artist', genre=genre, path=b'/song.mp3')
+            if source:
+                item.genre_source = source
+            self.lib.add(item)
+
+    def tearDown(self):
+        self.lib._close()
+        super().tearDown()
+
+    def run_prioritized(self, *argv):
+        '''Runs `beet autogenre -a -f` with a budget of 2 items per run and
+        returns the ids of the evaluated items.'''
+        plugin = self.create_plugin(lastgenre=False, xtractor=False, prioritize=True, batch_size=2)
+        evaluated = []
+        evaluate_items = plugin._evaluate_items
+        def evaluate(items, *args):
+            evaluated.extend(item.id for item in items)
+            return evaluate_items(items, *args)
+        plugin._evaluate_items = evaluate
+        cmd = plugin.commands()[0]
+        opts, args = cmd.parser.parse_args(['-a', '-f', '--max-items=2'] + list(argv))
+        cmd.func(self.lib, opts, args)
+        return evaluated
+
+    def test_resume(self):
+        runs = [self.run_prioritized()]
+        runs += [self.run_prioritized('--resume') for _ in range(3)]
+        # Untagged items first, then those tagged by Essentia, then the others.
+        # Items that match a later phase after their genre changed are skipped.
+        self.assertEqual(runs, [[2, 4], [7, 3], [5, 1], [6]])
+        for item in self.lib.items():
+            self.assertEqual((item.genre, item.genre_source), ('Indie Rock', 'title'))
+        # The checkpoint has been removed after the last item, so the next
+        # run starts over (all items have a genre by now)
+        self.assertEqual(self.run_prioritized('--resume'), [1, 2])
+
+class TestDeferredWrites(PluginTestCase):
+
+    def test_mtime_is_stored(self):
+        config['import']['write'] = True
+        lib = Library(config['library'].as_filename(), self.tmpdir.name)
+        for i in range(3):
+            lib.add(Item(title='Song {}'.format(i), artist='Artist', genre='', path=b'/song.mp3'))
+        def write(item):
+            item.mtime = 1000 + item.id
+        plugin = self.create_plugin(lastgenre=False, xtractor=False, deferred_writes=True, batch_size=2)
+        cmd = plugin.commands()[0]
+        opts, args = cmd.parser.parse_args(['--genre=House', 'artist:Artist'])
+        with mock.patch.object(Item, 'write', write):
+            cmd.func(lib, opts, args)
+        self.assertEqual([(item.genre, item.mtime) for item in lib.items()],
+            [('House', 1001), ('House', 1002), ('House', 1003)])
+        lib._close()
+
+class TestPlan(PluginTestCase):
+
+    def setUp(self):
+        super().setUp()
+        config['import']['write'] = False
+        config['lastgenre'] = {'whitelist': self.whitelist_file, 'canonical': self.tree_file, 'source': 'artist'}
+        self.libdir = os.path.join(self.tmpdir.name, 'library')
+        os.mkdir(self.libdir)
+        config['library'] = os.path.join(self.libdir, 'library.db')
+        lib = self.open_library()
+        items = [Item(title='Song {}'.format(i), artist='Artist {}'.format(i % 3 if i < 7 else 2), genre='',
+            path='song{}.mp3'.format(i).encode('utf-8')) for i in range(1, 10)]
+        for item in items[:6]:
+            lib.add(item)
+        lib.add_album(items[6:])
+        lib._close()
+        # The items of Artist 2 are analyzed using Essentia
+        self.output = FakeXtractorOutput()
+        self.network = FakeLastfm({'Artist 0': [('House', 100)], 'Artist 1': [('Indie Rock', 100)]})
+
+    def open_library(self):
+        return Library(config['library'].as_filename(), self.libdir)
+
+    def run_command(self, lib, *argv, **settings):
+        plugin = self.create_plugin(**settings)
+        plugin._analyze_items = self.output.analyze
+        plugin._get_xtractor_output = lambda: self.output
+        cmd = plugin.commands()[0]
+        opts, args = cmd.parser.parse_args(list(argv))
+        with mock.patch('beetsplug.lastgenre.LASTFM', self.network):
+            cmd.func(lib, opts, args)
+
+    def read_records(self, *plans):
+        records = []
+        for plan in plans:
+            with open(plan, encoding='utf-8') as f:
+                records.extend(json.loads(line) for line in f)
+        return records
+
+    @unittest.skipIf(os.name != 'posix' or os.geteuid() == 0, 'requires a read-only directory')
+    def test_read_only_library(self):
+        plan = os.path.join(self.tmpdir.name, 'plan.jsonl')
+        os.chmod(self.libdir, 0o555)
+        try:
+            lib = self.open_library()
+            self.run_command(lib, '--plan', plan, cache=True)
+            lib._close()
+        finally:
+            os.chmod(self.libdir, 0o755)
+        self.assertEqual(os.listdir(self.libdir), ['library.db'])
+        records = self.read_records(plan)
+        self.assertEqual(sorted(r['id'] for r in records if 'genre' in r), list(range(1, 10)))
+
+    def test_apply_shard_plans(self):
+        plans = [os.path.join(self.tmpdir.name, 'shard{}.jsonl'.format(i)) for i in (1, 2)]
+        lib = self.open_library()
+        for i, plan in enumerate(plans, 1):
+            self.run_command(lib, '--shard', '{}/2'.format(i), '--plan', plan)
+            # The library is not changed while planning
+            self.assertEqual([item.genre for item in lib.items()], [''] * 9)
+        self.assertEqual(sorted(self.output.analyzed), [2, 5, 7, 8, 9])
+        # Each item's changes are planned exactly once
+        records = self.read_records(*plans)
+        self.assertEqual(sorted(r['id'] for r in records if 'genre' in r), list(range(1, 10)))
+        self.assertEqual(sorted(r['id'] for r in records if 'analysis' in r), [2, 5, 7, 8, 9])
+        self.run_command(lib, '--apply-plan', plans[0], '--apply-plan', plans[1])
+        genres = {'Artist 0': 'House', 'Artist 1': 'Indie Rock', 'Artist 2': 'Rock'}
+        for item in lib.items():
+            with self.subTest(id=item.id):
+                self.assertEqual(item.genre, genres[item.artist])
+                self.assertEqual(item.get('bpm'), 120 if item.artist == 'Artist 2' else 0)
+        self.assertEqual(lib.get_album(1).genre, 'Rock')
+        lib._close()
+
+class FakeXtractorOutput:
+    '''Stands in for the analysis using xtractor and its output directory,
+    classifying each analyzed item as rock.'''
+
+    VALUES = {'bpm': 120, 'genre_rosamerica': 'roc', 'genre_rosamerica_probability': 0.9}
+
+    def __init__(self):
+        self.analyzed = []
+
+    def analyze(self, items):
+        self.analyzed.extend(item.id for item in items)
+
+    def load(self, item):
+        return dict(self.VALUES) if item.id in self.analyzed else {}
+
+    def rescan(self):
+        pass
+
+class TestGenreTreeCache(PluginTestCase):
+
+    def test_cached_tree_does_not_create_lastgenre(self):
+        self.assertTrue(self.create_plugin()._genres().contains('indie rock'))
+        # The cached tree is loaded without creating a LastGenrePlugin,
+        # which would parse the genre tree
+        plugin = self.create_plugin()
+        self.assertTrue(plugin._genres().contains('indie rock'))
+        self.assertIsNone(plugin._lastgenre_plugin)
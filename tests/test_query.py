@@ -0,0 +1,121 @@
+import unittest
+from beets.dbcore.query import FixedFieldSort
+from beets.library import Item, Library
+from beetsplug.autogenre.query import PRIORITIES, GenreSelectionQuery, PriorityQuery, ShardQuery, filter_item
+
+class TestGenreSelectionQuery(unittest.TestCase):
+
+    def setUp(self):
+        self.lib = Library(':memory:')
+        items = [
+            ('empty', '', None),
+            ('empty with source', '', 'custom'),
+            ('lastfm', 'Rock', 'lastfm'),
+            ('user', 'Jazz', 'user'),
+            ('unspecified', 'Pop', None),
+            ('empty source', 'Pop', ''),
+            ('custom', 'House', 'custom'),
+        ]
+        for title, genre, source in items:
+            item = Item(title=title, genre=genre, path=title.encode('utf-8'))
+            if source is not None:
+                item.genre_source = source
+            self.lib.add(item)
+
+    def tearDown(self):
+        self.lib._close()
+
+    def test_query(self):
+        testcases = [
+            {
+                'all': False,
+                'force': False,
+                'expected': ['empty', 'empty with source'],
+            },
+            {
+                'all': True,
+                'force': False,
+                'expected': ['empty', 'empty with source'],
+            },
+            {
+                'all': False,
+                'force': True,
+                'expected': ['empty', 'empty with source', 'lastfm', 'user'],
+            },
+            {
+                'all': True,
+                'force': True,
+                'expected': ['empty', 'empty with source', 'lastfm', 'user', 'unspecified', 'empty source'],
+            },
+        ]
+        for c in testcases:
+            info = '\ntest case all={} force={}'.format(c['all'], c['force'])
+            query = GenreSelectionQuery(c['all'], c['force'])
+            self.assertIsNotNone(query.clause()[0])
+            a = [item.title for item in self.lib.items(query, FixedFieldSort('id'))]
+            self.assertEqual(a, c['expected'], info)
+            a = [item.title for item in self.lib.items() if filter_item(item, c['all'], c['force'])]
+            self.assertEqual(a, c['expected'], info)
+
+class TestShardQuery(unittest.TestCase):
+
+    def setUp(self):
+        self.lib = Library(':memory:')
+        for a in range(4):
+            items = [Item(title='{}-{}'.format(a, t), path='/{}/{}'.format(a, t).encode('utf-8')) for t in range(3)]
+            self.lib.add_album(items)
+        for s in range(3):
+            self.lib.add(Item(title='single {}'.format(s), path='/s/{}'.format(s).encode('utf-8')))
+
+    def tearDown(self):
+        self.lib._close()
+
+    def test_query(self):
+        shards = []
+        for index in range(3):
+            query = ShardQuery(index, 3)
+            ids = [item.id for item in self.lib.items(query, FixedFieldSort('id'))]
+            self.assertEqual(ids, [item.id for item in self.lib.items() if query.match(item)])
+            shards.append(ids)
+        # Each item belongs to exactly one shard
+        all_ids = sorted(item.id for item in self.lib.items())
+        self.assertEqual(sorted(i for ids in shards for i in ids), all_ids)
+        # The items of an album belong to the same shard
+        for album in self.lib.albums():
+            album_shards = {n for n, ids in enumerate(shards) for item in album.items() if item.id in ids}
+            self.assertEqual(len(album_shards), 1)
+
+class TestPriorityQuery(unittest.TestCase):
+
+    def setUp(self):
+        self.lib = Library(':memory:')
+        items = [
+            ('empty', '', None),
+            ('empty essentia', '', 'essentia'),
+            ('essentia', 'Techno', 'essentia'),
+            ('lastfm', 'Rock', 'lastfm'),
+            ('unspecified', 'Pop', None),
+        ]
+        for title, genre, source in items:
+            item = Item(title=title, genre=genre, path=title.encode('utf-8'))
+            if source is not None:
+                item.genre_source = source
+            self.lib.add(item)
+
+    def tearDown(self):
+        self.lib._close()
+
+    def test_query(self):
+        testcases = [
+            ('untagged', ['empty', 'empty essentia']),
+            ('essentia', ['essentia']),
+            ('other', ['lastfm', 'unspecified']),
+        ]
+        self.assertEqual(tuple(c[0] for c in testcases), PRIORITIES)
+        for priority, expected in testcases:
+            with self.subTest(priority=priority):
+                query = PriorityQuery(priority)
+                a = [item.title for item in self.lib.items(query, FixedFieldSort('id'))]
+                self.assertEqual(a, expected)
+                a = [item.title for item in self.lib.items() if query.match(item)]
+                self.assertEqual(a, expected)
@@ -0,0 +1,34 @@
+import os
+import tempfile
+import unittest
+from beetsplug.autogenre.workqueue import WorkQueue
+
+class TestWorkQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'queue.db')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_put_entries_remove(self):
+        testee = WorkQueue(self.path)
+        testee.put('album', [3])
+        testee.put('item', [7, 8])
+        testee.put('album', [3])
+        self.assertEqual(len(testee), 3)
+        entries = testee.entries(2)
+        self.assertEqual([e[1:] for e in entries], [('album', 3), ('item', 7)])
+        self.assertEqual([e[1:] for e in testee.entries(2, entries[-1][0])], [('item', 8)])
+        testee.remove(entries)
+        self.assertEqual([e[1:] for e in testee.entries(10)], [('item', 8)])
+        testee.close()
+
+    def test_persistence(self):
+        testee = WorkQueue(self.path)
+        testee.put('item', [1])
+        testee.close()
+        testee = WorkQueue(self.path)
+        self.assertEqual([e[1:] for e in testee.entries(10)], [('item', 1)])
+        testee.close()
@@ -0,0 +1,45 @@
+import os
+import tempfile
+import unittest
+from beets import logging
+from beets.library import WriteError
+from beetsplug.autogenre.writer import TagWriter
+
+class FakeItem:
+    def __init__(self, path, failures):
+        self.path = path
+        self.failures = failures
+        self.writes = 0
+
+    def write(self):
+        self.writes += 1
+        if self.writes <= self.failures:
+            raise WriteError(self.path, 'device busy')
+
+class TestTagWriter(unittest.TestCase):
+
+    def test_flush(self):
+        testee = TagWriter(4, 2, logging.getLogger('test'), backoff=0)
+        path = __file__.encode('utf-8')
+        items = [
+            FakeItem(path, 0),
+            FakeItem(path, 2),
+            FakeItem(path, 3),
+            FakeItem(b'/nonexistent/missing.flac', 1),
+        ]
+        for item in items:
+            testee.add(item)
+        self.assertEqual(len(testee), 4)
+        self.assertEqual(testee.flush(), items[:2])
+        self.assertEqual(len(testee), 0)
+        # Retried up to 2 times unless the file does not exist
+        self.assertEqual([item.writes for item in items], [1, 3, 3, 1])
+        self.assertEqual(testee.written, 2)
+        self.assertEqual([f[0] for f in testee.failures], [__file__, '/nonexistent/missing.flac'])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            report = os.path.join(tmpdir, 'report.txt')
+            testee.write_report(report)
+            with open(report, encoding='utf-8') as f:
+                lines = f.read().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].startswith('/nonexistent/missing.flac\t'))
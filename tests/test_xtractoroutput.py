@@ -0,0 +1,82 @@
+import hashlib
+import json
+import os
+import tempfile
+import unittest
+from confuse import Configuration
+from beets.library import Item
+from beetsplug.autogenre.xtractoroutput import XtractorOutput
+
+TARGETS = {
+    'low_level_targets': {
+        'bpm': {'path': 'rhythm.bpm', 'type': 'integer'},
+        'average_loudness': {'path': 'lowlevel.average_loudness', 'type': 'float'},
+    },
+    'high_level_targets': {
+        'genre_rosamerica': {'path': 'highlevel.genre_rosamerica.value', 'type': 'string'},
+        'genre_rosamerica_probability': {'path': 'highlevel.genre_rosamerica.probability', 'type': 'float'},
+        'genre_electronic': {'path': 'highlevel.genre_electronic.value', 'type': 'string'},
+    },
+}
+
+OUTPUT = {
+    'lowlevel': {'average_loudness': 0.9, 'spectral': [0.1] * 100},
+    # Nested key named like a top-level section
+    'metadata': {'tags': {'highlevel': {'genre_rosamerica': 'jaz'}}},
+    'rhythm': {'bpm': 127.6, 'beats_position': [0.5, 1.0]},
+    'highlevel': {
+        'genre_rosamerica': {'value': 'roc', 'probability': 0.93},
+        'genre_electronic': {'value': 'house', 'probability': 0.4},
+    },
+}
+
+class TestXtractorOutput(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        config = Configuration('test', read=False)
+        config.set(TARGETS)
+        fields = ('bpm', 'genre_rosamerica', 'genre_rosamerica_probability', 'genre_electronic')
+        self.testee = XtractorOutput.from_config(config, self.tmpdir.name, fields)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write_output(self, name, text):
+        with open(os.path.join(self.tmpdir.name, name), 'w', encoding='utf-8') as f:
+            f.write(text)
+
+    def test_load(self):
+        by_path = Item(path=b'/music/a.flac')
+        by_trackid = Item(path=b'/other/host/b.flac', mb_trackid='0f0e')
+        missing = Item(path=b'/music/c.flac', mb_trackid='1a2b')
+        self.write_output(hashlib.md5(b'/music/a.flac').hexdigest() + '.json', json.dumps(OUTPUT, indent=4))
+        self.write_output('0f0e.json', json.dumps(OUTPUT))
+        expected = {
+            'bpm': 128,
+            'genre_rosamerica': 'roc',
+            'genre_rosamerica_probability': 0.93,
+            'genre_electronic': 'house',
+        }
+        testcases = [
+            (by_path, expected),
+            (by_trackid, expected),
+            (missing, {}),
+        ]
+        for item, values in testcases:
+            with self.subTest(path=item.path):
+                self.assertEqual(self.testee.load(item), values)
+
+    def test_partial_output(self):
+        item = Item(path=b'/music/a.flac', mb_trackid='0f0e')
+        testcases = [
+            # No highlevel section: falls back to decoding the whole document
+            ({'rhythm': {'bpm': 90}}, {'bpm': 90}),
+            ({'rhythm': {'bpm': 90}, 'highlevel': {'genre_electronic': {'value': 'trance'}}},
+                {'bpm': 90, 'genre_electronic': 'trance'}),
+            ('{"rhythm": {"bpm": ', {}),
+        ]
+        for output, values in testcases:
+            with self.subTest(output=output):
+                self.write_output('0f0e.json', output if isinstance(output, str) else json.dumps(output))
+                self.assertEqual(self.testee.load(item), values)